@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+#
+#  Camera Capabilities
+#
+#  Copyright (C) 2021-2024 JetsonHacks (info@jetsonhacks.com)
+#
+#  MIT License
+#
+#  Enumeration benchmark
+#  Builds a synthetic sysfs tree with many USB cameras and Tegra capture nodes,
+#  along with the v4l2-ctl --list-devices output a machine like that would print,
+#  then times Sysfs_Enumerator against parsing that output. The enumerated cameras
+#  are checked against the parsed ones: same names, bus addresses and nodes, with
+#  the Tegra nodes left to v4l2-ctl. A mismatch makes the run exit with status 1.
+#  The v4l2-ctl time itself, which opens every node, is not part of the comparison.
+#
+#  Usage:
+#    python3 benchmarks/enumeration_benchmark.py
+#    python3 benchmarks/enumeration_benchmark.py --usb-cameras 300 --nodes-per-camera 4
+#
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from camera_caps_model import Camera_Inspector  # noqa: E402
+from camera_caps_sysfs import Sysfs_Enumerator  # noqa: E402
+
+
+def write_attribute(path: str, value: str):
+    with open(path, 'w') as attribute_file:
+        attribute_file.write(value + "\n")
+
+
+def add_node(sysfs_root: str, device_dir: str, node_number: int, name: str, index: int):
+    """ /sys/devices/.../video4linux/videoN and its /sys/class/video4linux link """
+    node_name = f"video{node_number}"
+    node_dir = os.path.join(device_dir, 'video4linux', node_name)
+    os.makedirs(node_dir)
+    write_attribute(os.path.join(node_dir, 'name'), name)
+    write_attribute(os.path.join(node_dir, 'index'), str(index))
+    os.symlink(os.path.relpath(device_dir, node_dir), os.path.join(node_dir, 'device'))
+    class_dir = os.path.join(sysfs_root, 'class', 'video4linux')
+    os.symlink(os.path.relpath(node_dir, class_dir), os.path.join(class_dir, node_name))
+
+
+def build_tree(sysfs_root: str, usb_cameras: int, nodes_per_camera: int, tegra_nodes: int) -> str:
+    """ Populate sysfs_root; return the matching v4l2-ctl --list-devices output """
+    os.makedirs(os.path.join(sysfs_root, 'class', 'video4linux'))
+    platform_dir = os.path.join(sysfs_root, 'devices', 'platform')
+    controller = '3610000.xhci'
+    entries = []
+    node_number = 0
+    for camera_index in range(usb_cameras):
+        # Behind a chain of hubs: 1-2.1.3 has devpath 2.1.3
+        devpath = f"2.{camera_index // 100 + 1}.{camera_index % 100 + 1}"
+        device_dir = os.path.join(platform_dir, controller, 'usb1', '1-2', f"1-{devpath}")
+        os.makedirs(device_dir)
+        write_attribute(os.path.join(device_dir, 'idVendor'), '046d')
+        write_attribute(os.path.join(device_dir, 'devpath'), devpath)
+        interface_dir = os.path.join(device_dir, f"1-{devpath}:1.0")
+        os.makedirs(interface_dir)
+        name = f"Synthetic Webcam {camera_index}"
+        uris = []
+        for index in range(nodes_per_camera):
+            add_node(sysfs_root, interface_dir, node_number, name, index)
+            uris.append(f"/dev/video{node_number}")
+            node_number += 1
+        entries.append(f"{name} (usb-{controller}-{devpath}):\n" + "".join(f"\t{uri}\n" for uri in uris))
+    tegra_dir = os.path.join(platform_dir, 'tegra-capture-vi')
+    os.makedirs(tegra_dir)
+    for channel in range(tegra_nodes):
+        name = f"vi-output, imx219 {channel + 9}-0010"
+        add_node(sysfs_root, tegra_dir, node_number, name, 0)
+        entries.append(f"{name} (platform:tegra-capture-vi:{channel}):\n\t/dev/video{node_number}\n")
+        node_number += 1
+    return "\n".join(entries)
+
+
+class Text_Inspector(Camera_Inspector):
+    """ Answers --list-devices from recorded text instead of running v4l2-ctl """
+
+    def __init__(self, list_devices_text: str):
+        self.list_devices_text = list_devices_text
+
+    def run_v4l2_ctl(self, args, timeout=None):
+        return self.list_devices_text
+
+
+def check(enumerated: list, parsed: list) -> list:
+    """ Differences between the two camera lists, as messages """
+    described = lambda cameras: [(camera.camera_name, camera.bus_address, camera.uri_list) for camera in cameras]
+    enumerated, parsed = described(enumerated), described(parsed)
+    return [f"sysfs {got} != v4l2-ctl {expected}"
+            for got, expected in zip(enumerated, parsed) if got != expected] + \
+        ([f"sysfs found {len(enumerated)} cameras, v4l2-ctl {len(parsed)}"] if len(enumerated) != len(parsed) else [])
+
+
+def measure(function, repeat: int) -> float:
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Benchmark camera enumeration from sysfs')
+    parser.add_argument('--usb-cameras', type=int, default=200, help='USB cameras in the synthetic tree')
+    parser.add_argument('--nodes-per-camera', type=int, default=2, help='video nodes per USB camera')
+    parser.add_argument('--tegra-nodes', type=int, default=8, help='Tegra capture nodes, left to v4l2-ctl')
+    parser.add_argument('--repeat', type=int, default=5, help='timing samples per benchmark')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    with tempfile.TemporaryDirectory() as sysfs_root:
+        list_devices_text = build_tree(sysfs_root, args.usb_cameras, args.nodes_per_camera, args.tegra_nodes)
+        enumerator = Sysfs_Enumerator(sysfs_root)
+        inspector = Text_Inspector(list_devices_text)
+        inspector.device_enumerator = enumerator
+        nodes = args.usb_cameras * args.nodes_per_camera + args.tegra_nodes
+
+        errors = check(inspector.list_devices(), inspector.parse_devices(list_devices_text))
+        _, unresolved = enumerator.list_devices()
+        if len(unresolved) != args.tegra_nodes:
+            errors.append(f"{len(unresolved)} nodes left to v4l2-ctl, expected {args.tegra_nodes}")
+        for error in errors:
+            print(error)
+
+        timings = {
+            'sysfs enumeration': measure(enumerator.list_devices, args.repeat),
+            'sysfs + v4l2-ctl for the rest': measure(inspector.list_devices, args.repeat),
+            'parse --list-devices output': measure(lambda: inspector.parse_devices(list_devices_text), args.repeat),
+        }
+        print(f"{nodes} nodes, {args.usb_cameras} USB cameras, {args.tegra_nodes} Tegra nodes")
+        for name, seconds in timings.items():
+            print(f"{name:<32} {seconds * 1000:>8.2f} ms {seconds * 1e6 / nodes:>8.1f} us/node")
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
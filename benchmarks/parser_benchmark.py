@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+#
+#  Camera Capabilities
+#
+#  Copyright (C) 2021-2024 JetsonHacks (info@jetsonhacks.com)
+#
+#  MIT License
+#
+#  Parser benchmark
+#  Times the v4l2-ctl output parsers of Camera_Inspector over the recorded outputs
+#  in benchmarks/fixtures, plus a few generated devices far larger than any real
+#  camera, and reports the time and peak memory of each parse. Results are compared
+#  against parser_baseline.json; a parse that got slower or hungrier than the
+#  tolerance allows makes the run exit with status 1.
+#
+#  Each timing sample of a parse is paired with a sample of a fixed reference
+#  workload taken just before it, and the parse is compared by the median of its
+#  time relative to the reference. A machine that is busier, or clocked lower,
+#  than when the baseline was recorded slows both alike, so the ratio holds where
+#  the absolute microseconds would not. Parses under a millisecond are noisier
+#  still and are allowed twice the tolerance.
+#
+#  Fixtures:
+#    <name>.devices.txt   v4l2-ctl --list-devices
+#    <name>.report.txt    v4l2-ctl -d <node> --info --get-fmt-video --get-parm
+#                                  --list-formats-ext --list-ctrls-menus
+#
+#  Usage:
+#    python3 benchmarks/parser_benchmark.py                  compare against the baseline
+#    python3 benchmarks/parser_benchmark.py --save-baseline  record a new baseline
+#  Timings depend on the machine, so record the baseline on the machine that compares.
+#
+import argparse
+import glob
+import json
+import os
+import platform
+import statistics
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from camera_caps_model import Camera_Info, Camera_Inspector, Format_Catalogue  # noqa: E402
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_DIR = os.path.join(BENCHMARK_DIR, 'fixtures')
+BASELINE_PATH = os.path.join(BENCHMARK_DIR, 'parser_baseline.json')
+BASELINE_VERSION = 2
+# Parses faster than this are allowed twice the time tolerance
+SHORT_PARSE_SECONDS = 0.001
+# Each timing sample runs for about this long
+SAMPLE_SECONDS = 0.05
+
+
+def synthetic_report(name: str, formats: int, sizes: int, intervals: int, controls: int,
+                     stepwise: bool = False) -> str:
+    """ A device with far more formats, sizes and controls than real cameras have """
+    lines = ["Driver Info:",
+             "\tDriver name      : synthetic",
+             f"\tCard type        : {name}",
+             "\tBus info         : platform:synthetic",
+             "\tDriver version   : 6.1.0",
+             "\tCapabilities     : 0x84200001",
+             "\t\tVideo Capture",
+             "\t\tStreaming",
+             "\t\tExtended Pix Format",
+             "\t\tDevice Capabilities",
+             "\tDevice Caps      : 0x04200001",
+             "\t\tVideo Capture",
+             "\t\tStreaming",
+             "\t\tExtended Pix Format",
+             "Format Video Capture:",
+             "\tWidth/Height      : 640/480",
+             "\tPixel Format      : 'F000' (Synthetic 0)",
+             "Streaming Parameters Video Capture:",
+             "\tCapabilities     : timeperframe",
+             "\tFrames per second: 30.000 (30/1)",
+             "ioctl: VIDIOC_ENUM_FMT",
+             "\tType: Video Capture",
+             ""]
+    for format_index in range(formats):
+        lines.append(f"\t[{format_index}]: 'F{format_index:03d}' (Synthetic {format_index})")
+        if stepwise:
+            lines.append("\t\tSize: Stepwise 16x16 - 8192x4320 with step 2/2")
+            continue
+        for size_index in range(sizes):
+            lines.append(f"\t\tSize: Discrete {16 + size_index * 8}x{16 + size_index * 4}")
+            for interval_index in range(intervals):
+                fps = 120 / (interval_index + 1)
+                lines.append(f"\t\t\tInterval: Discrete {1 / fps:.3f}s ({fps:.3f} fps)")
+    lines += ["", "User Controls", ""]
+    for control_index in range(controls):
+        name = f"control_{control_index}"
+        if control_index % 3 == 2:
+            lines.append(f"{name:>31} 0x{0x00980900 + control_index:08x} (menu)   : "
+                         f"min=0 max=3 default=0 value=1")
+            lines += [f"\t\t\t\t{entry}: Entry {entry}" for entry in range(4)]
+        else:
+            flags = " flags=inactive" if control_index % 5 == 0 else ""
+            lines.append(f"{name:>31} 0x{0x00980900 + control_index:08x} (int)    : "
+                         f"min=0 max=255 step=1 default=128 value=128{flags}")
+    return "\n".join(lines) + "\n"
+
+
+def load_fixtures() -> dict:
+    """ name -> (kind, text) for the recorded fixtures and the generated devices """
+    fixtures = {}
+    for path in sorted(glob.glob(os.path.join(FIXTURE_DIR, '*.txt'))):
+        name, kind, _ = os.path.basename(path).rsplit('.', 2)
+        with open(path, 'r', encoding='utf-8') as fixture_file:
+            fixtures[name] = (kind, fixture_file.read())
+    fixtures['synthetic_600_sizes'] = ('report', synthetic_report('synthetic_600_sizes', 3, 600, 4, 40))
+    fixtures['synthetic_stepwise'] = ('report', synthetic_report('synthetic_stepwise', 24, 0, 0, 40, True))
+    fixtures['synthetic_500_controls'] = ('report', synthetic_report('synthetic_500_controls', 1, 8, 2, 500))
+    return fixtures
+
+
+def parse_devices(inspector: Camera_Inspector, text: str) -> list:
+    return [inspector.parse_device(entry) for entry in inspector.parse_device_list(text)]
+
+
+def parse_catalogue(inspector: Camera_Inspector, formats_text: str) -> Format_Catalogue:
+    catalogue = Format_Catalogue(inspector.parse_camera_formats(formats_text))
+    for fourcc in catalogue.formats:
+        catalogue.frame_sizes(fourcc)
+    return catalogue
+
+
+def benchmarks_for(inspector: Camera_Inspector, kind: str, text: str) -> dict:
+    """ benchmark name -> callable, for one fixture """
+    if kind == 'devices':
+        return {'parse_device_list': lambda: parse_devices(inspector, text)}
+    sections = inspector.split_sections(text)
+    return {
+        'split_sections': lambda: inspector.split_sections(text),
+        'parse_camera_info': lambda: inspector.parse_camera_info(sections['info'], Camera_Info()),
+        'parse_camera_formats': lambda: inspector.parse_camera_formats(sections['formats']),
+        'format_catalogue': lambda: parse_catalogue(inspector, sections['formats']),
+        'parse_ctrl_menus': lambda: inspector.parse_ctrl_menus(sections['controls']),
+        'parse_inactive_ctrls': lambda: inspector.parse_inactive_ctrls(sections['controls']),
+        'parse_stream_settings': lambda: inspector.parse_stream_settings(sections['settings']),
+        'parse_camera_report': lambda: inspector.parse_camera_report('/dev/video0', text),
+    }
+
+
+def reference_workload():
+    """ Fixed string work like the parsers do, to time the parses against """
+    fields = {}
+    for index in range(200):
+        line = f"\tcontrol_{index:<24} 0x{index:08x} (int)    : min=0 max=255 value={index}"
+        name, _, values = line.strip().partition(' ')
+        fields[name] = dict(pair.split('=') for pair in values.split(':')[1].split())
+    return fields
+
+
+def calls_per_sample(timer: timeit.Timer) -> int:
+    """ Calls of timer's function that take about SAMPLE_SECONDS """
+    number, seconds = timer.autorange()
+    return max(1, round(number * SAMPLE_SECONDS / seconds))
+
+
+def measure(function, reference: timeit.Timer, reference_number: int, repeat: int) -> dict:
+    timer = timeit.Timer(function)
+    number = calls_per_sample(timer)
+    samples = []
+    ratios = []
+    for _ in range(repeat):
+        reference_seconds = reference.timeit(reference_number) / reference_number
+        seconds = timer.timeit(number) / number
+        samples.append(seconds)
+        ratios.append(seconds / reference_seconds)
+    tracemalloc.start()
+    try:
+        function()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'seconds': statistics.median(samples),
+            'relative': statistics.median(ratios),
+            'peak_bytes': peak_bytes}
+
+
+def run(filter_text: str, repeat: int) -> dict:
+    inspector = Camera_Inspector()
+    reference = timeit.Timer(reference_workload)
+    reference_number = calls_per_sample(reference)
+    results = {}
+    for name, (kind, text) in load_fixtures().items():
+        for benchmark, function in benchmarks_for(inspector, kind, text).items():
+            key = f"{name}/{benchmark}"
+            if filter_text and filter_text not in key:
+                continue
+            results[key] = measure(function, reference, reference_number, repeat)
+    return results
+
+
+def load_baseline(path: str) -> dict:
+    try:
+        with open(path, 'r', encoding='utf-8') as baseline_file:
+            contents = json.load(baseline_file)
+    except FileNotFoundError:
+        return {}
+    if contents.get('version') != BASELINE_VERSION:
+        print(f"Ignoring baseline {path}: version {contents.get('version')}")
+        return {}
+    return contents.get('results', {})
+
+
+def save_baseline(path: str, results: dict):
+    contents = {'version': BASELINE_VERSION,
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'results': results}
+    with open(path, 'w', encoding='utf-8') as baseline_file:
+        json.dump(contents, baseline_file, indent=1, sort_keys=True)
+        baseline_file.write("\n")
+
+
+def report(results: dict, baseline: dict, tolerance: float) -> list:
+    """ Print the results next to the baseline; return the keys that regressed """
+    regressions = []
+    print(f"{'benchmark':<52} {'time':>10} {'vs base':>8} {'peak KiB':>9} {'vs base':>8}")
+    for key, result in results.items():
+        previous = baseline.get(key)
+        time_change = ""
+        memory_change = ""
+        regressed = False
+        if previous is not None:
+            time_ratio = result['relative'] / previous['relative']
+            memory_ratio = result['peak_bytes'] / max(previous['peak_bytes'], 1)
+            time_change = f"{(time_ratio - 1) * 100:+.0f}%"
+            memory_change = f"{(memory_ratio - 1) * 100:+.0f}%"
+            time_tolerance = tolerance * 2 if previous['seconds'] < SHORT_PARSE_SECONDS else tolerance
+            regressed = time_ratio > 1 + time_tolerance or memory_ratio > 1 + tolerance
+        if regressed:
+            regressions.append(key)
+        print(f"{key:<52} {result['seconds'] * 1e6:>8.1f}us {time_change:>8} "
+              f"{result['peak_bytes'] / 1024:>9.1f} {memory_change:>8}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Benchmark the v4l2-ctl output parsers')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='record the results as the new baseline')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='baseline file')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed slowdown or memory growth before failing (0.25 = 25%%); '
+                             'twice that for parses under a millisecond')
+    parser.add_argument('--repeat', type=int, default=15, help='timing samples per benchmark')
+    parser.add_argument('--filter', default='', help='only run benchmarks whose name contains this')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    results = run(args.filter, args.repeat)
+    if args.save_baseline:
+        # Keep the entries a filtered run did not measure
+        baseline = load_baseline(args.baseline)
+        baseline.update(results)
+        save_baseline(args.baseline, baseline)
+        report(results, {}, args.tolerance)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+    regressions = report(results, load_baseline(args.baseline), args.tolerance)
+    if regressions:
+        print(f"{len(regressions)} benchmarks regressed by more than {args.tolerance:.0%}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+#
+#  Camera Capabilities
+#
+#  Copyright (C) 2021-2024 JetsonHacks (info@jetsonhacks.com)
+#
+#  MIT License
+#
+#  Region of interest crop benchmark
+#  Runs a raw 1080p stream through each crop strategy of roi_crop.py, cropped to
+#  the centre quarter of the frame, and reports frames per second and process CPU
+#  time per frame. The uncropped pipeline is the baseline; the extra CPU time over
+#  it is what the strategy costs. videotestsrc stands in for the camera, so the
+#  v4l2 strategy is measured as a capture that arrives at the region's size.
+#  Strategies whose elements are not installed (nvvidconv off Jetson) are skipped.
+#
+#  Usage:
+#    python3 benchmarks/roi_crop_benchmark.py
+#    python3 benchmarks/roi_crop_benchmark.py --sink xvimagesink --width 3840 --height 2160
+#
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gst_calibration import Gst_Runner  # noqa: E402
+from gst_loader import load_gst  # noqa: E402
+from gst_pipeline_builder import Gst_Element_Registry  # noqa: E402
+
+
+def strategy_pipelines(args) -> dict:
+    """ Strategy name -> (elements it needs, launch string) """
+    width, height = args.width, args.height
+    # The centre quarter of the frame
+    x, y, crop_width, crop_height = width // 4, height // 4, width // 2, height // 2
+    source = f"videotestsrc num-buffers={args.frames} pattern=ball ! video/x-raw, format={args.format}"
+    full = f"{source}, width={width}, height={height}, framerate={args.framerate}/1"
+    full_caps = f"video/x-raw, width={width}, height={height}"
+    videocrop = (f"videocrop name=cropper top={y} left={x} "
+                 f"bottom={height - y - crop_height} right={width - x - crop_width}")
+    sink = f"videoconvert ! {args.sink} sync=false"
+    return {
+        'none': ((), f"{full} ! {sink}"),
+        'v4l2': ((), f"{source}, width={crop_width}, height={crop_height}, framerate={args.framerate}/1 ! {sink}"),
+        'nvvidconv': (('nvvidconv',),
+                      f"{full} ! nvvidconv name=cropper left={x} top={y} right={x + crop_width} "
+                      f"bottom={y + crop_height} ! {full_caps} ! {sink}"),
+        'sink': (('videocrop',), f"{full} ! {videocrop} ! {sink}"),
+        'videoscale': (('videocrop', 'videoscale'), f"{full} ! {videocrop} ! videoscale ! {full_caps} ! {sink}"),
+    }
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Benchmark region of interest crop strategies')
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--framerate', type=int, default=60)
+    parser.add_argument('--format', default='YUY2', help='raw format of the stream (default YUY2)')
+    parser.add_argument('--frames', type=int, default=300, help='frames per run')
+    parser.add_argument('--sink', default='fakesink',
+                        help='fakesink measures the pipeline alone; xvimagesink includes the display')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per strategy; the lowest CPU time is kept')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    Gst = load_gst()
+    registry = Gst_Element_Registry(Gst)
+    runner = Gst_Runner(Gst)
+    results = {}
+    for name, (elements, launch) in strategy_pipelines(args).items():
+        if any(registry.rank(element) is None for element in elements + (args.sink,)):
+            print(f"{name:<11} skipped, not installed: {', '.join(elements + (args.sink,))}")
+            continue
+        runs = [runner.run(launch) for _ in range(args.repeat)]
+        errors = [error for _, _, error in runs if error]
+        if errors:
+            print(f"{name:<11} failed: {errors[0]}")
+            continue
+        results[name] = min(runs, key=lambda run: run[1])
+    if 'none' not in results:
+        return 1
+    baseline = results['none'][1] / args.frames
+    print(f"{args.width}x{args.height} {args.format}, centre quarter cropped, {args.frames} frames to {args.sink}")
+    for name, (seconds, cpu_seconds, _) in results.items():
+        cpu_per_frame = cpu_seconds / args.frames
+        print(f"{name:<11} {args.frames / seconds:>8.1f} fps {cpu_per_frame * 1000:>7.2f} ms CPU/frame "
+              f"{(cpu_per_frame - baseline) * 1000:>+7.2f} ms over uncropped")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,197 +7,92 @@
 #  MIT License
 #
 
+# First, so the profile starts before the other imports
+from startup_profile import startup_profile
+
+import argparse
 import sys
-from dataclasses import dataclass
-
-import gi
-gi.require_version('Gst', '1.0')
-gi.require_version('GstVideo', '1.0')
-from gi.repository import Gst
-from PyQt5.QtCore import QSize
-from PyQt5.QtGui import QIcon
-from PyQt5.QtWidgets import (QApplication, QComboBox, QFrame, QHBoxLayout,
-                             QLabel, QLayout, QLineEdit, QListWidget, QCheckBox,
-                             QMainWindow, QPushButton, QScrollArea,
-                             QSizePolicy, QVBoxLayout, QWidget)
-
-from camera_caps_controller import Camera_Caps_Controller
-from preview_window import PreviewWindow
-
-
-
-@dataclass
-class Camera_Caps_Config:
-    window_width: int = 640
-    window_height: int = 720
-    top_frame_height: int = 310
-
-window_configs = Camera_Caps_Config()
-
-class Camera_Caps_Window(QMainWindow):
-
-    def setup(self, controller):
-
-        self.ctrl_dict = {}  # Holds control groups accessed by v4l2 control name
-        top_frame = self.setup_top_frame(controller)
-        self.setCentralWidget(top_frame)
-        self.setGeometry(100, 100, window_configs.window_width,
-                         window_configs.window_height)
-        self.setWindowTitle('Camera Capabilities')
-
-    def setup_top_frame(self, controller):
-        main_frame = QFrame()
-        main_vbox = QVBoxLayout()
-        main_frame.setLayout(main_vbox)
-
-        top_frame = QFrame()
-        top_vbox = QVBoxLayout()
-        top_frame.setLayout(top_vbox)
-        top_frame.setMaximumHeight(window_configs.top_frame_height)
-
-        camera_box = QHBoxLayout()
-        camera_label = QLabel("Camera")
-        camera_label.setSizePolicy(QSizePolicy.Fixed, QSizePolicy.Fixed)
-        camera_box.addWidget(camera_label)
-
-        self.camera_combo_box = QComboBox(self)
-        self.camera_combo_box.setSizePolicy(
-            QSizePolicy.Fixed, QSizePolicy.Fixed)
-        self.camera_combo_box.currentIndexChanged.connect(
-            controller.on_camera_box_changed)
-        camera_box.addWidget(self.camera_combo_box)
-        camera_box.addStretch()
-        top_vbox.addLayout(camera_box)
-
-        self.driver_label = QLabel("Driver")
-        self.bus_label = QLabel("Bus")
-        self.capabilities_label = QLabel("Capabilities")
-        self.device_capabilities_label = QLabel("Device Caps")
-        for label in [self.bus_label, self.driver_label,  self.capabilities_label, self.device_capabilities_label]:
-            top_vbox.addWidget(label)
-        main_vbox.addWidget(top_frame)
-
-        middle_frame = self.setup_middle_frame(controller)
-        top_vbox.addWidget(middle_frame)
-
-        preview_frame = self.setup_preview_frame(controller)
-        top_vbox.addWidget(preview_frame)
-
-        self.bottom_frame = self.setup_control_menu_frame(controller)
-        main_vbox.addWidget(self.bottom_frame)
-
-        return main_frame
-
-    def setup_middle_frame(self, controller):
-        middle_frame = QFrame()
-        middle_hbox = QHBoxLayout()
-        middle_frame.setLayout(middle_hbox)
-
-        # List of pixel formats
-        vbox = QVBoxLayout()
-        vbox.addWidget(QLabel("Pixel Format"))
-        self.pixel_format_list = QListWidget()
-        self.pixel_format_list.setMinimumWidth(280)
-        self.pixel_format_list.itemClicked.connect(
-            controller.on_pixel_format_list_clicked)
-        vbox.addWidget(self.pixel_format_list)
-        # middle_hbox.addWidget(self.pixel_format_list)
-        middle_hbox.addLayout(vbox)
-
-        # Image Size list
-        vbox = QVBoxLayout()
-        vbox.addWidget(QLabel("Image Size"))
-        self.image_size_list = QListWidget()
-        self.image_size_list.setMinimumWidth(280)
-        self.image_size_list.itemClicked.connect(
-            controller.on_image_size_list_clicked)
-        vbox.addWidget(self.image_size_list)
-        middle_hbox.addLayout(vbox)
-
-        # FPS list
-        vbox = QVBoxLayout()
-        vbox.addWidget(QLabel("Frame Duration"))
-        self.fps_list = QListWidget()
-        self.fps_list.setMinimumWidth(280)
-        self.fps_list.itemClicked.connect(controller.on_fps_list_clicked)
-        vbox.addWidget(self.fps_list)
-        middle_hbox.addLayout(vbox)
-
-        return middle_frame
-
-    def setup_preview_frame(self, controller):
-        self.preview = QWidget()
-        preview_hbox = QHBoxLayout()
-        self.preview.setLayout(preview_hbox)
-        self.line_edit = QLineEdit()
-        # self.line_edit.setText(
-        #    "v4l2src device=/dev/video4 ! video/x-raw, width=640, height=480, framerate=30/1 ! xvimagesink")
-        self.line_edit.setText("")
-        preview_hbox.addWidget(self.line_edit)
-
-        self.copy_button = QPushButton('')
-        self.copy_button.line_edit = self.line_edit
-        self.copy_button.setIcon(QIcon('baseline_content_copy_black_24dp.png'))
-        self.copy_button.setIconSize(QSize(24, 24))   
-        self.copy_button.clicked.connect(controller.copy_button_clicked)
-        preview_hbox.addWidget(self.copy_button)
-
-        self.preview_button = QPushButton('')
-        self.preview_button.line_edit = self.line_edit
-        self.preview_button.setIcon(QIcon('baseline_preview_black_24dp.png'))
-        self.preview_button.setIconSize(QSize(24, 24))   
-        self.preview_button.clicked.connect(controller.preview_button_clicked)
-        preview_hbox.addWidget(self.preview_button)
-
-        self.sync_flag_checkbox = QCheckBox('Synchronize Video')
-        self.sync_flag_checkbox.clicked.connect(controller.on_sync_flag_checkbox_clicked)
-        preview_hbox.addWidget(self.sync_flag_checkbox)
-
-        return self.preview
-
-    def setup_control_menu_frame(self, controller):
-        self.scroll = QScrollArea()
-        self.scroll.setWidgetResizable(True)
-        # scroll_vbox = QVBoxLayout()
-        # self.scroll.setLayout(scroll_vbox)
-
-        self.control_menu_frame = QFrame()
-        control_menu_vbox = QVBoxLayout()
-        self.control_menu_frame.setLayout(control_menu_vbox)
-
-        self.scroll.setWidget(self.control_menu_frame)
-        # return self.control_menu_frame
-        return self.scroll
-
-    def clear_layout(self, layout: QLayout):
-        self.ctrl_dict = {}         # Clear out previous ctrl groups
-        child = layout.takeAt(0)
-        while child is not None:
-            if child.layout() is not None:
-                self.clear_layout(child.layout())
-            elif child.widget() is not None:
-                layout.removeWidget(child.widget())
-                child.widget().setParent(None)
-            child = layout.takeAt(0)
-
-    def create_preview_window(self):
-        preview_window = PreviewWindow()
-        preview_window.setup()
-        return preview_window
-
-    def closeEvent(self, event):
-        # Closing this window terminates the application
-        for window in self.preview_windows:
-            window.app_closing = True
-            window.close()
 
-def main():
-    Gst.init(None)
-    app = QApplication(sys.argv)
-    window = Camera_Caps_Window()
-    window.preview_windows = window.create_preview_window()
-    controller = Camera_Caps_Controller(window)
+from camera_caps_cache import Cached_Camera_Inspector, Capability_Cache
+from camera_caps_model import create_camera_inspector
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(description='Camera Capabilities')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Probe every camera, ignoring the capability cache')
+    parser.add_argument('--flush-cache', action='store_true',
+                        help='Empty the capability cache before probing')
+    parser.add_argument('--backend', choices=['auto', 'ioctl', 'v4l2-ctl', 'gst'], default='auto',
+                        help='How to query the cameras; gst lists cameras and formats through GStreamer')
+    parser.add_argument('--dump', nargs='?', const='ndjson', choices=['ndjson', 'json'],
+                        help='Print the capabilities of every device node and exit, without a GUI. '
+                             'ndjson (the default) writes one line per node as soon as it is probed')
+    parser.add_argument('--calibrate', action='store_true',
+                        help='Time the installed decoders and video sinks on this machine, '
+                             'store the ranking for previews to use and exit')
+    parser.add_argument('--warm-pool', type=int, default=0, metavar='N',
+                        help='Keep the pipelines of the N most recently closed previews ready, '
+                             'so reopening them is immediate')
+    parser.add_argument('--warm-pool-memory', default='256M', metavar='SIZE',
+                        help='Estimated buffer memory the warm pipelines may hold (default 256M)')
+    parser.add_argument('--warm-pool-state', choices=['paused', 'ready'], default='paused',
+                        help='paused keeps the cameras streaming for the fastest resume; '
+                             'ready stops them and frees the buffers')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='Print how long each startup phase took to stderr')
+    # Anything else is left for Qt
+    return parser.parse_known_args(argv[1:])
+
+
+def create_inspector(args):
+    camera_inspector = create_camera_inspector(args.backend)
+    if args.no_cache and not args.flush_cache:
+        return camera_inspector
+    cache = Capability_Cache()
+    if args.flush_cache:
+        cache.flush()
+    if args.no_cache:
+        return camera_inspector
+    return Cached_Camera_Inspector(camera_inspector, cache)
+
+
+def run_gui(args, qt_args):
+    # Qt is only loaded for the GUI; GStreamer waits for the first preview (see gst_loader.py)
+    with startup_profile.phase('imports (Qt, controller)'):
+        from PyQt5.QtWidgets import QApplication
+
+        from camera_caps_controller import Camera_Caps_Controller
+        from camera_caps_window import Camera_Caps_Window, First_Paint_Watcher
+
+    with startup_profile.phase('QApplication'):
+        app = QApplication(sys.argv[:1] + qt_args)
+    with startup_profile.phase('main window'):
+        window = Camera_Caps_Window()
+        window.preview_windows = window.create_preview_window()
+    with startup_profile.phase('device probing'):
+        # Queries from the GUI have deadlines, so a wedged camera cannot hang the window
+        from camera_caps_async import Async_Camera_Inspector, Sync_Camera_Inspector
+        from camera_caps_memo import Memo_Camera_Inspector
+        inspector = Sync_Camera_Inspector(Async_Camera_Inspector(create_inspector(args)))
+        # Answers are remembered for the session (camera_caps_memo.py)
+        inspector = Memo_Camera_Inspector(inspector)
+        pipeline_pool = None
+        if args.warm_pool > 0:
+            from pipeline_pool import Pipeline_Pool, parse_memory
+            pipeline_pool = Pipeline_Pool(args.warm_pool, parse_memory(args.warm_pool_memory),
+                                          args.warm_pool_state)
+        controller = Camera_Caps_Controller(window, inspector, pipeline_pool)
+    # setup records widget construction and format probing itself
     controller.setup()
+    startup_profile.mark('show')
+
+    def on_first_paint():
+        startup_profile.mark('first paint')
+        startup_profile.report()
+
+    window.first_paint_watcher = First_Paint_Watcher(window, on_first_paint)
+    controller.start_device_monitor()
 
     """ 
     def quitting_app():
@@ -209,5 +104,21 @@ def main():
     sys.exit(app.exec_())
 
 
+def main():
+    startup_profile.mark('imports (model)')
+    args, qt_args = parse_arguments(sys.argv)
+    startup_profile.enabled = args.profile_startup
+    if args.calibrate:
+        from gst_calibration import calibrate_host
+        sys.exit(calibrate_host())
+    if args.dump is not None:
+        from camera_caps_dump import dump_cameras
+        status = dump_cameras(create_inspector(args), args.dump)
+        startup_profile.mark('dump')
+        startup_profile.report()
+        sys.exit(status)
+    run_gui(args, qt_args)
+
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,336 @@
+#
+#  Camera Capabilities
+#
+#  Copyright (C) 2021-2024 JetsonHacks (info@jetsonhacks.com)
+#
+#  MIT License
+#
+#  Asynchronous camera queries
+#  Async_Camera_Inspector offers every Camera_Inspector query as a coroutine with a
+#  deadline. With the v4l2-ctl backend, v4l2-ctl runs through
+#  asyncio.create_subprocess_exec and is killed when its query times out or is
+#  cancelled. Other backends (ioctl, cached, fakes) run each query on a daemon
+#  thread; a wedged driver can keep that thread stuck in the kernel, but the
+#  caller gets Query_Timeout and carries on, and the thread does not hold up exit.
+#  Queries fail the way the Camera_Inspector ones do (printed, empty result);
+#  only missed deadlines and cancellation are raised.
+#
+#  Sync_Camera_Inspector is a drop-in facade for code that is not a coroutine.
+#  It runs the queries on an event loop thread of its own.
+#
+#  Python 3.6 (JetPack 4) is supported, so asyncio.run and asyncio.to_thread are not used.
+#
+import asyncio
+import subprocess
+import sys
+import threading
+from typing import Callable, List
+
+from camera_caps_model import Camera_Info, Camera_Inspector, Probe_Result, create_camera_inspector
+
+
+class Query_Timeout(TimeoutError):
+    """ A camera query missed its deadline """
+
+
+def _settle(future, result=None, exception=None):
+    # Runs on the event loop; the waiter may have timed out or been cancelled already
+    if future.cancelled():
+        return
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
+
+
+def backend_inspector(inspector):
+    """ The inspector that asks the devices, under wrappers that keep it in .inspector """
+    while getattr(inspector, 'inspector', None) is not None:
+        inspector = inspector.inspector
+    return inspector
+
+
+class Async_Camera_Inspector:
+
+    def __init__(self, inspector=None, timeout: float = None):
+        if inspector is None:
+            inspector = create_camera_inspector()
+        self.inspector = inspector
+        # Default deadline of each query, in seconds
+        self.timeout = inspector.probe_timeout if timeout is None else timeout
+        # The plain v4l2-ctl backend is run here so its process can be killed, also under a
+        # Cached_Camera_Inspector; the queries the wrapper answers itself go through it
+        self.backend = backend_inspector(inspector)
+        self.use_subprocess = type(self.backend) is Camera_Inspector
+
+    async def _deadline(self, awaitable, timeout: float, query: str):
+        if timeout is None:
+            timeout = self.timeout
+        try:
+            return await asyncio.wait_for(awaitable, timeout)
+        except asyncio.TimeoutError:
+            raise Query_Timeout(f"{query}: no response after {timeout} seconds") from None
+
+    async def _in_thread(self, name: str, *args, timeout: float = None):
+        """ inspector.name(*args) on a daemon thread """
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        function = getattr(self.inspector, name)
+
+        def run():
+            try:
+                result = function(*args)
+            except BaseException as exc:
+                outcome = (None, exc)
+            else:
+                outcome = (result, None)
+            try:
+                loop.call_soon_threadsafe(_settle, future, *outcome)
+            except RuntimeError:
+                # The loop closed while the query ran
+                pass
+
+        threading.Thread(target=run, name=f"camera-query {name}", daemon=True).start()
+        return await self._deadline(future, timeout, name)
+
+    async def run_v4l2_ctl(self, args: List[str], timeout: float = None) -> str:
+        """ Run v4l2-ctl with args, return its output or None on failure """
+        query = " ".join(["v4l2-ctl"] + args)
+        try:
+            process = await asyncio.create_subprocess_exec(
+                "v4l2-ctl", *args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except OSError as exc:
+            print(exc)
+            return None
+        try:
+            stdout, stderr = await self._deadline(process.communicate(), timeout, query)
+        except BaseException:
+            # Timed out or cancelled; do not leave v4l2-ctl behind
+            if process.returncode is None:
+                process.kill()
+            raise
+        if process.returncode != 0:
+            print(f"{query} failed ({process.returncode}): {stderr.decode(errors='replace').strip()}")
+            return None
+        return stdout.decode('utf-8', errors='replace')
+
+    async def list_devices(self, timeout: float = None) -> List[Camera_Info]:
+        if not self.use_subprocess:
+            return await self._in_thread('list_devices', timeout=timeout)
+        cameras, unresolved = None, []
+        if self.inspector.device_enumerator is not None:
+            # Reading sysfs does not block on the devices
+            cameras, unresolved = self.inspector.device_enumerator.list_devices()
+            if cameras is not None and len(unresolved) == 0:
+                return cameras
+        output = await self.run_v4l2_ctl(["--list-devices"], timeout)
+        queried = [] if output is None else self.inspector.parse_devices(output)
+        if cameras is None:
+            return queried
+        return self.inspector.merge_devices(cameras, unresolved, queried)
+
+    async def list_cameras(self, timeout: float = None) -> List[Camera_Info]:
+        """ The cameras with their extended info; each camera is probed under its own deadline """
+        if not self.use_subprocess or self.inspector is not self.backend:
+            # Other backends bound each device probe themselves (see Camera_Inspector.probe_devices),
+            # and a capability cache answers for the devices it knows
+            return await self._in_thread('list_cameras', timeout=timeout or sys.float_info.max)
+        to_return = await self.list_devices(timeout)
+        cameras = {camera.uri_list[0]: camera for camera in to_return if len(camera.uri_list) > 0}
+
+        async def probe(uri):
+            return await self.probe_camera(cameras[uri], timeout)
+
+        await self.probe_devices(list(cameras), probe)
+        return to_return
+
+    async def probe_devices(self, uris: List[str], query: Callable, on_result: Callable = None) -> List[Probe_Result]:
+        """ Await query(uri) for every uri, at most probe_workers at a time
+        Results are returned in the order of uris; a query that raises or misses its
+        deadline is reported in Probe_Result.error. on_result, if given, is called
+        with each Probe_Result as it completes. Cancelling this cancels every query.
+        """
+        results = [Probe_Result(uri) for uri in uris]
+        semaphore = asyncio.Semaphore(self.inspector.probe_workers)
+
+        async def run(index):
+            async with semaphore:
+                try:
+                    results[index].result = await query(uris[index])
+                except asyncio.CancelledError:
+                    raise
+                except Exception as exc:
+                    results[index].error = str(exc) or type(exc).__name__
+            if on_result is not None:
+                on_result(results[index])
+
+        await asyncio.gather(*[run(index) for index in range(len(uris))])
+        for result in results:
+            if result.error:
+                print(f"Unable to probe {result.uri}: {result.error}")
+        return results
+
+    async def probe_camera(self, camera: Camera_Info, timeout: float = None) -> Camera_Info:
+        if not self.use_subprocess:
+            return await self._in_thread('probe_camera', camera, timeout=timeout)
+        for uri in camera.uri_list:
+            output = await self.run_v4l2_ctl(["-d", uri, "--info", "--list-ctrls-menus"], timeout)
+            self.inspector.parse_probe(camera, uri, output)
+        return camera
+
+    async def get_camera_info(self, camera: Camera_Info, timeout: float = None):
+        if not self.use_subprocess:
+            return await self._in_thread('get_camera_info', camera, timeout=timeout)
+        uri = camera.uri_list[0]
+        output = await self.run_v4l2_ctl(["--info", "-d", uri], timeout)
+        if output is None:
+            print(f"Unable to get device info: {uri}")
+            return
+        self.inspector.parse_camera_info(output, camera)
+
+    async def describe_node(self, device_uri: str, timeout: float = None) -> Camera_Info:
+        camera = Camera_Info(uri_list=[device_uri])
+        await self.get_camera_info(camera, timeout)
+        return camera
+
+    async def camera_formats(self, device_uri: str, timeout: float = None) -> list:
+        if not self.use_subprocess:
+            return await self._in_thread('camera_formats', device_uri, timeout=timeout)
+        # A capability cache answers first, and keeps what v4l2-ctl returns
+        cached_formats = getattr(self.inspector, 'cached_formats', None)
+        if cached_formats is not None:
+            formats = cached_formats(device_uri)
+            if formats is not None:
+                return formats
+        output = await self.run_v4l2_ctl(["--list-formats-ext", "-d", device_uri], timeout)
+        formats = [] if output is None else self.inspector.parse_camera_formats(output)
+        if cached_formats is not None:
+            self.inspector.store_formats(device_uri, formats)
+        return formats
+
+    async def get_ctrl_menus(self, device_uri: str, timeout: float = None) -> list:
+        if not self.use_subprocess:
+            return await self._in_thread('get_ctrl_menus', device_uri, timeout=timeout)
+        output = await self.run_v4l2_ctl(["-d", device_uri, "--list-ctrls-menus"], timeout)
+        if output is None:
+            return []
+        return self.inspector.parse_ctrl_menus(output)
+
+    async def get_inactive_ctrls(self, device_uri: str, timeout: float = None) -> list:
+        if not self.use_subprocess:
+            return await self._in_thread('get_inactive_ctrls', device_uri, timeout=timeout)
+        output = await self.run_v4l2_ctl(["-d", device_uri, "--list-ctrls-menus"], timeout)
+        if output is None:
+            return []
+        return self.inspector.parse_inactive_ctrls(output)
+
+    async def get_camera_stream_settings(self, device_uri: str, timeout: float = None) -> list:
+        if not self.use_subprocess:
+            return await self._in_thread('get_camera_stream_settings', device_uri, timeout=timeout)
+        output = await self.run_v4l2_ctl(["--all", "-d", device_uri], timeout)
+        if output is None:
+            print(f"Unable to get device info: {device_uri}")
+            output = ""
+        return self.inspector.parse_stream_settings(output)
+
+    async def get_camera_report(self, device_uri: str, timeout: float = None):
+        if not self.use_subprocess:
+            return await self._in_thread('get_camera_report', device_uri, timeout=timeout)
+        output = await self.run_v4l2_ctl(["-d", device_uri, "--info", "--get-fmt-video", "--get-parm",
+                                          "--list-formats-ext", "--list-ctrls-menus"], timeout)
+        if output is None:
+            return None
+        return self.inspector.parse_camera_report(device_uri, output)
+
+    async def set_controls(self, device_uri: str, values: dict, timeout: float = None) -> None:
+        """ Set several controls in one call, in the order given; raises on failure """
+        if not self.use_subprocess:
+            return await self._in_thread('set_controls', device_uri, values, timeout=timeout)
+        settings = ",".join(f"{name}={value}" for name, value in values.items())
+        args = ["-d", device_uri, "-c", settings]
+        process = await asyncio.create_subprocess_exec(
+            "v4l2-ctl", *args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        try:
+            output, _ = await self._deadline(process.communicate(), timeout, f"v4l2-ctl -c {settings}")
+        except BaseException:
+            if process.returncode is None:
+                process.kill()
+            raise
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, ["v4l2-ctl"] + args, output)
+
+
+class Sync_Camera_Inspector:
+
+    """ The Camera_Inspector interface on top of an Async_Camera_Inspector
+    Each call blocks until its query finishes or misses its deadline; a missed
+    deadline is printed and answered like a failed query. submit() starts a query
+    without waiting and returns a concurrent.futures.Future whose cancel() cancels
+    it. Anything else is passed through to the wrapped inspector.
+    """
+
+    def __init__(self, async_inspector: Async_Camera_Inspector):
+        self.async_inspector = async_inspector
+        self.inspector = async_inspector.inspector
+        self.loop = asyncio.new_event_loop()
+        if sys.version_info < (3, 8):
+            # Before 3.8 subprocesses need the child watcher, which must be attached from the main thread
+            asyncio.get_child_watcher().attach_loop(self.loop)
+        self.thread = threading.Thread(target=self.run_loop, name='camera-queries', daemon=True)
+        self.thread.start()
+
+    def __getattr__(self, name):
+        return getattr(self.inspector, name)
+
+    def run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def submit(self, coroutine):
+        """ Start a query on the event loop thread; returns a concurrent.futures.Future """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def _call(self, failure, name: str, *args):
+        future = self.submit(getattr(self.async_inspector, name)(*args))
+        try:
+            return future.result()
+        except Query_Timeout as exc:
+            print(exc)
+            return failure
+
+    def list_devices(self) -> List[Camera_Info]:
+        return self._call([], 'list_devices')
+
+    def list_cameras(self) -> List[Camera_Info]:
+        return self._call([], 'list_cameras')
+
+    def probe_camera(self, camera: Camera_Info) -> Camera_Info:
+        return self._call(camera, 'probe_camera', camera)
+
+    def get_camera_info(self, camera: Camera_Info):
+        return self._call(None, 'get_camera_info', camera)
+
+    def describe_node(self, device_uri: str) -> Camera_Info:
+        return self._call(Camera_Info(uri_list=[device_uri]), 'describe_node', device_uri)
+
+    def camera_formats(self, device_uri: str) -> list:
+        return self._call([], 'camera_formats', device_uri)
+
+    def get_ctrl_menus(self, device_uri: str) -> list:
+        return self._call([], 'get_ctrl_menus', device_uri)
+
+    def get_inactive_ctrls(self, device_uri: str) -> list:
+        return self._call([], 'get_inactive_ctrls', device_uri)
+
+    def get_camera_stream_settings(self, device_uri: str) -> list:
+        return self._call(["", "", ""], 'get_camera_stream_settings', device_uri)
+
+    def get_camera_report(self, device_uri: str):
+        return self._call(None, 'get_camera_report', device_uri)
+
+    def set_controls(self, device_uri: str, values: dict) -> None:
+        # Failures, missed deadlines included, are raised for the control writer to count
+        return self.submit(self.async_inspector.set_controls(device_uri, values)).result()
@@ -0,0 +1,320 @@
+#
+#  Camera Capabilities
+#
+#  Copyright (C) 2021-2024 JetsonHacks (info@jetsonhacks.com)
+#
+#  MIT License
+#
+#  On-disk cache of camera capabilities
+#  Cameras on a rig rarely change, so the parsed Camera_Info and Camera_Format
+#  data is kept between launches. Entries are keyed by device identity (bus address,
+#  driver name and version, card name) and each device node carries a signature read
+#  from /dev and sysfs. A warm start only compares signatures; a camera that has been
+#  replugged, replaced or had its driver updated misses and is probed again.
+#
+import json
+import os
+import threading
+import time
+from dataclasses import asdict
+from fractions import Fraction
+from typing import List
+
+from camera_caps_model import (Camera_Format, Camera_Info, Frame_Size, Frame_Size_Range,
+                               Interval_Range)
+
+CACHE_VERSION = 3
+
+
+def default_cache_path() -> str:
+    cache_home = os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))
+    return os.path.join(cache_home, 'camera-caps', 'capabilities.json')
+
+
+def _fractions_to_json(fractions: List[Fraction]) -> list:
+    # Stored as [numerator, denominator] to stay exact
+    return [[fraction.numerator, fraction.denominator] for fraction in fractions]
+
+
+def _fractions_from_json(contents: list) -> List[Fraction]:
+    return [Fraction(*fraction) for fraction in contents]
+
+
+def _interval_range_to_json(interval_range: Interval_Range) -> list:
+    if interval_range is None:
+        return None
+    return _fractions_to_json([interval_range.minimum, interval_range.maximum, interval_range.step])
+
+
+def _interval_range_from_json(contents: list) -> Interval_Range:
+    if contents is None:
+        return None
+    return Interval_Range(*_fractions_from_json(contents))
+
+
+def format_to_json(camera_format: Camera_Format) -> dict:
+    to_return = {'index': camera_format.index, 'type': camera_format.type,
+                 'pixel_format': camera_format.pixel_format, 'format_name': camera_format.format_name}
+    to_return['frame_sizes'] = [
+        {'width': frame_size.width, 'height': frame_size.height,
+         'intervals': _fractions_to_json(frame_size.intervals),
+         'interval_range': _interval_range_to_json(frame_size.interval_range)}
+        for frame_size in camera_format.frame_sizes]
+    to_return['frame_size_ranges'] = [
+        {'width': [size_range.min_width, size_range.max_width, size_range.step_width],
+         'height': [size_range.min_height, size_range.max_height, size_range.step_height],
+         'intervals': _fractions_to_json(size_range.intervals),
+         'interval_range': _interval_range_to_json(size_range.interval_range)}
+        for size_range in camera_format.frame_size_ranges]
+    return to_return
+
+
+def format_from_json(contents: dict) -> Camera_Format:
+    frame_sizes = [Frame_Size(frame_size['width'], frame_size['height'],
+                              _fractions_from_json(frame_size['intervals']),
+                              _interval_range_from_json(frame_size['interval_range']))
+                   for frame_size in contents['frame_sizes']]
+    frame_size_ranges = []
+    for size_range in contents['frame_size_ranges']:
+        min_width, max_width, step_width = size_range['width']
+        min_height, max_height, step_height = size_range['height']
+        frame_size_ranges.append(Frame_Size_Range(min_width, max_width, step_width,
+                                                  min_height, max_height, step_height,
+                                                  _fractions_from_json(size_range['intervals']),
+                                                  _interval_range_from_json(size_range['interval_range'])))
+    return Camera_Format(contents['index'], contents['type'], contents['pixel_format'],
+                         contents['format_name'], frame_sizes, frame_size_ranges)
+
+
+class Capability_Cache:
+
+    # USB descriptors that identify the physical camera behind a node
+    usb_attributes = ['idVendor', 'idProduct', 'bcdDevice', 'serial']
+
+    def __init__(self, path: str = None, max_entries: int = 64,
+                 sysfs_root: str = '/sys', dev_root: str = '/dev'):
+        if path is None:
+            path = default_cache_path()
+        self.path = path
+        self.max_entries = max_entries
+        self.sysfs_root = sysfs_root
+        self.dev_root = dev_root
+        self.entries = None
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+        # Devices are probed from several threads at once
+        self.lock = threading.RLock()
+
+    def load(self):
+        if self.entries is not None:
+            return
+        self.entries = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as cache_file:
+                contents = json.load(cache_file)
+            if contents.get('version') == CACHE_VERSION:
+                self.entries = contents.get('entries', {})
+        except (OSError, ValueError) as exc:
+            if not isinstance(exc, FileNotFoundError):
+                print(f"Ignoring unreadable capability cache {self.path}: {exc}")
+
+    def save(self):
+        with self.lock:
+            if not self.dirty or self.entries is None:
+                return
+            self.evict()
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                temp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(temp_path, 'w', encoding='utf-8') as cache_file:
+                    json.dump({'version': CACHE_VERSION, 'entries': self.entries}, cache_file)
+                os.replace(temp_path, self.path)
+                self.dirty = False
+            except OSError as exc:
+                print(f"Unable to write capability cache {self.path}: {exc}")
+
+    def flush(self):
+        """ Remove every entry, on disk as well """
+        with self.lock:
+            self.entries = {}
+            self.dirty = False
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            except OSError as exc:
+                print(f"Unable to remove capability cache {self.path}: {exc}")
+
+    def evict(self):
+        # Least recently used entries go first
+        if len(self.entries) <= self.max_entries:
+            return
+        by_age = sorted(self.entries, key=lambda key: self.entries[key].get('last_used', 0))
+        for key in by_age[:len(self.entries) - self.max_entries]:
+            del self.entries[key]
+
+    def identity_key(self, camera: Camera_Info) -> str:
+        return "|".join([camera.bus_address, camera.driver_name,
+                         camera.driver_version, camera.camera_name])
+
+    def node_signature(self, uri: str) -> dict:
+        """ Cheap to read, and changes when the device behind the node changes """
+        signature = {}
+        try:
+            stat = os.stat(uri)
+            signature['ctime'] = stat.st_ctime_ns
+            signature['rdev'] = stat.st_rdev
+        except OSError:
+            return None
+        node_name = os.path.basename(uri)
+        device_path = os.path.join(self.sysfs_root, 'class', 'video4linux', node_name, 'device')
+        device_path = os.path.realpath(device_path)
+        # The video node hangs off a USB interface; the descriptors live on its parent
+        for _ in range(3):
+            if os.path.exists(os.path.join(device_path, 'idVendor')):
+                for attribute in self.usb_attributes:
+                    try:
+                        with open(os.path.join(device_path, attribute), 'r') as attribute_file:
+                            signature[attribute] = attribute_file.read().strip()
+                    except OSError:
+                        signature[attribute] = None
+                break
+            device_path = os.path.dirname(device_path)
+        return signature
+
+    def _find_node(self, uri: str):
+        self.load()
+        signature = self.node_signature(uri)
+        if signature is None:
+            return None, None
+        for key, entry in self.entries.items():
+            node = entry['nodes'].get(uri)
+            if node is not None and node['signature'] == signature:
+                entry['last_used'] = time.time()
+                self.dirty = True
+                return entry, node
+        return None, None
+
+    def _node_for_store(self, camera: Camera_Info, uri: str):
+        self.load()
+        signature = self.node_signature(uri)
+        if signature is None:
+            return None
+        key = self.identity_key(camera)
+        # A node belongs to one device at a time
+        for other_key, entry in self.entries.items():
+            if other_key != key:
+                entry['nodes'].pop(uri, None)
+        entry = self.entries.setdefault(key, {'camera_info': None, 'nodes': {}})
+        entry['last_used'] = time.time()
+        node = entry['nodes'].get(uri)
+        if node is None or node['signature'] != signature:
+            node = {'signature': signature, 'formats': None}
+            entry['nodes'][uri] = node
+        self.dirty = True
+        return entry, node
+
+    def restore_camera(self, camera: Camera_Info) -> bool:
+        """ Fill in the extended info of camera from the cache; False on a miss """
+        with self.lock:
+            entry, _ = self._find_node(camera.uri_list[0])
+            if entry is None or entry['camera_info'] is None:
+                self.misses += 1
+                return False
+            cached = entry['camera_info']
+            # The enumerated name and bus must still agree with the cached device
+            if cached['camera_name'] != camera.camera_name or cached['bus_address'] != camera.bus_address:
+                self.misses += 1
+                return False
+            for name in ['driver_name', 'driver_version', 'capabilities_code', 'capabilities_list',
+                         'device_caps_code', 'device_caps_list']:
+                setattr(camera, name, cached[name])
+            self.hits += 1
+            return True
+
+    def store_camera(self, camera: Camera_Info):
+        with self.lock:
+            if camera.driver_name == "":
+                # Probe failed, nothing worth keeping
+                return
+            stored = self._node_for_store(camera, camera.uri_list[0])
+            if stored is None:
+                return
+            entry, _ = stored
+            camera_info = asdict(camera)
+            # The control menu dumps are live device state
+            camera_info['ctrl_menu_list'] = []
+            entry['camera_info'] = camera_info
+
+    def lookup_formats(self, uri: str) -> List[Camera_Format]:
+        with self.lock:
+            _, node = self._find_node(uri)
+            if node is None or node['formats'] is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return [format_from_json(camera_format) for camera_format in node['formats']]
+
+    def store_formats(self, camera: Camera_Info, uri: str, formats: List[Camera_Format]):
+        with self.lock:
+            if camera is None or camera.driver_name == "":
+                return
+            stored = self._node_for_store(camera, uri)
+            if stored is None:
+                return
+            _, node = stored
+            node['formats'] = [format_to_json(camera_format) for camera_format in formats]
+
+
+class Cached_Camera_Inspector:
+
+    """ Wraps a Camera_Inspector, answering device info and format queries from a
+    Capability_Cache when the device is unchanged. Control menus and current stream
+    settings are device state that other programs can change, so they always go to
+    the device. Everything not overridden here is passed through to the inspector.
+    """
+
+    def __init__(self, inspector, cache: Capability_Cache):
+        self.inspector = inspector
+        self.cache = cache
+        self.cameras_by_uri = {}
+
+    def __getattr__(self, name):
+        return getattr(self.inspector, name)
+
+    def list_cameras(self) -> List:
+        to_return = self.inspector.list_devices()
+        cameras = {camera.uri_list[0]: camera for camera in to_return if len(camera.uri_list) > 0}
+        self.cameras_by_uri = {uri: camera for camera in to_return for uri in camera.uri_list}
+
+        def probe(uri):
+            camera = cameras[uri]
+            if not self.cache.restore_camera(camera):
+                self.inspector.probe_camera(camera)
+                self.cache.store_camera(camera)
+            return camera
+
+        self.inspector.probe_devices(list(cameras), probe)
+        self.cache.save()
+        return to_return
+
+    def camera_formats(self, device_uri: str):
+        formats = self.cached_formats(device_uri)
+        if formats is None:
+            formats = self.inspector.camera_formats(device_uri)
+            self.store_formats(device_uri, formats)
+        return formats
+
+    def cached_formats(self, device_uri: str):
+        """ The formats the cache has for device_uri, or None """
+        return self.cache.lookup_formats(device_uri)
+
+    def store_formats(self, device_uri: str, formats: List):
+        if len(formats) > 0:
+            self.cache.store_formats(self.cameras_by_uri.get(device_uri), device_uri, formats)
+
+    def probe_devices(self, uris, probe, on_result=None):
+        results = self.inspector.probe_devices(uris, probe, on_result)
+        self.cache.save()
+        return results
@@ -0,0 +1,105 @@
+#
+#  Camera Capabilities
+#
+#  Copyright (C) 2021-2024 JetsonHacks (info@jetsonhacks.com)
+#
+#  MIT License
+#
+#  Control event listener
+#  Subscribes to V4L2_EVENT_CTRL for every control of the open device, so value
+#  and flag changes (e.g. exposure_absolute becoming active when auto exposure
+#  is switched off) arrive as they happen - including changes made by other
+#  programs. Drivers without event support make start() return False; the
+#  caller then keeps re-reading the control list instead.
+#
+import errno
+import threading
+from dataclasses import dataclass
+from typing import Callable, List
+
+import v4l2_ioctl
+
+
+@dataclass
+class Control_Event:
+    ctrl_id: int = 0
+    # V4L2_EVENT_CTRL_CH_* bits
+    changes: int = 0
+    value: int = 0
+    flags: int = 0
+
+    @property
+    def value_changed(self) -> bool:
+        return bool(self.changes & v4l2_ioctl.V4L2_EVENT_CTRL_CH_VALUE)
+
+    @property
+    def flags_changed(self) -> bool:
+        return bool(self.changes & v4l2_ioctl.V4L2_EVENT_CTRL_CH_FLAGS)
+
+    @property
+    def inactive(self) -> bool:
+        return bool(self.flags & v4l2_ioctl.V4L2_CTRL_FLAG_INACTIVE)
+
+
+class Control_Event_Listener:
+
+    def __init__(self, device_uri: str, registry, ctrl_ids: List[int], on_event: Callable):
+        # on_event(device_uri, Control_Event) is called from the listener thread
+        self.device_uri = device_uri
+        self.registry = registry
+        self.ctrl_ids = ctrl_ids
+        self.on_event = on_event
+        self.transport = None
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def start(self) -> bool:
+        """ Subscribe and start listening; False if the device does not support control events """
+        try:
+            self.transport = self.registry.open(self.device_uri)
+            device = v4l2_ioctl.V4L2_Device(self.transport)
+            for ctrl_id in self.ctrl_ids:
+                device.subscribe_control_events(ctrl_id)
+        except OSError as exc:
+            if exc.errno not in (errno.ENOTTY, errno.EINVAL, errno.ENOSYS):
+                print(f"Unable to subscribe to control events on {self.device_uri}: {exc}")
+            self.close_transport()
+            return False
+        self.thread = threading.Thread(target=self.run, name=f"control-events {self.device_uri}",
+                                       daemon=True)
+        self.thread.start()
+        return True
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=1.0)
+            self.thread = None
+        self.close_transport()
+
+    def close_transport(self):
+        if self.transport is not None:
+            # Closing the file handle drops the subscriptions
+            self.transport.close()
+            self.transport = None
+
+    def run(self):
+        device = v4l2_ioctl.V4L2_Device(self.transport)
+        try:
+            while not self.stop_event.is_set():
+                if not self.transport.wait_for_event(0.25):
+                    continue
+                event = device.dequeue_event()
+                while event is not None:
+                    if event.type == v4l2_ioctl.V4L2_EVENT_CTRL:
+                        ctrl = event.u.ctrl
+                        value = ctrl.value
+                        if ctrl.type == v4l2_ioctl.V4L2_CTRL_TYPE_INTEGER64:
+                            value = ctrl.value64
+                        self.on_event(self.device_uri,
+                                      Control_Event(event.id, ctrl.changes, value, ctrl.flags))
+                    event = device.dequeue_event()
+        except OSError as exc:
+            # The device went away; hotplug handling takes it from here
+            if not self.stop_event.is_set():
+                print(f"Control events on {self.device_uri} stopped: {exc}")
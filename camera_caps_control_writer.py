@@ -0,0 +1,138 @@
+#
+#  Camera Capabilities
+#
+#  Copyright (C) 2021-2024 JetsonHacks (info@jetsonhacks.com)
+#
+#  MIT License
+#
+#  Control writer
+#  Dragging a slider produces a value per tick. Writing each one synchronously
+#  stalls the UI, so values are handed to a worker thread per device instead.
+#  The latest value of a control wins, writes are spaced at least min_interval
+#  apart, and every control pending at write time goes out in one batch. When a
+#  batch asks for a refresh, the controls made inactive by it are read on the
+#  worker thread too.
+#
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+
+@dataclass
+class Control_Write_Stats:
+    batches: int = 0
+    values_written: int = 0
+    # Intermediate values replaced by a newer value before they were written
+    dropped: int = 0
+    errors: int = 0
+    last_latency: float = 0.0
+    max_latency: float = 0.0
+    total_latency: float = 0.0
+
+    @property
+    def average_latency(self) -> float:
+        if self.batches == 0:
+            return 0.0
+        return self.total_latency / self.batches
+
+    def summary(self) -> str:
+        return (f"{self.values_written} values in {self.batches} writes, {self.dropped} dropped, "
+                f"{self.errors} errors, latency avg {self.average_latency * 1000:.1f} ms "
+                f"max {self.max_latency * 1000:.1f} ms")
+
+
+class Control_Writer:
+
+    def __init__(self, device_uri: str, write_controls: Callable, min_interval: float = 1 / 30,
+                 on_written: Callable = None, read_inactive: Callable = None):
+        # write_controls(device_uri, {name: value}) does the actual write and raises on failure
+        self.device_uri = device_uri
+        self.write_controls = write_controls
+        self.min_interval = min_interval
+        # on_written(device_uri, values, inactive controls, error) is called from the writer thread;
+        # the inactive controls are None unless the batch asked for a refresh
+        self.on_written = on_written
+        # read_inactive(device_uri) returns the titles of the inactive controls
+        self.read_inactive = read_inactive
+        self.stats = Control_Write_Stats()
+        self.pending = {}
+        self.refresh_pending = False
+        self.busy = False
+        self.closing = False
+        self.last_write = 0.0
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, name=f"control-writer {device_uri}",
+                                       daemon=True)
+        self.thread.start()
+
+    def set(self, name: str, value, refresh: bool = False):
+        """ Queue a control value; refresh asks for the control states to be re-read afterwards """
+        with self.condition:
+            if name in self.pending:
+                self.stats.dropped += 1
+            self.pending[name] = value
+            self.refresh_pending = self.refresh_pending or refresh
+            self.condition.notify()
+
+    def flush(self, timeout: float = 2.0) -> bool:
+        """ Wait until everything queued has been written """
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while self.pending or self.busy:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def close(self, wait: bool = False, timeout: float = 2.0):
+        """ Stop once everything queued has been written; with wait, block until then """
+        with self.condition:
+            self.closing = True
+            self.condition.notify()
+        if wait:
+            self.thread.join(timeout)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.closing:
+                    self.condition.wait()
+                if self.closing and not self.pending:
+                    return
+                # Rate limit; values arriving meanwhile join this batch
+                while not self.closing:
+                    delay = self.last_write + self.min_interval - time.monotonic()
+                    if delay <= 0:
+                        break
+                    self.condition.wait(delay)
+                values = self.pending
+                refresh = self.refresh_pending
+                self.pending = {}
+                self.refresh_pending = False
+                self.busy = True
+            error = None
+            start = time.monotonic()
+            try:
+                self.write_controls(self.device_uri, values)
+            except Exception as exc:
+                error = str(exc)
+            latency = time.monotonic() - start
+            with self.condition:
+                self.last_write = time.monotonic()
+                self.stats.batches += 1
+                self.stats.values_written += len(values)
+                self.stats.last_latency = latency
+                self.stats.max_latency = max(self.stats.max_latency, latency)
+                self.stats.total_latency += latency
+                if error is not None:
+                    self.stats.errors += 1
+            inactive = None
+            if refresh and self.read_inactive is not None:
+                inactive = self.read_inactive(self.device_uri)
+            if self.on_written is not None:
+                self.on_written(self.device_uri, values, inactive, error)
+            with self.condition:
+                self.busy = False
+                self.condition.notify_all()
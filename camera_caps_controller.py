@@ -5,63 +5,84 @@
 #
 #  MIT License
 #
-import subprocess
+import time
 
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import QObject, Qt, pyqtSignal
 from PyQt5.QtWidgets import (QApplication, QCheckBox, QComboBox, QHBoxLayout,
                              QLabel, QListWidgetItem, QPushButton, QSizePolicy,
                              QSlider, QSpinBox, QVBoxLayout)
 from dataclasses import dataclass
 
-from camera_caps_model import (Camera_Format, Camera_Inspector,
-                               Control_Menu_Entry)
+from camera_caps_model import (Camera_Format, Control_Menu_Entry, Format_Catalogue,
+                               create_camera_inspector, format_interval, parse_frame_interval)
+from camera_caps_control_events import Control_Event_Listener
+from camera_caps_control_writer import Control_Writer
+from camera_caps_memo import Memo_Camera_Inspector
+from camera_caps_monitor import Device_Monitor
+from camera_caps_switcher import Camera_Switch
+from pipeline_release import release_stats
+from roi_crop import supports_v4l2_crop
 from preview_window import PreviewWindow
+from startup_profile import startup_profile
 
 from camera_caps_dataclasses import CameraSettings, generate_capsfilter_string
+from camera_caps_gst_discovery import fourcc_to_gst
 from dataclasses import replace
+from gst_calibration import Calibration_Cache
+from gst_pipeline_builder import Element_Spec, Pipeline_Builder, Plugin_File_Registry, default_registry
+from gst_loader import gst_loaded, load_gst
 
 
 
-class Command_Map:
-    # Build the gstreamer filter. [0] = media type (caps) [1] = cccc [2] = decoder [3] = output sink
-    # command_base: str = '{}, width={}, height={}, framerate={}/1, format={} {} ! videoconvert ! videocrop name=cropper ! {}'
-    command_base: str = '{}, width={}, height={}, framerate={}/1, format={} {} ! {}'
-    source: dict = {'uvcvideo': 'v4l2src device={device_uri}',
-                    'tegra-video': 'nvarguscamerasrc sensor-id={}'}
-    filters: dict = {'YUYV': 'video/x-raw, width={}, height={}, framerate={}/1 ! format=YUY2 ! xvimagesink',
-                     'H264': 'video/x-h264, width={}, height={}, framerate={}/1, format=H264 ! nvv4l2decoder ! nvvidconv ! xvimagesink sync=false',
-                     'MJPG': 'image/jpeg, width={}, height={}, framerate={}/1, format=MJPG ! nvv4l2decoder mjpeg=1 ! nvvidconv ! xvimagesink',
-                     'UYVY': 'video/x-raw, width={}, height={}, framerate={}/1, format=UYVY ! xvimagesink'}
-    # Build the gstreamer filter. [0] = media type (caps) [1] = cccc [2] = decoder [3] = output sink
-    filter_types: dict = { 
-                    'YUYV': ['video/x-raw', 'YUY2', '', 'xvimagesink sync={}' ],
-                    'H264': ['video/x-h264', 'H264', '! h264parse ! avdec_h264  ', 'xvimagesink sync={}'],
-                    'MJPG': ['image/jpeg', 'MJPG',   '! nvv4l2decoder mjpeg=1 ! nvvidconv ',  'xvimagesink sync={}'],
-                    'UYVY': ['video/x-raw', 'UYVY' , '',  'xvimagesink sync={}' ] }
-
-    # Build the gstreamer filter. [0] = media type (caps) [1] = cccc [2] = decoder [3] = output sink
-    crop_filter_types: dict = { 
-                    'YUYV': ['video/x-raw', 'YUY2', '! videocrop name=cropper ! videoscale ! video/x-raw, width={}, height={} ! videoconvert ', 'xvimagesink sync={}' ],
-                    'H264': ['video/x-h264', 'H264', '! h264parse ! avdec_h264  ! videocrop name=cropper ', 'xvimagesink sync={}'],
-                    'MJPG': ['image/jpeg', 'MJPG',   '! nvv4l2decoder mjpeg=1 ! nvvidconv ! videocrop name=cropper ',  'xvimagesink sync={}'],
-                    'UYVY': ['video/x-raw', 'UYVY' , '! videocrop name=cropper ! videoscale ! video/x-raw, width={}, height={} ! videoconvert ',  'xvimagesink sync={}' ] }
-# ! videocrop top=162 left=543 bottom=252 right=519 ! videoscale ! video/x-raw,width=1920,height=1080 ! videoconvert 
+class Device_Event_Bridge(QObject):
+    # Results produced on worker threads; Qt queues them to the GUI thread
+    # Hotplug: new nodes (Camera_Info list), format Probe_Results, removed uris
+    devices_changed = pyqtSignal(object, object, object)
+    # Control writer: device uri, {name: value}, inactive controls (None without a refresh), error or None
+    controls_written = pyqtSignal(object, object, object, object)
+    # Control event listener: device uri, Control_Event
+    control_changed = pyqtSignal(object, object)
+    # Camera switch: Camera_Switch, stage name, query result or None
+    camera_switch_stage = pyqtSignal(object, object, object)
+    # Pipeline release: device uri whose preview pipeline has stopped
+    pipeline_released = pyqtSignal(object)
+
 
 class Camera_Caps_Controller:
 
-    def __init__(self, view):
+    def __init__(self, view, camera_inspector=None, pipeline_pool=None):
         self.view = view
         self.device_uri = None
         # list of camera device id and PIDs of camera running in preview window
         self.camera_preview_list = []
         self.check_previews_timer = None
-        self.camera_inspector = Camera_Inspector()
+        if camera_inspector is None:
+            camera_inspector = create_camera_inspector()
+        self.camera_inspector = camera_inspector
         self.camera_list = self.camera_inspector.list_cameras()
         self.camera_location = None
         self.camera_formats = None
-        self.size_list = None
+        self.format_catalogue = Format_Catalogue()
+        # List widget items by fourcc, (width, height) and frame interval
+        self.format_items = {}
+        self.size_items = {}
+        self.interval_items = {}
         self.gst_source = ""
-        self.gst_filters = ""
+        # Decides which decoders and sinks previews use; see pipeline_builder
+        self.element_registry = None
+        # This host's calibrated decoder and sink order, loaded with the first preview
+        self.calibration_ranking = None
+        # Device uri -> whether the driver can crop the capture (roi_crop.py)
+        self.v4l2_crop_support = {}
+        self.preview_pipeline_graph = None
+        # Keeps the pipelines of closed previews warm (pipeline_pool.py); None when not enabled
+        self.pipeline_pool = pipeline_pool
+        # Device uri -> (preview window, command line, pipeline or None, graph or None, camera settings)
+        # for previews waiting for the device to be released by the previous pipeline
+        self.pending_previews = {}
+        # The selected format and frame interval as the device names them, for exact preview caps
+        self.selected_fourcc = ""
+        self.selected_interval = None
 
         """ 
         self.image_width = ""   # Currently selected image width
@@ -71,40 +92,215 @@ class Camera_Caps_Controller:
         """
 
         self.camera_settings = CameraSettings()
+        self.device_monitor = None
+        self.control_writer = None
+        self.control_event_listener = None
+        # Queries for the selected camera; results of any other switch are stale
+        self.camera_switch = None
+        # V4L2 control id -> Control_Menu_Entry of the current camera
+        self.ctrl_menus_by_id = {}
+        # Control name -> time of our last write, to tell our own changes from others'
+        self.last_written = {}
+        self.device_event_bridge = Device_Event_Bridge()
+        self.device_event_bridge.devices_changed.connect(self.on_devices_changed)
+        self.device_event_bridge.controls_written.connect(self.on_controls_written)
+        self.device_event_bridge.control_changed.connect(self.on_control_event)
+        self.device_event_bridge.camera_switch_stage.connect(self.on_camera_switch_stage)
+        self.device_event_bridge.pipeline_released.connect(self.start_preview)
 
     def setup(self):
-        self.view.setup(self)
-        preview_window_list = []
+        with startup_profile.phase('widget construction'):
+            self.view.setup(self)
+        self.view.preview_windows = []
         if len(self.camera_list) > 0:
             self.view.camera_combo_box.setEnabled(True)
-            for camera in self.camera_list:
-                for uri in camera.uri_list:
-                    entry_name = f"{camera.camera_name} on {uri}"
-                    self.view.camera_combo_box.addItem(entry_name, uri)
-                    item_index = self.view.camera_combo_box.count()
-                    # Does the camera have associated formats?
-                    formats = self.camera_inspector.camera_formats(uri)
-                    if len(formats) == 0:
-                        self.view.camera_combo_box.model().item(item_index-1).setEnabled(False)
-                    # Create a preview window for the camera
-                    preview_window: PreviewWindow = self.view.create_preview_window()
-                    preview_window.base_title = entry_name
-                    preview_window.setWindowTitle(entry_name)
-                    preview_window.device_uri = uri
-                    preview_window_list.append(preview_window)
+            uris = [uri for camera in self.camera_list for uri in camera.uri_list]
+            with startup_profile.phase('format probing'):
+                format_results = self.camera_inspector.probe_devices(
+                    uris, self.camera_inspector.camera_formats)
+            with startup_profile.phase('camera entries'):
+                self.add_camera_entries(format_results)
         else:
             # No cameras to show
             self.view.camera_combo_box.setEnabled(False)
-        self.view.preview_windows = preview_window_list
         self.view.show()
 
-    def set_ctl_value(self, setting, value):
-        try:
-            subprocess.check_output(
-                ["v4l2-ctl", '-d', self.device_uri, '-c', f"{setting}={value}"], encoding='utf-8')
+    def add_camera_entries(self, format_results):
+        """ Add a combo box entry and a preview window for each probed uri """
+        for probe_result in format_results:
+            uri = probe_result.uri
+            camera = self.get_camera(uri)
+            entry_name = f"{camera.camera_name} on {uri}"
+            self.view.camera_combo_box.addItem(entry_name, uri)
+            item_index = self.view.camera_combo_box.count()
+            # Does the camera have associated formats? Failed probes have none
+            if not probe_result.result:
+                self.view.camera_combo_box.model().item(item_index-1).setEnabled(False)
+            # Create a preview window for the camera
+            preview_window: PreviewWindow = self.view.create_preview_window()
+            preview_window.base_title = entry_name
+            preview_window.setWindowTitle(entry_name)
+            preview_window.device_uri = uri
+            preview_window.driver_name = camera.driver_name
+            preview_window.pipeline_pool = self.pipeline_pool
+            self.view.preview_windows.append(preview_window)
+
+    def remove_camera_entry(self, uri: str):
+        index = self.view.camera_combo_box.findData(uri)
+        if index >= 0:
+            # Removing the current entry selects another camera through on_camera_box_changed
+            self.view.camera_combo_box.removeItem(index)
+        if self.pipeline_pool is not None:
+            self.pipeline_pool.discard(uri)
+        for preview_window in [window for window in self.view.preview_windows if window.device_uri == uri]:
+            preview_window.app_closing = True
+            preview_window.close()
+            self.view.preview_windows.remove(preview_window)
+        camera = self.get_camera(uri)
+        if camera is not None:
+            camera.uri_list.remove(uri)
+            if len(camera.uri_list) == 0:
+                self.camera_list.remove(camera)
+
+    def start_device_monitor(self, dev_root: str = '/dev', sysfs_root: str = '/sys'):
+        # Inspectors with their own device events (GStreamer discovery) report hotplug themselves
+        create_device_monitor = getattr(self.camera_inspector, 'create_device_monitor', None)
+        if create_device_monitor is not None:
+            self.device_monitor = create_device_monitor(self.probe_changed_devices)
+        else:
+            self.device_monitor = Device_Monitor(self.probe_changed_devices, dev_root, sysfs_root)
+        self.device_monitor.start()
+
+    def probe_changed_devices(self, added, removed):
+        # Runs on the monitor thread; only the nodes that appeared are probed
+        for uri in added + removed:
+            # A node number can come back as a different camera
+            self.invalidate_queries(uri)
+        new_nodes = [self.camera_inspector.describe_node(uri) for uri in added]
+        format_results = self.camera_inspector.probe_devices(
+            added, self.camera_inspector.camera_formats)
+        self.device_event_bridge.devices_changed.emit(new_nodes, format_results, removed)
+
+    def on_devices_changed(self, new_nodes, format_results, removed):
+        for uri in removed:
+            self.remove_camera_entry(uri)
+        added_results = []
+        for node, probe_result in zip(new_nodes, format_results):
+            uri = probe_result.uri
+            if self.get_camera(uri) is not None:
+                continue
+            if node.driver_name == "":
+                print(f"Unable to query new device {uri}")
+                continue
+            # Nodes of one physical device share a bus address
+            camera = [camera for camera in self.camera_list if camera.bus_address == node.bus_address]
+            if len(camera) > 0:
+                camera[0].uri_list.append(uri)
+            else:
+                self.camera_list.append(node)
+            added_results.append(probe_result)
+        self.add_camera_entries(added_results)
+        self.view.camera_combo_box.setEnabled(self.view.camera_combo_box.count() > 0)
+
+    def open_control_writer(self, device_uri: str):
+        self.stop_control_events()
+        self.close_control_writer()
+        if device_uri is not None:
+            self.control_writer = Control_Writer(
+                device_uri, self.camera_inspector.set_controls,
+                on_written=self.device_event_bridge.controls_written.emit,
+                read_inactive=self.camera_inspector.get_inactive_ctrls)
+
+    def close_control_writer(self, wait: bool = False):
+        if self.control_writer is not None:
+            # Values still queued are written on the writer thread after the close
+            self.control_writer.close(wait)
+            if self.control_writer.stats.batches > 0:
+                print(f"Control writes on {self.control_writer.device_uri}: {self.control_writer.stats.summary()}")
+            self.control_writer = None
+
+    def set_ctl_value(self, setting, value, refresh=False):
+        # Written on the control writer thread; refresh re-reads the control states afterwards.
+        # With control events the driver reports the affected controls itself
+        self.last_written[setting] = time.monotonic()
+        if self.control_writer is not None:
+            self.control_writer.set(setting, value, refresh and self.control_event_listener is None)
+
+    def start_control_events(self, device_uri: str, ctrl_menu_list: list):
+        self.stop_control_events()
+        self.ctrl_menus_by_id = {}
+        for ctrl_menu in ctrl_menu_list:
+            try:
+                self.ctrl_menus_by_id[int(ctrl_menu.address, 16)] = ctrl_menu
+            except ValueError:
+                continue
+        # Events need the ioctl backend; otherwise the control list is re-read after changes
+        registry = getattr(self.camera_inspector, 'registry', None)
+        if registry is None or device_uri is None:
+            return
+        listener = Control_Event_Listener(device_uri, registry, list(self.ctrl_menus_by_id),
+                                          self.device_event_bridge.control_changed.emit)
+        if listener.start():
+            self.control_event_listener = listener
+
+    def stop_control_events(self):
+        if self.control_event_listener is not None:
+            self.control_event_listener.stop()
+            self.control_event_listener = None
+
+    def invalidate_queries(self, device_uri: str, queries: tuple = None):
+        """ Drop remembered answers about device_uri when the inspector keeps any (see camera_caps_memo.py) """
+        invalidate = getattr(self.camera_inspector, 'invalidate', None)
+        if invalidate is not None:
+            invalidate(device_uri, queries)
+
+    def on_control_event(self, device_uri, event):
+        # Another program, or the driver itself, changed a control
+        self.invalidate_queries(device_uri, Memo_Camera_Inspector.control_queries)
+        if device_uri != self.device_uri:
+            return
+        ctrl_menu = self.ctrl_menus_by_id.get(event.ctrl_id)
+        if ctrl_menu is None or ctrl_menu.title not in self.view.ctrl_dict:
+            return
+        widgets = self.view.ctrl_dict[ctrl_menu.title]
+        # Echoes of our own writes would drag a slider back while it is moving
+        recently_written = time.monotonic() - self.last_written.get(ctrl_menu.title, 0) < 1.0
+        if event.value_changed and not recently_written:
+            self.show_control_value(ctrl_menu, widgets, event.value)
+        if event.flags_changed:
+            for ctrl in widgets:
+                ctrl.setEnabled(not event.inactive)
+        if not event.inactive:
+            reset_button = widgets[-1]
+            reset_button.setEnabled(self.is_default_value(reset_button))
+
+    def show_control_value(self, ctrl_menu: Control_Menu_Entry, widgets: list, value: int):
+        """ Show a value changed elsewhere without writing it back to the device """
+        if 'int' == ctrl_menu.menu_type or 'int64' == ctrl_menu.menu_type:
+            controls = [widgets[1], widgets[2]]
+        else:
+            controls = [widgets[0]]
+        for ctrl in controls:
+            ctrl.blockSignals(True)
+        if 'int' == ctrl_menu.menu_type or 'int64' == ctrl_menu.menu_type:
+            widgets[1].setValue(value)
+            widgets[2].setValue(value)
+        elif 'bool' == ctrl_menu.menu_type:
+            widgets[0].setChecked(value != 0)
+        elif 'menu' == ctrl_menu.menu_type or 'intmenu' == ctrl_menu.menu_type:
+            lookup = [idx for idx, element in enumerate(
+                ctrl_menu.menu_list) if element[0] == str(value)]
+            if len(lookup) != 0:
+                widgets[0].setCurrentIndex(lookup[0])
+        for ctrl in controls:
+            ctrl.blockSignals(False)
 
-        except Exception as exc:
-            print(exc)
+    def on_controls_written(self, device_uri, values, inactive_list, error):
+        if error is not None:
+            print(f"Unable to set {values} on {device_uri}: {error}")
+        if inactive_list is not None and device_uri == self.device_uri:
+            # Changing one control can make others active or inactive
+            self.set_control_enabled_states(inactive_list)
 
     def add_ctrl_slider(self, ctrl_menu: Control_Menu_Entry):
         slider_menu_vbox = QVBoxLayout()
@@ -243,10 +439,11 @@ class Camera_Caps_Controller:
         layout = self.view.control_menu_frame.layout()
         layout.addLayout(combo_box_menu_hbox)
 
-    def setup_ctrl_menus(self, device_uri: str):
+    def setup_ctrl_menus(self, device_uri: str, ctrl_menu_list: list = None, inactive_list: list = None):
         layout = self.view.control_menu_frame.layout()
         self.view.clear_layout(layout)
-        ctrl_menu_list = self.camera_inspector.get_ctrl_menus(device_uri)
+        if ctrl_menu_list is None:
+            ctrl_menu_list = self.camera_inspector.get_ctrl_menus(device_uri)
         for ctrl_menu in ctrl_menu_list:
             try:
                 ...  # print(ctrl_menu.menu_type)
@@ -266,7 +463,8 @@ class Camera_Caps_Controller:
                     f"Unrecognized Menu type: {ctrl_menu.menu_type} named: {ctrl_menu.title}")
         layout = self.view.control_menu_frame.layout()
         layout.addStretch()
-        self.set_control_enabled_states()
+        self.set_control_enabled_states(inactive_list)
+        self.start_control_events(device_uri, ctrl_menu_list)
 
     def setup_camera_info(self, device_uri: str):
         # Get the camera info from the URI
@@ -307,24 +505,64 @@ class Camera_Caps_Controller:
         self.view.pixel_format_list.clear()
         self.view.image_size_list.clear()
         self.view.fps_list.clear()
+        self.format_items = {}
+        self.size_items = {}
+        self.interval_items = {}
         self.camera_location = None
         self.camera_formats = None
+        self.format_catalogue = Format_Catalogue()
         # The device uri is in the itemData of the combo box entry
         self.device_uri = self.view.camera_combo_box.itemData(combo_box_index)
-        if self.device_uri is not None:
-            self.camera_formats = self.camera_inspector.camera_formats(
-                self.device_uri)
-        if self.camera_formats is not None:
-            for camera_format in self.camera_formats:
-                format_name = f"{camera_format.pixel_format}"
-                item = QListWidgetItem(format_name)
-                item.camera_format = camera_format
-                self.view.pixel_format_list.addItem(item)
+        self.open_control_writer(self.device_uri)
+        self.cancel_camera_switch()
+        self.view.clear_layout(self.view.control_menu_frame.layout())
+        self.view.line_edit.setText("")
         self.setup_camera_info(self.device_uri)
-        video_settings = self.camera_inspector.get_camera_stream_settings(
-            self.device_uri)
+        if self.device_uri is None:
+            # The last camera was unplugged
+            return
+        # Formats, current settings and controls arrive in that order through on_camera_switch_stage
+        self.camera_switch = Camera_Switch(self.device_uri, self.camera_inspector,
+                                           self.device_event_bridge.camera_switch_stage.emit)
+        self.camera_switch.start()
+
+    def cancel_camera_switch(self):
+        if self.camera_switch is not None:
+            self.camera_switch.cancel()
+            self.camera_switch = None
+
+    def on_camera_switch_stage(self, camera_switch, stage, result):
+        if camera_switch is not self.camera_switch:
+            # The user has already moved on to another camera
+            return
+        if stage == 'formats':
+            self.setup_formats(result)
+        elif stage == 'settings':
+            self.setup_stream_settings(result)
+        elif stage == 'controls':
+            self.camera_switch = None
+            if result is None:
+                result = ([], [])
+            self.setup_ctrl_menus(camera_switch.device_uri, *result)
+
+    def setup_formats(self, camera_formats):
+        self.camera_formats = camera_formats
+        if self.camera_formats is None:
+            return
+        self.format_catalogue = Format_Catalogue(self.camera_formats)
+        for camera_format in self.camera_formats:
+            format_name = f"{camera_format.pixel_format}"
+            item = QListWidgetItem(format_name)
+            item.camera_format = camera_format
+            self.view.pixel_format_list.addItem(item)
+            self.format_items[camera_format.fourcc] = item
+
+    def setup_stream_settings(self, video_settings):
+        if video_settings is None:
+            video_settings = ["", "", ""]
 
         # String is of the format: 'YUYV' (YUYV 4:2:2)
+        fourcc = ""
         try:
             fourcc = video_settings[0].split("'")[1]
             self.camera_settings.fourcc = fourcc
@@ -334,176 +572,128 @@ class Camera_Caps_Controller:
         self.setup_gst_pipeline_source(fourcc)
         # setup the width, height, and frame rate
 
-        self.setup_ctrl_menus(self.device_uri)
-        # Set the current video pixel format, frame size, and frame duration
-
-        pixel_format = video_settings[0]
-        image_size = video_settings[1]
-        image_size = image_size.replace("/", "x")
-        frame_rate = video_settings[2]
-        frame_rate = frame_rate.split(" ", maxsplit=1)[0]
-
-        self.camera_settings.image_width, self.camera_settings.image_height = image_size.split('x')
-        if frame_rate == '':
-            frame_rate = '30'
-        frame_rate = frame_rate.split('.')[0]
-        self.camera_settings.frame_rate = frame_rate
+        image_size = video_settings[1].replace("/", "x")
+        try:
+            width, height = [int(value) for value in image_size.split('x')]
+        except ValueError:
+            width, height = 0, 0
+        self.camera_settings.image_width, self.camera_settings.image_height = str(width), str(height)
+        frame_interval = parse_frame_interval(video_settings[2])
+        if frame_interval is None:
+            self.camera_settings.frame_rate = '30'
+        else:
+            self.camera_settings.frame_rate = str(int(1 / frame_interval))
         # Construct gstreamer source pipelne
         preview_command = self.preview_command()
         self.view.line_edit.setText(preview_command)
         self.view.line_edit.setCursorPosition(0)
 
-        self.setup_frame_format(pixel_format, image_size, frame_rate)
         # select the current camera settings
-        self.setup_current_settings([pixel_format, image_size, frame_rate])
-        # self.setup_frame_format(fourcc, image_size, frame_rate)
-
-    def set_current_selection(self, list_widget, target_text, match_flag):
-        # Find items with the exact match of the target text
-        items = list_widget.findItems(target_text, match_flag)
-        # If the item is found, set it as the current item
-        if items:
-            list_widget.setCurrentItem(items[0])
-
-    # video_settings are the current settings read from the camera
-    def setup_current_settings(self, video_settings):
-        # Set the format widget
-        fourcc = video_settings[0].split("'")[1]
-
-        items = self.view.pixel_format_list.findItems(fourcc,Qt.MatchContains)
-        if items:
-            self.view.pixel_format_list.setCurrentItem(items[0])
-            # This populates the image size list; fake like we're clicking it to setup other lists
-            self.on_pixel_format_list_clicked(items[0])
-            self.set_current_selection(self.view.image_size_list, video_settings[1],Qt.MatchContains)
-            self.on_image_size_list_clicked(self.view.image_size_list.currentItem())
-            self.set_current_selection(self.view.fps_list, video_settings[2],Qt.MatchContains)
-
+        self.setup_current_settings(fourcc, width, height, frame_interval)
+
+    def setup_current_settings(self, fourcc: str, width: int, height: int, frame_interval):
+        """ Select the camera's current pixel format, frame size and frame interval in the lists """
+        format_item = self.format_items.get(fourcc)
+        if format_item is None:
+            return
+        self.view.pixel_format_list.setCurrentItem(format_item)
+        # This populates the image size list; fake like we're clicking it to setup other lists
+        self.on_pixel_format_list_clicked(format_item)
+        size_item = self.size_items.get((width, height))
+        if size_item is None:
+            # A size accepted by a stepwise range but not among the sizes offered
+            frame_size = self.format_catalogue.frame_size(fourcc, width, height)
+            if frame_size is None:
+                return
+            size_item = self.add_size_item(fourcc, frame_size)
+        self.view.image_size_list.setCurrentItem(size_item)
+        self.view.image_size_list.scrollToItem(size_item)
+        self.on_image_size_list_clicked(size_item)
+        if frame_interval is None or len(self.interval_items) == 0:
+            return
+        interval_item = self.interval_items.get(frame_interval)
+        if interval_item is None:
+            # v4l2-ctl rounds the rates it prints, take the closest one
+            closest = min(self.interval_items, key=lambda interval: abs(interval - frame_interval))
+            interval_item = self.interval_items[closest]
+        self.view.fps_list.setCurrentItem(interval_item)
+        self.view.fps_list.scrollToItem(interval_item)
+        self.on_fps_list_clicked(interval_item)
 
     def on_pixel_format_list_clicked(self, pixel_format: QListWidgetItem):
         self.view.image_size_list.clear()
         self.view.fps_list.clear()
+        self.size_items = {}
+        self.interval_items = {}
 
-        self.size_list = None
         camera_format = pixel_format.camera_format
-        fourcc = camera_format.pixel_format.split("'")[1]
+        fourcc = camera_format.fourcc
+        self.selected_fourcc = fourcc
+        self.selected_interval = None
         self.setup_gst_pipeline_source(fourcc)
 
-        self.size_list = camera_format.size_list
-        for frame_size in camera_format.size_list:
-            self.view.image_size_list.addItem(frame_size[0])
-        if len(self.size_list) > 0:
+        for frame_size in self.format_catalogue.frame_sizes(fourcc):
+            self.add_size_item(fourcc, frame_size)
+        if self.view.image_size_list.count() > 0:
             size_item_widget = self.view.image_size_list.item(0)
             size_item_widget.setSelected(True)
             self.view.image_size_list.scrollToItem(size_item_widget)
             self.on_image_size_list_clicked(size_item_widget)
 
+    def add_size_item(self, fourcc: str, frame_size) -> QListWidgetItem:
+        item = QListWidgetItem(frame_size.label)
+        item.fourcc = fourcc
+        item.frame_size = frame_size
+        self.view.image_size_list.addItem(item)
+        self.size_items[(frame_size.width, frame_size.height)] = item
+        return item
+
     def setup_gst_pipeline_source(self, fourcc: str):
         camera = self.get_camera(self.device_uri)
         self.gst_source = ""
-        self.gst_filters = ""
         self.camera_settings.fourcc = fourcc
         if camera.driver_name == 'tegra-camrtc-ca':
             sensor_id = self.device_uri.lstrip('/dev/video')
             self.gst_source = f"nvarguscamerasrc sensor-id={sensor_id}"
-            self.gst_filters = "video/x-raw(memory:NVMM), width={}, height={}, framerate={}/1 ! nvvidconv ! xvimagesink"
             self.camera_settings.fourcc = 'NVMM'
             self.camera_settings.media_type = 'video/x-raw(memory:NVMM)'
         elif camera.driver_name == 'uvcvideo':
             self.gst_source = f"v4l2src device={self.device_uri}"
-            try:
-                # Build the gstreamer caps filter
-                # command_base: str = '{}, width={}, height={}, framerate={}/1 ! format={} {} ! {}'
-                # base_command = Command_Map.command_base
-                filter_args = Command_Map.filter_types[fourcc]
-                crop_filter_args = Command_Map.crop_filter_types[fourcc]
- 
-                # self.gst_filters = Command_Map.filters[fourcc]
-                base_command = Command_Map.command_base.format(filter_args[0], '{}', '{}', '{}', 
-                                     filter_args[1], filter_args[2], filter_args[3])
-                self.gst_filters = base_command
-                crop_command = Command_Map.command_base.format(crop_filter_args[0], '{}', '{}', '{}', 
-                                     crop_filter_args[1], crop_filter_args[2], crop_filter_args[3])
-                self.crop_gst_filters = crop_command
-                self.camera_settings.media_type = filter_args[0]
-
-
-            except KeyError:
+            media_type, _ = fourcc_to_gst(fourcc)
+            if media_type is None:
                 print(f"Unsupported format: {fourcc}")
-                self.gst_filters = ""
+            else:
+                self.camera_settings.media_type = media_type
         else:
             print("Unknown camera driver type")
 
     def on_image_size_list_clicked(self, image_size: QListWidgetItem):
         self.view.fps_list.clear()
-        image_size_text = image_size.text()
-        image_size_text = image_size_text.lstrip('Discrete ')
-        self.camera_settings.image_width, self.camera_settings.image_height = image_size_text.split('x')
-        if self.camera_formats is not None:
-            if self.size_list is not None:
-                for frame_size in self.size_list:
-                    if frame_size[0] == image_size.text():
-                        for fps in frame_size[1:]:
-                            self.view.fps_list.addItem(fps)
-                        # Select the first item in the fps list
-                        if len(frame_size[1:]) > 0:
-                            fps_widget = self.view.fps_list.item(0)
-                            fps_widget.setSelected(True)
-                            self.view.fps_list.scrollToItem(fps_widget)
-                            self.on_fps_list_clicked(fps_widget)
-                        break
-            else:
-                # TODO Throw Exception
-                print("camera_formats not set correctly")
-
-        else:
-            # TODO Throw Exception
-            print("camera_formats not set correctly")
-
-    def setup_frame_format(self, pixel_format, image_size, frame_rate):
-        list_widget = self.view.pixel_format_list
-        count = list_widget.count()
-        count -= 1
-        while count >= 0:
-            list_widget_item: QListWidgetItem = list_widget.item(count)
-            camera_format: Camera_Format = list_widget_item.camera_format
-            camera_pixel_format = camera_format.pixel_format.split(" ")[0]
-            if camera_pixel_format == pixel_format:
-                list_widget_item.setSelected(True)
-                list_widget.scrollToItem(list_widget_item)
-                # Populate Image Sizes
-                self.view.image_size_list.clear()
-                self.size_list = None
-                self.size_list = camera_format.size_list
-                for frame_size in camera_format.size_list:
-                    frame_size_text = frame_size[0]
-                    frame_size_widget_item = QListWidgetItem(frame_size_text)
-                    self.view.image_size_list.addItem(frame_size_widget_item)
-                    if image_size in frame_size_text:
-                        frame_size_widget_item.setSelected(True)
-                        self.view.image_size_list.scrollToItem(
-                            frame_size_widget_item)
-                        # Populate Frame Rate
-                        fps_list = self.view.fps_list
-                        fps_list.clear()
-                        for frame_size in self.size_list:
-                            if image_size in frame_size[0]:
-                                for fps in frame_size[1:]:
-                                    fps_list_widget = QListWidgetItem(fps)
-                                    fps_list.addItem(fps_list_widget)
-                                    if frame_rate != "" and frame_rate in fps:
-                                        fps_list_widget.setSelected(True)
-                                        fps_list.scrollToItem(fps_list_widget)
-            count -= 1
+        self.interval_items = {}
+        if image_size is None:
+            return
+        frame_size = image_size.frame_size
+        self.camera_settings.image_width = str(frame_size.width)
+        self.camera_settings.image_height = str(frame_size.height)
+        for interval in self.format_catalogue.intervals(image_size.fourcc, frame_size.width, frame_size.height):
+            item = QListWidgetItem(format_interval(interval))
+            item.frame_interval = interval
+            self.view.fps_list.addItem(item)
+            self.interval_items[interval] = item
+        # Select the first item in the fps list
+        if self.view.fps_list.count() > 0:
+            fps_widget = self.view.fps_list.item(0)
+            fps_widget.setSelected(True)
+            self.view.fps_list.scrollToItem(fps_widget)
+            self.on_fps_list_clicked(fps_widget)
 
     def on_check_box_changed(self):
         check_box = self.view.sender()
         ctrl_menu = check_box.ctrl_menu
         if check_box.isChecked():
-            self.set_ctl_value(ctrl_menu.title, 1)
+            self.set_ctl_value(ctrl_menu.title, 1, refresh=True)
         else:
-            self.set_ctl_value(ctrl_menu.title, 0)
-        self.set_control_enabled_states()
+            self.set_ctl_value(ctrl_menu.title, 0, refresh=True)
         
     def on_slider_value_changed(self, value):
         slider = self.view.sender()
@@ -525,8 +715,7 @@ class Camera_Caps_Controller:
         combo_box = self.view.sender()
         ctrl_menu = combo_box.ctrl_menu
         menu_entry = ctrl_menu.menu_list[index]
-        self.set_ctl_value(ctrl_menu.title, int(menu_entry[0]))
-        self.set_control_enabled_states()
+        self.set_ctl_value(ctrl_menu.title, int(menu_entry[0]), refresh=True)
 
     def slider_reset_button_clicked(self):
         button = self.view.sender()
@@ -548,11 +737,11 @@ class Camera_Caps_Controller:
         ctrl_menu = bool_ctrl.ctrl_menu
         value = [item[1]
                  for item in ctrl_menu.key_value_list if item[0] == 'default'][0]
+        # A change in state writes the control through on_check_box_changed
         if value == '1':
             bool_ctrl.check_box.setChecked(True)
         else:
             bool_ctrl.check_box.setChecked(False)
-        self.set_control_enabled_states()
 
     def menu_reset_button_clicked(self):
         menu_reset = self.view.sender()
@@ -564,9 +753,9 @@ class Camera_Caps_Controller:
         # Find the index of the value in the menu list
         lookup = [idx for idx, element in enumerate(
             ctrl_menu.menu_list) if element[0] == value]
+        # A change in index writes the control through on_combo_box_changed
         if len(lookup) != 0:
             combo_box.setCurrentIndex(lookup[0])
-        self.set_control_enabled_states()
 
     def preview_button_clicked(self):
         preview_button = self.view.sender()
@@ -581,23 +770,80 @@ class Camera_Caps_Controller:
             preview_window = preview_window[0]
 
         if preview_window is not None:
-            # If camera is currently running, stop it
-            if preview_window.video_widget.has_video():
-                preview_window.video_widget.close_pipeline()
-            # Setup for new pipeline, start it, and show the window
-            preview_window.video_widget.setup_pipeline(command_line)
-            preview_window.video_widget.start_pipeline()
-            # Show the window and bring it to front
-            window_title = f"{preview_window.base_title} - '{self.camera_settings.fourcc}' {self.camera_settings.image_width}x{self.camera_settings.image_height}"
-            preview_window.setWindowTitle(window_title)
-            preview_window.show()
-            preview_window.activateWindow()
-            preview_window.raise_()
-            preview_window.camera_settings = replace(self.camera_settings)
-            print("Setting camera settings to: ")
-            print(generate_capsfilter_string(self.camera_settings))
+            video_widget = preview_window.video_widget
+            graph = None
+            if self.preview_pipeline_graph is not None and \
+                    command_line == self.preview_pipeline_graph.launch_string():
+                # Not edited by hand: let GStreamer's own registry choose the elements
+                load_gst()
+                command_line = self.preview_command()
+                line_edit.setText(command_line)
+                graph = self.preview_pipeline_graph
+            resumed = False
+            if not video_widget.has_video() and self.pipeline_pool is not None:
+                # A warm pipeline for the camera is resumed; one that cannot be used frees the device
+                entry, release = self.pipeline_pool.take(self.device_uri, command_line, graph)
+                if entry is not None:
+                    preview_window.forget_roi()
+                    video_widget.setup_pipeline(entry.command_line, entry.pipeline, entry.graph)
+                    resumed = entry.command_line == command_line
+                elif release is not None:
+                    video_widget.release = release
+            # Region of interest windows are fed from the stream being replaced or renegotiated,
+            # and the region does not fit a new frame size
+            preview_window.close_rois()
+            preview_window.reset_roi()
+            renegotiated = not resumed and video_widget.has_video() and \
+                video_widget.renegotiate(command_line, graph)
+            if resumed or renegotiated:
+                video_widget.start_pipeline()
+                self.invalidate_queries(self.device_uri, Memo_Camera_Inspector.format_queries)
+                self.show_preview(preview_window, replace(self.camera_settings))
+                return
+            # If camera is currently running, stop it; the new pipeline starts once the device is free
+            if video_widget.has_video():
+                video_widget.close_pipeline(self.device_uri, preview_window.driver_name)
+            pipeline = None if graph is None else graph.create()
+            # A preview still waiting from an earlier click is replaced; its pipeline never started
+            self.pending_previews[self.device_uri] = (preview_window, command_line, pipeline, graph,
+                                                      replace(self.camera_settings))
+            release = video_widget.pending_release()
+            if release is None:
+                self.start_preview(self.device_uri)
+            else:
+                release.notify(lambda release, seconds, error:
+                               self.device_event_bridge.pipeline_released.emit(release.device_uri))
         return
 
+    def start_preview(self, device_uri: str):
+        """ Start the preview waiting for device_uri, if there is one """
+        if device_uri not in self.pending_previews:
+            return
+        preview_window, command_line, pipeline, graph, camera_settings = self.pending_previews.pop(device_uri)
+        if preview_window not in self.view.preview_windows:
+            # The camera was unplugged meanwhile
+            return
+        # Setup for new pipeline, start it, and show the window
+        # The pipeline sets the stream format of the device
+        self.invalidate_queries(device_uri, Memo_Camera_Inspector.format_queries)
+        preview_window.forget_roi()
+        preview_window.video_widget.setup_pipeline(command_line, pipeline, graph)
+        preview_window.video_widget.start_pipeline()
+        self.show_preview(preview_window, camera_settings)
+
+    def show_preview(self, preview_window: PreviewWindow, camera_settings: CameraSettings):
+        # Show the window and bring it to front
+        window_title = f"{preview_window.base_title} - '{camera_settings.fourcc}' {camera_settings.image_width}x{camera_settings.image_height}"
+        preview_window.set_stream_title(window_title)
+        preview_window.show()
+        preview_window.activateWindow()
+        preview_window.raise_()
+        preview_window.camera_settings = camera_settings
+        # For the region of interest branches
+        preview_window.pipeline_builder = self.pipeline_builder()
+        print("Setting camera settings to: ")
+        print(generate_capsfilter_string(camera_settings))
+
     def copy_button_clicked(self):
         clipboard = QApplication.clipboard()
         copy_button = self.view.sender()
@@ -622,9 +868,10 @@ class Camera_Caps_Controller:
         ctrl menu list. This does *NOT* take into account any dynamic menus which may be added
         or subtracted by state change, that is, only existing ctrls are set """
 
-    def set_control_enabled_states(self):
-        inactive_list = self.camera_inspector.get_inactive_ctrls(
-            self.device_uri)
+    def set_control_enabled_states(self, inactive_list: list = None):
+        if inactive_list is None:
+            inactive_list = self.camera_inspector.get_inactive_ctrls(
+                self.device_uri)
         for key, value in self.view.ctrl_dict.items():
             active_flag = True
             if key in inactive_list:
@@ -675,10 +922,9 @@ class Camera_Caps_Controller:
         return to_return
 
     def on_fps_list_clicked(self, fps: QListWidgetItem):
-        fps_text = fps.text()
-        fps_text = fps_text.split("(")[1]
-        fps_text = fps_text.split(".")[0]
-        self.camera_settings.frame_rate = fps_text
+        # The capsfilter takes whole frames per second
+        self.camera_settings.frame_rate = str(int(1 / fps.frame_interval))
+        self.selected_interval = fps.frame_interval
         # Construct gstreamer
         preview_command = self.preview_command()
         self.view.line_edit.setText(preview_command)
@@ -713,27 +959,87 @@ class Camera_Caps_Controller:
         return crop_pipeline
 
     
-    def preview_command(self):
-        gst_filters = self.gst_filters
-        sync_value = self.view.sync_flag_checkbox.isChecked()
-        gst_filters = gst_filters.format(
-            self.camera_settings.image_width, self.camera_settings.image_height, self.camera_settings.frame_rate, sync_value)
-        crop_gst_filters = self.crop_gst_filters
-        if self.camera_settings.fourcc == 'YUY2' or self.camera_settings.fourcc == 'YUYV' :
-            crop_gst_filters = crop_gst_filters.format(
-            self.camera_settings.image_width, self.camera_settings.image_height, self.camera_settings.frame_rate, 
-                    self.camera_settings.image_width, self.camera_settings.image_height, sync_value)
+    def preview_caps(self):
+        """ (source element, caps) for the selected format, size and frame rate; None without a source """
+        width, height = int(self.camera_settings.image_width), int(self.camera_settings.image_height)
+        # Inspectors that know the source's own caps (GStreamer discovery) give them exactly
+        preview_source = getattr(self.camera_inspector, 'preview_source', None)
+        if preview_source is not None and self.selected_interval is not None:
+            source_caps = preview_source(self.device_uri, self.selected_fourcc, width, height,
+                                         self.selected_interval)
+            if source_caps is not None:
+                return source_caps
+        if self.gst_source == "":
+            return None
+        media_type = self.camera_settings.media_type
+        if 'memory:NVMM' in media_type:
+            gst_format = 'NV12'
         else:
-            crop_gst_filters = crop_gst_filters.format(
-                self.camera_settings.image_width, self.camera_settings.image_height, self.camera_settings.frame_rate, sync_value)
-        if True: 
-            preview_command = f"{self.gst_source} ! {crop_gst_filters}"
+            media_type, gst_format = fourcc_to_gst(self.selected_fourcc)
+            if media_type is None:
+                return None
+        if self.selected_interval is not None:
+            rate = 1 / self.selected_interval
+            framerate = f"{rate.numerator}/{rate.denominator}"
         else:
-            preview_command = f"{self.gst_source} ! {gst_filters}"
-        return preview_command
+            framerate = f"{self.camera_settings.frame_rate}/1"
+        fields = [media_type, f"width={width}", f"height={height}", f"framerate={framerate}"]
+        if gst_format is not None:
+            fields.append(f"format={gst_format}")
+        return self.gst_source, ", ".join(fields)
+
+    def pipeline_builder(self) -> Pipeline_Builder:
+        # The plugin files stand in for the GStreamer registry until a preview loads GStreamer
+        if self.element_registry is None or (isinstance(self.element_registry, Plugin_File_Registry)
+                                             and gst_loaded()):
+            self.element_registry = default_registry()
+        if self.calibration_ranking is None:
+            # An empty ranking when uncalibrated, so the file is read once
+            self.calibration_ranking = Calibration_Cache().ranking() or {}
+        return Pipeline_Builder(self.element_registry, self.calibration_ranking)
+
+    def preview_graph(self):
+        """ The Pipeline_Graph previewing the current selection, or None """
+        try:
+            source_caps = self.preview_caps()
+        except ValueError:
+            # No size selected yet
+            return None
+        if source_caps is None:
+            return None
+        source, caps = source_caps
+        source = Element_Spec.parse(source)
+        device_uri = source.properties.get('device')
+        if device_uri is not None and device_uri not in self.v4l2_crop_support:
+            self.v4l2_crop_support[device_uri] = supports_v4l2_crop(device_uri)
+        graph = self.pipeline_builder().preview(
+            source, caps, int(self.camera_settings.image_width),
+            int(self.camera_settings.image_height), self.view.sync_flag_checkbox.isChecked(),
+            v4l2_crop=self.v4l2_crop_support.get(device_uri, False))
+        if graph.missing:
+            print(f"No GStreamer element installed for: {', '.join(graph.missing)}")
+        return graph
+
+    def preview_command(self):
+        self.preview_pipeline_graph = self.preview_graph()
+        if self.preview_pipeline_graph is None:
+            return ""
+        return self.preview_pipeline_graph.launch_string()
 
     def app_quitting(self):
         """ The application is quitting, close any camera preview windows"""
         """ This is handled in the main script """
-        pass
+        if self.device_monitor is not None:
+            self.device_monitor.stop()
+        self.cancel_camera_switch()
+        self.stop_control_events()
+        # The last values reach the camera before the application exits
+        self.close_control_writer(wait=True)
+        stats = getattr(self.camera_inspector, 'stats', None)
+        if stats is not None:
+            print(f"Camera queries: {stats.summary()}")
+        if self.pipeline_pool is not None:
+            print(f"Warm pipelines: {self.pipeline_pool.stats.summary()}")
+            self.pipeline_pool.clear(wait=True)
+        print(f"Device releases: {release_stats.summary()}")
 
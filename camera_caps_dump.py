@@ -0,0 +1,136 @@
+#
+#  Camera Capabilities
+#
+#  Copyright (C) 2021-2024 JetsonHacks (info@jetsonhacks.com)
+#
+#  MIT License
+#
+#  Headless capability dump
+#  camera_caps.py --dump writes one JSON object per device node to stdout, each
+#  as soon as its probe finishes (NDJSON); --dump json writes a single array at
+#  the end instead. Only the model modules are loaded - no Qt, no GStreamer - so
+#  this runs from scripts and over ssh on machines without a display.
+#  Frame intervals are exact fractions in seconds per frame, written as "1/30".
+#
+import contextlib
+import json
+import sys
+from typing import List
+
+from camera_caps_model import (Camera_Format, Camera_Info, Camera_Report, Control_Menu_Entry,
+                               Interval_Range, parse_frame_interval)
+
+
+def interval_range_record(interval_range: Interval_Range) -> dict:
+    if interval_range is None:
+        return None
+    return {'min': str(interval_range.minimum), 'max': str(interval_range.maximum),
+            'step': str(interval_range.step)}
+
+
+def format_record(camera_format: Camera_Format) -> dict:
+    return {
+        'fourcc': camera_format.fourcc,
+        'pixel_format': camera_format.pixel_format,
+        'sizes': [{'width': frame_size.width, 'height': frame_size.height,
+                   'intervals': [str(interval) for interval in frame_size.intervals],
+                   'interval_range': interval_range_record(frame_size.interval_range)}
+                  for frame_size in camera_format.frame_sizes],
+        'size_ranges': [{'width': [size_range.min_width, size_range.max_width, size_range.step_width],
+                         'height': [size_range.min_height, size_range.max_height, size_range.step_height],
+                         'intervals': [str(interval) for interval in size_range.intervals],
+                         'interval_range': interval_range_record(size_range.interval_range)}
+                        for size_range in camera_format.frame_size_ranges],
+    }
+
+
+def control_record(ctrl_menu: Control_Menu_Entry) -> dict:
+    to_return = {'name': ctrl_menu.title, 'type': ctrl_menu.menu_type}
+    try:
+        to_return['id'] = int(ctrl_menu.address, 16)
+    except ValueError:
+        to_return['id'] = None
+    for key, value in ctrl_menu.key_value_list:
+        if key == 'flags':
+            continue
+        try:
+            to_return[key] = int(value)
+        except ValueError:
+            to_return[key] = value
+    to_return['flags'] = ctrl_menu.flags_list
+    if ctrl_menu.menu_list:
+        to_return['menu'] = {entry[0]: entry[1] for entry in ctrl_menu.menu_list}
+    return to_return
+
+
+def settings_record(stream_settings: List[str]) -> dict:
+    """ [pixel format, width/height, frames per second] as read from the device """
+    pixel_format, image_size, frame_rate = (list(stream_settings) + ["", "", ""])[:3]
+    to_return = {'pixel_format': pixel_format, 'width': None, 'height': None, 'interval': None}
+    try:
+        to_return['fourcc'] = pixel_format.split("'")[1]
+    except IndexError:
+        to_return['fourcc'] = ""
+    try:
+        to_return['width'], to_return['height'] = [int(value) for value in image_size.split('/')]
+    except ValueError:
+        pass
+    interval = parse_frame_interval(frame_rate)
+    if interval is not None:
+        to_return['interval'] = str(interval)
+    return to_return
+
+
+def node_record(camera: Camera_Info, report: Camera_Report) -> dict:
+    info = report.camera_info
+    return {
+        'uri': report.uri,
+        'camera': camera.camera_name,
+        'bus': camera.bus_address,
+        'driver': info.driver_name,
+        'driver_version': info.driver_version,
+        'capabilities': info.capabilities_list,
+        'device_caps': info.device_caps_list,
+        'formats': [format_record(camera_format) for camera_format in report.formats],
+        'controls': [control_record(ctrl_menu) for ctrl_menu in report.ctrl_menus],
+        'current': settings_record(report.stream_settings),
+    }
+
+
+def dump_cameras(inspector, output_format: str = 'ndjson', output=None) -> int:
+    """ Probe every device node and write its record; returns the exit status """
+    if output is None:
+        output = sys.stdout
+    records = []
+    failures = 0
+
+    def write(record):
+        if output_format == 'ndjson':
+            output.write(json.dumps(record) + "\n")
+            output.flush()
+        else:
+            records.append(record)
+
+    # The inspector reports problems with print(); keep them out of the JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        cameras = inspector.list_devices()
+        camera_by_uri = {uri: camera for camera in cameras for uri in camera.uri_list}
+
+        def on_result(probe_result):
+            nonlocal failures
+            camera = camera_by_uri[probe_result.uri]
+            if probe_result.error or probe_result.result is None:
+                failures += 1
+                write({'uri': probe_result.uri, 'camera': camera.camera_name,
+                       'bus': camera.bus_address, 'error': probe_result.error or "No response"})
+                return
+            write(node_record(camera, probe_result.result))
+
+        inspector.probe_devices(list(camera_by_uri), inspector.get_camera_report, on_result)
+    if output_format != 'ndjson':
+        # Same order as the device list, whatever order the probes finished in
+        order = {uri: index for index, uri in enumerate(camera_by_uri)}
+        records.sort(key=lambda record: order[record['uri']])
+        json.dump(records, output, indent=1)
+        output.write("\n")
+    return 1 if failures else 0
@@ -0,0 +1,597 @@
+#
+#  Camera Capabilities
+#
+#  Copyright (C) 2021-2024 JetsonHacks (info@jetsonhacks.com)
+#
+#  MIT License
+#
+#  GStreamer discovery
+#  --backend gst lists the cameras through Gst.DeviceMonitor (Video/Source) instead
+#  of v4l2-ctl. Each device reports the caps its source element (v4l2src,
+#  nvarguscamerasrc) will negotiate; those caps are mapped into Camera_Format so
+#  the format lists show exactly what GStreamer accepts, and preview pipelines are
+#  built from the caps themselves instead of caps written from the format name. Controls
+#  and current settings still come from v4l2-ctl. Device added/removed messages
+#  replace the inotify monitor.
+#
+#  Devices come from a provider: Gst_Monitor_Provider wraps Gst.DeviceMonitor,
+#  Fake_Device_Provider serves Gst_Device_Records made up from caps strings, so
+#  everything but the provider runs without GStreamer.
+#
+import queue
+import re
+import threading
+from dataclasses import dataclass, field
+from fractions import Fraction
+from typing import Callable, Dict, List, Tuple
+
+import v4l2_ioctl
+from camera_caps_model import (Camera_Format, Camera_Info, Camera_Inspector, Frame_Size,
+                               Frame_Size_Range, Interval_Range)
+
+# (media type, GStreamer format) -> (V4L2 fourcc, description); None matches any format
+GST_FORMATS: Dict[Tuple[str, str], Tuple[str, str]] = {
+    ('video/x-raw', 'YUY2'): ('YUYV', 'YUYV 4:2:2'),
+    ('video/x-raw', 'UYVY'): ('UYVY', 'UYVY 4:2:2'),
+    ('video/x-raw', 'YVYU'): ('YVYU', 'YVYU 4:2:2'),
+    ('video/x-raw', 'NV12'): ('NV12', 'Y/CbCr 4:2:0'),
+    ('video/x-raw', 'NV21'): ('NV21', 'Y/CrCb 4:2:0'),
+    ('video/x-raw', 'NV16'): ('NV16', 'Y/CbCr 4:2:2'),
+    ('video/x-raw', 'I420'): ('YU12', 'Planar YUV 4:2:0'),
+    ('video/x-raw', 'YV12'): ('YV12', 'Planar YVU 4:2:0'),
+    ('video/x-raw', 'GRAY8'): ('GREY', '8-bit Greyscale'),
+    ('video/x-raw', 'GRAY16_LE'): ('Y16 ', '16-bit Greyscale'),
+    ('video/x-raw', 'RGB'): ('RGB3', '24-bit RGB 8-8-8'),
+    ('video/x-raw', 'BGR'): ('BGR3', '24-bit BGR 8-8-8'),
+    ('video/x-bayer', 'bggr'): ('BA81', '8-bit Bayer BGBG/GRGR'),
+    ('video/x-bayer', 'gbrg'): ('GBRG', '8-bit Bayer GBGB/RGRG'),
+    ('video/x-bayer', 'grbg'): ('GRBG', '8-bit Bayer GRGR/BGBG'),
+    ('video/x-bayer', 'rggb'): ('RGGB', '8-bit Bayer RGRG/GBGB'),
+    ('image/jpeg', None): ('MJPG', 'Motion-JPEG'),
+    ('video/x-h264', None): ('H264', 'H.264'),
+    ('video/x-h265', None): ('HEVC', 'HEVC'),
+}
+
+
+def fourcc_to_gst(fourcc: str) -> Tuple[str, str]:
+    """ (media type, GStreamer format) of a V4L2 fourcc; the format is None for compressed video """
+    for (media_type, gst_format), (known, _) in GST_FORMATS.items():
+        if known == fourcc:
+            return media_type, gst_format
+    return None, None
+
+
+@dataclass
+class Caps_Range:
+    """ [ minimum, maximum ] or [ minimum, maximum, step ] """
+    minimum: object = 0
+    maximum: object = 0
+    step: object = None
+
+    def contains(self, value) -> bool:
+        if not self.minimum <= value <= self.maximum:
+            return False
+        return not self.step or (value - self.minimum) % self.step == 0
+
+
+@dataclass
+class Caps_Structure:
+    """ One structure of a caps string: video/x-raw, format=(string)YUY2, width=(int)640, ... """
+    name: str = ""
+    # Field name -> (type name or "", value); a value is a scalar, a list or a Caps_Range
+    fields: Dict[str, tuple] = field(default_factory=dict)
+
+    @property
+    def media_type(self) -> str:
+        """ The name without caps features: video/x-raw(memory:NVMM) -> video/x-raw """
+        return self.name.split('(')[0]
+
+    def value(self, name: str, default=None):
+        return self.fields.get(name, ("", default))[1]
+
+    def values(self, name: str) -> list:
+        """ A field as a list of the values or ranges it allows """
+        value = self.value(name)
+        if value is None:
+            return []
+        return value if isinstance(value, list) else [value]
+
+
+class _Caps_Parser:
+
+    """ Reads the serialized form of Gst.Caps and Gst.Structure (gst_caps_to_string) """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.position = 0
+
+    def peek(self) -> str:
+        self.skip_spaces()
+        return self.text[self.position:self.position + 1]
+
+    def skip_spaces(self):
+        while self.position < len(self.text) and self.text[self.position].isspace():
+            self.position += 1
+
+    def expect(self, character: str):
+        if self.peek() != character:
+            raise ValueError(f"Expected '{character}' at {self.position} in caps: {self.text}")
+        self.position += 1
+
+    def token(self, stops: str) -> str:
+        """ Up to the first unescaped stop character; backslash escapes are resolved """
+        self.skip_spaces()
+        characters = []
+        depth = 0
+        while self.position < len(self.text):
+            character = self.text[self.position]
+            if character == '\\' and self.position + 1 < len(self.text):
+                characters.append(self.text[self.position + 1])
+                self.position += 2
+                continue
+            if character == '(':
+                depth += 1
+            elif character == ')' and depth > 0:
+                depth -= 1
+            elif depth == 0 and character in stops:
+                break
+            characters.append(character)
+            self.position += 1
+        return "".join(characters).strip()
+
+    def quoted(self) -> str:
+        self.expect('"')
+        characters = []
+        while self.position < len(self.text) and self.text[self.position] != '"':
+            if self.text[self.position] == '\\':
+                self.position += 1
+            characters.append(self.text[self.position])
+            self.position += 1
+        self.position += 1
+        return "".join(characters)
+
+    def scalar(self, type_name: str):
+        if self.peek() == '"':
+            text = self.quoted()
+        else:
+            text = self.token(',;}]>')
+        return convert_value(type_name, text)
+
+    def value(self, type_name: str):
+        if self.peek() == '(':
+            self.position += 1
+            type_name = self.token(')')
+            self.expect(')')
+        opening = self.peek()
+        if opening in '{<':
+            closing = '}' if opening == '{' else '>'
+            self.position += 1
+            values = []
+            while self.peek() != closing:
+                values.append(self.value(type_name))
+                if self.peek() == ',':
+                    self.position += 1
+            self.position += 1
+            return type_name, [value for _, value in values]
+        if opening == '[':
+            self.position += 1
+            bounds = [self.value(type_name)[1]]
+            while self.peek() == ',':
+                self.position += 1
+                bounds.append(self.value(type_name)[1])
+            self.expect(']')
+            return type_name, Caps_Range(*bounds[:3])
+        return type_name, self.scalar(type_name)
+
+    def structure(self) -> Caps_Structure:
+        caps_structure = Caps_Structure(self.token(',;'))
+        while self.peek() == ',':
+            self.position += 1
+            name = self.token('=,;')
+            self.expect('=')
+            caps_structure.fields[name] = self.value("")
+        return caps_structure
+
+    def caps(self) -> List[Caps_Structure]:
+        structures = []
+        while self.peek() != '':
+            caps_structure = self.structure()
+            if caps_structure.name not in ('', 'ANY', 'EMPTY'):
+                structures.append(caps_structure)
+            if self.peek() == ';':
+                self.position += 1
+        return structures
+
+
+def convert_value(type_name: str, text: str):
+    if type_name in ('int', 'uint', 'int64', 'uint64', 'i', 'uint8'):
+        return int(text, 0)
+    if type_name in ('fraction', 'GstFraction'):
+        return Fraction(text)
+    if type_name in ('double', 'float', 'd', 'f'):
+        return float(text)
+    if type_name in ('boolean', 'b'):
+        return text.lower() in ('true', 'yes', '1', 't')
+    if type_name == '':
+        # Untyped values: the serializer only leaves numbers and plain words untyped
+        for convert in (int, Fraction):
+            try:
+                return convert(text)
+            except ValueError:
+                continue
+    return text
+
+
+def parse_caps(text: str) -> List[Caps_Structure]:
+    """ video/x-raw, format=(string)YUY2, width=(int)640, framerate=(fraction){ 30/1, 15/1 }; ... """
+    return _Caps_Parser(text).caps()
+
+
+def parse_structure(text: str) -> Caps_Structure:
+    """ A single Gst.Structure, such as the properties of a Gst.Device """
+    return _Caps_Parser(text).structure()
+
+
+def format_value(value) -> str:
+    if isinstance(value, bool):
+        return f"(boolean){'true' if value else 'false'}"
+    if isinstance(value, int):
+        return f"(int){value}"
+    if isinstance(value, Fraction):
+        return f"(fraction){value.numerator}/{value.denominator}"
+    if isinstance(value, float):
+        return f"(double){value}"
+    text = str(value)
+    if re.fullmatch(r'[\w.:/+-]+', text) is None:
+        text = '"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"'
+    return f"(string){text}"
+
+
+def format_structure(name: str, fields: dict) -> str:
+    return ", ".join([name] + [f"{key}={format_value(value)}" for key, value in fields.items()])
+
+
+def structure_fourccs(caps_structure: Caps_Structure) -> List[Tuple[str, str, str]]:
+    """ (V4L2 fourcc, description, GStreamer format or None) for each format the structure allows """
+    media_type = caps_structure.media_type
+    to_return = []
+    for gst_format in caps_structure.values('format') or [None]:
+        known = GST_FORMATS.get((media_type, gst_format)) or GST_FORMATS.get((media_type, None))
+        if known is not None:
+            to_return.append((known[0], known[1], gst_format))
+    return to_return
+
+
+def interval_choices(caps_structure: Caps_Structure) -> Tuple[List[Fraction], Interval_Range]:
+    """ The frame intervals (seconds per frame) of the structure's framerate field """
+    intervals = []
+    interval_range = None
+    for rate in caps_structure.values('framerate'):
+        if isinstance(rate, Caps_Range):
+            # Variable rate sources report [ 0/1, 2147483647/1 ]; a second per frame is slow enough
+            slowest = rate.minimum if rate.minimum > 0 else Fraction(1)
+            interval_range = Interval_Range(1 / Fraction(rate.maximum), 1 / Fraction(slowest))
+        elif rate != 0:
+            intervals.append(1 / Fraction(rate))
+    return intervals, interval_range
+
+
+def caps_to_formats(structures: List[Caps_Structure]) -> List[Camera_Format]:
+    """ Camera_Formats, in the order the formats first appear in the caps """
+    formats: Dict[str, Camera_Format] = {}
+    for caps_structure in structures:
+        intervals, interval_range = interval_choices(caps_structure)
+        widths, heights = caps_structure.values('width'), caps_structure.values('height')
+        for fourcc, description, _ in structure_fourccs(caps_structure):
+            camera_format = formats.get(fourcc)
+            if camera_format is None:
+                camera_format = Camera_Format(str(len(formats)), 'Video Capture', f"'{fourcc}' ({description})")
+                formats[fourcc] = camera_format
+            for width in widths:
+                for height in heights:
+                    if isinstance(width, Caps_Range) or isinstance(height, Caps_Range):
+                        width_range = width if isinstance(width, Caps_Range) else Caps_Range(width, width)
+                        height_range = height if isinstance(height, Caps_Range) else Caps_Range(height, height)
+                        camera_format.frame_size_ranges.append(Frame_Size_Range(
+                            width_range.minimum, width_range.maximum, width_range.step or 1,
+                            height_range.minimum, height_range.maximum, height_range.step or 1,
+                            list(intervals), interval_range))
+                        continue
+                    # v4l2src writes one structure per size; a size can also come in several
+                    frame_size = [size for size in camera_format.frame_sizes
+                                  if (size.width, size.height) == (width, height)]
+                    if len(frame_size) == 0:
+                        frame_size = Frame_Size(width, height)
+                        camera_format.frame_sizes.append(frame_size)
+                    else:
+                        frame_size = frame_size[0]
+                    frame_size.intervals += [interval for interval in intervals
+                                             if interval not in frame_size.intervals]
+                    if interval_range is not None:
+                        frame_size.interval_range = interval_range
+    return list(formats.values())
+
+
+def allows(values: list, value) -> bool:
+    return any(choice.contains(value) if isinstance(choice, Caps_Range) else choice == value
+               for choice in values)
+
+
+@dataclass
+class Gst_Device_Record:
+    """ What discovery needs from a Gst.Device """
+    display_name: str = ""
+    device_class: str = ""
+    # gst_caps_to_string of Gst.Device.get_caps()
+    caps: str = ""
+    # Gst.Device.get_properties(): device.path, v4l2.device.bus_info, ...
+    properties: dict = field(default_factory=dict)
+    # The factory of the element the device creates: v4l2src, nvarguscamerasrc
+    element_name: str = ""
+
+    @property
+    def uri(self) -> str:
+        path = self.properties.get('device.path') or self.properties.get('api.v4l2.path')
+        if path:
+            return path
+        if self.element_name == 'nvarguscamerasrc':
+            # No device node; the sensor id stands in for one
+            return f"argus://{self.properties.get('sensor-id', 0)}"
+        return ""
+
+
+class Gst_Camera:
+
+    """ One discovered device: its caps, and the formats and preview caps built from them """
+
+    def __init__(self, record: Gst_Device_Record):
+        self.record = record
+        self.structures = parse_caps(record.caps)
+        self.formats = caps_to_formats(self.structures)
+
+    @property
+    def uri(self) -> str:
+        return self.record.uri
+
+    def source_element(self) -> str:
+        if self.record.element_name == 'nvarguscamerasrc':
+            return f"nvarguscamerasrc sensor-id={self.record.properties.get('sensor-id', 0)}"
+        return f"v4l2src device={self.uri}"
+
+    def camera_info(self) -> Camera_Info:
+        properties = self.record.properties
+        camera_info = Camera_Info(properties.get('v4l2.device.card') or self.record.display_name,
+                                  properties.get('v4l2.device.bus_info') or properties.get('device.bus_path', ""),
+                                  [self.uri])
+        camera_info.driver_name = properties.get('v4l2.device.driver', "")
+        version = properties.get('v4l2.device.version')
+        if isinstance(version, int):
+            camera_info.driver_version = v4l2_ioctl.decode_version(version)
+        for caps_name, code_name, list_name in [('v4l2.device.capabilities', 'capabilities_code', 'capabilities_list'),
+                                                ('v4l2.device.device_caps', 'device_caps_code', 'device_caps_list')]:
+            capabilities = properties.get(caps_name)
+            if isinstance(capabilities, int):
+                setattr(camera_info, code_name, f"0x{capabilities:08x}")
+                setattr(camera_info, list_name, v4l2_ioctl.flags_to_names(
+                    capabilities, v4l2_ioctl.CAPABILITY_NAMES))
+        return camera_info
+
+    def preview_caps(self, fourcc: str, width: int, height: int, interval: Fraction) -> str:
+        """ The fixed caps for this format, size and interval, as the source reports them; None if not offered """
+        for caps_structure in self.structures:
+            gst_formats = [gst_format for known, _, gst_format in structure_fourccs(caps_structure) if known == fourcc]
+            if len(gst_formats) == 0:
+                continue
+            if not (allows(caps_structure.values('width'), width) and allows(caps_structure.values('height'), height)):
+                continue
+            rate = 1 / interval if interval else None
+            if rate is not None and caps_structure.values('framerate') and \
+                    not allows(caps_structure.values('framerate'), rate):
+                continue
+            fields = {}
+            if gst_formats[0] is not None:
+                fields['format'] = gst_formats[0]
+            fields['width'], fields['height'] = width, height
+            if rate is not None:
+                fields['framerate'] = rate
+            # Fixed fields such as pixel-aspect-ratio, colorimetry or stream-format come along
+            for name, (_, value) in caps_structure.fields.items():
+                if name not in fields and name not in ('format', 'framerate') \
+                        and not isinstance(value, (list, Caps_Range)):
+                    fields[name] = value
+            return format_structure(caps_structure.name, fields)
+        return None
+
+
+class Fake_Device_Provider:
+    """ Serves Gst_Device_Records; add() and remove() post events like a hotplug would """
+
+    def __init__(self, records: List[Gst_Device_Record] = None):
+        self.records = list(records or [])
+        self.events = queue.Queue()
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def devices(self) -> List[Gst_Device_Record]:
+        return list(self.records)
+
+    def add(self, record: Gst_Device_Record):
+        self.records.append(record)
+        self.events.put(('added', record))
+
+    def remove(self, record: Gst_Device_Record):
+        self.records.remove(record)
+        self.events.put(('removed', record))
+
+    def pop_event(self, timeout: float):
+        """ ('added' or 'removed', Gst_Device_Record), or None after timeout seconds """
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class Gst_Monitor_Provider:
+    """ Gst.DeviceMonitor for Video/Source devices """
+
+    def __init__(self):
+        from gst_loader import load_gst
+        self.Gst = load_gst()
+        self.monitor = self.Gst.DeviceMonitor.new()
+        self.monitor.add_filter('Video/Source', None)
+        self.started = False
+
+    def start(self):
+        if not self.started:
+            self.started = self.monitor.start()
+
+    def stop(self):
+        if self.started:
+            self.monitor.stop()
+            self.started = False
+
+    def record(self, device) -> Gst_Device_Record:
+        caps = device.get_caps()
+        properties = device.get_properties()
+        element = device.create_element(None)
+        factory = element.get_factory() if element is not None else None
+        return Gst_Device_Record(
+            device.get_display_name(), device.get_device_class(),
+            caps.to_string() if caps is not None else "",
+            {name: value for name, (_, value) in parse_structure(properties.to_string()).fields.items()}
+            if properties is not None else {},
+            factory.get_name() if factory is not None else "")
+
+    def devices(self) -> List[Gst_Device_Record]:
+        self.start()
+        return [self.record(device) for device in self.monitor.get_devices()]
+
+    def pop_event(self, timeout: float):
+        Gst = self.Gst
+        message = self.monitor.get_bus().timed_pop_filtered(
+            int(timeout * Gst.SECOND), Gst.MessageType.DEVICE_ADDED | Gst.MessageType.DEVICE_REMOVED)
+        if message is None:
+            return None
+        if message.type == Gst.MessageType.DEVICE_ADDED:
+            return 'added', self.record(message.parse_device_added())
+        return 'removed', self.record(message.parse_device_removed())
+
+
+class Gst_Device_Discovery:
+
+    """ Reports device nodes added and removed, like Device_Monitor, from provider events """
+
+    def __init__(self, inspector, on_change: Callable, poll_interval: float = 0.5):
+        self.inspector = inspector
+        # on_change(added uris, removed uris) is called from the discovery thread
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.inspector.provider.start()
+        self.thread = threading.Thread(target=self.run, name='gst-device-discovery', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=2 * self.poll_interval)
+            self.thread = None
+
+    def run(self):
+        while not self.stop_event.is_set():
+            event = self.inspector.provider.pop_event(self.poll_interval)
+            if event is not None:
+                self.handle(*event)
+
+    def handle(self, kind: str, record: Gst_Device_Record):
+        uri = record.uri
+        if kind == 'added':
+            # Providers announce the devices present at start as well
+            if uri in self.inspector.cameras:
+                return
+            self.inspector.cameras[uri] = Gst_Camera(record)
+            self.on_change([uri], [])
+        elif self.inspector.cameras.pop(uri, None) is not None:
+            self.on_change([], [uri])
+
+
+class Gst_Camera_Inspector(Camera_Inspector):
+
+    """ Camera_Inspector that lists cameras and formats from GStreamer device discovery
+    Controls, current settings and anything a device does not report through its caps
+    (the 10 bit Bayer formats of CSI sensors, for example) come from v4l2-ctl.
+    """
+
+    def __init__(self, provider=None):
+        if provider is None:
+            provider = Gst_Monitor_Provider()
+        self.provider = provider
+        # uri -> Gst_Camera
+        self.cameras = {}
+
+    def refresh(self):
+        self.cameras = {}
+        for record in self.provider.devices():
+            camera = Gst_Camera(record)
+            if camera.uri:
+                self.cameras[camera.uri] = camera
+
+    def query_devices(self, uris: List[str] = None) -> List:
+        """ The discovered devices, grouped by bus address like v4l2-ctl --list-devices """
+        self.refresh()
+        to_return = []
+        cameras = {}
+        for uri, gst_camera in sorted(self.cameras.items(),
+                                      key=lambda item: int(re.sub(r'\D', '', item[0]) or 0)):
+            node = gst_camera.camera_info()
+            camera_info = cameras.get(node.bus_address) if node.bus_address else None
+            if camera_info is None:
+                cameras[node.bus_address] = node
+                to_return.append(node)
+            else:
+                camera_info.uri_list.append(uri)
+        if len(to_return) == 0:
+            return super().query_devices(uris)
+        return to_return
+
+    def describe_node(self, device_uri: str) -> Camera_Info:
+        gst_camera = self.cameras.get(device_uri)
+        if gst_camera is None:
+            return super().describe_node(device_uri)
+        return gst_camera.camera_info()
+
+    def camera_formats(self, device_uri: str):
+        gst_camera = self.cameras.get(device_uri)
+        if gst_camera is None or len(gst_camera.formats) == 0:
+            return super().camera_formats(device_uri)
+        return gst_camera.formats
+
+    def get_camera_report(self, device_uri: str):
+        report = super().get_camera_report(device_uri)
+        gst_camera = self.cameras.get(device_uri)
+        if report is not None and gst_camera is not None and len(gst_camera.formats) > 0:
+            report.formats = gst_camera.formats
+        return report
+
+    def preview_source(self, device_uri: str, fourcc: str, width: int, height: int,
+                       interval: Fraction) -> Tuple[str, str]:
+        """ (source element, fixed caps) for a preview, or None when the device's caps do not offer it """
+        gst_camera = self.cameras.get(device_uri)
+        if gst_camera is None:
+            return None
+        caps = gst_camera.preview_caps(fourcc, width, height, interval)
+        if caps is None:
+            return None
+        return gst_camera.source_element(), caps
+
+    def create_device_monitor(self, on_change: Callable) -> Gst_Device_Discovery:
+        return Gst_Device_Discovery(self, on_change)
@@ -0,0 +1,184 @@
+#
+#  Camera Capabilities
+#
+#  Copyright (C) 2021-2024 JetsonHacks (info@jetsonhacks.com)
+#
+#  MIT License
+#
+#  Session memo
+#  The GUI asks for the same per-device answers more than once: formats at startup
+#  to check the camera has any, again when it is selected, controls after every
+#  change. Memo_Camera_Inspector keeps each answer in memory for the session, keyed
+#  by query and device uri, until it is invalidated. Identical requests that arrive
+#  while the query is still running (startup probing, a camera switch and a hotplug
+#  at once) wait for that one query instead of starting their own.
+#  Writing controls invalidates that device's control answers; starting a stream or
+#  a hotplug event invalidates the rest through invalidate().
+#
+import threading
+from concurrent.futures import CancelledError, Future
+from dataclasses import dataclass
+from typing import List
+
+
+@dataclass
+class Memo_Stats:
+    hits: int = 0
+    misses: int = 0
+    # Requests that waited for an identical query already running
+    shared: int = 0
+    invalidations: int = 0
+
+    def summary(self) -> str:
+        requests = self.hits + self.misses + self.shared
+        return (f"{requests} queries, {self.hits} hits, {self.shared} shared, {self.misses} misses, "
+                f"{self.invalidations} entries invalidated")
+
+
+class Memo_Camera_Inspector:
+
+    """ Wraps a Camera_Inspector, remembering the per-device query results
+    Results are shared between callers, so they must not be modified. Failed
+    queries (exceptions) are not remembered. Everything not memoized is passed
+    through to the inspector.
+    """
+
+    # Queries that answer with device state changed by writing controls
+    control_queries = ('get_ctrl_menus', 'get_inactive_ctrls', 'get_camera_report')
+    # Queries that answer with the current stream format
+    format_queries = ('camera_formats', 'get_camera_stream_settings', 'get_camera_report')
+
+    def __init__(self, inspector):
+        self.inspector = inspector
+        self.stats = Memo_Stats()
+        # (query, device uri) -> Future; a Future that is not done is a query in flight
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.inspector, name)
+
+    def memo(self, query: str, device_uri: str):
+        key = (query, device_uri)
+        while True:
+            with self.lock:
+                future = self.entries.get(key)
+                if future is None:
+                    future = Future()
+                    self.entries[key] = future
+                    self.stats.misses += 1
+                    break
+                if future.done():
+                    self.stats.hits += 1
+                else:
+                    self.stats.shared += 1
+            try:
+                return future.result()
+            except CancelledError:
+                # The caller that submitted the query cancelled it; forget it and ask again
+                with self.lock:
+                    if self.entries.get(key) is future:
+                        del self.entries[key]
+        try:
+            result = getattr(self.inspector, query)(device_uri)
+        except BaseException as exc:
+            with self.lock:
+                if self.entries.get(key) is future:
+                    del self.entries[key]
+            future.set_exception(exc)
+            raise
+        future.set_result(result)
+        return result
+
+    def submit_query(self, query: str, device_uri: str) -> Future:
+        """ Start query(device_uri) without waiting; returns a Future whose cancel() cancels it
+        The answer is remembered as with memo. Through a Sync_Camera_Inspector the query
+        runs on its event loop and cancelling kills its v4l2-ctl; other inspectors run it
+        on a thread of its own, which cannot be stopped once started.
+        """
+        key = (query, device_uri)
+        with self.lock:
+            shared = self.entries.get(key)
+            if shared is None:
+                self.stats.misses += 1
+                submit = getattr(self.inspector, 'submit', None)
+                async_inspector = getattr(self.inspector, 'async_inspector', None)
+                if submit is not None and async_inspector is not None:
+                    future = submit(getattr(async_inspector, query)(device_uri))
+                else:
+                    future = Future()
+                    threading.Thread(target=_run_query, args=(future, getattr(self.inspector, query), device_uri),
+                                     name=f"camera-query {query}", daemon=True).start()
+                self.entries[key] = future
+            elif shared.done():
+                self.stats.hits += 1
+            else:
+                self.stats.shared += 1
+        if shared is not None:
+            # Cancelling must not cancel the answer for the other callers
+            waiter = Future()
+            shared.add_done_callback(lambda done: _copy_outcome(done, waiter))
+            return waiter
+
+        def forget(done):
+            # Failed and cancelled queries are not remembered
+            if done.cancelled() or done.exception() is not None:
+                with self.lock:
+                    if self.entries.get(key) is done:
+                        del self.entries[key]
+
+        future.add_done_callback(forget)
+        return future
+
+    def invalidate(self, device_uri: str = None, queries: tuple = None):
+        """ Forget the answers for device_uri (all devices if None) to the queries (all if None)
+        A query in flight finishes for the callers already waiting on it; later callers query again.
+        """
+        with self.lock:
+            stale = [key for key in self.entries
+                     if (device_uri is None or key[1] == device_uri) and (queries is None or key[0] in queries)]
+            for key in stale:
+                del self.entries[key]
+            self.stats.invalidations += len(stale)
+
+    def camera_formats(self, device_uri: str) -> List:
+        return self.memo('camera_formats', device_uri)
+
+    def get_ctrl_menus(self, device_uri: str) -> List:
+        return self.memo('get_ctrl_menus', device_uri)
+
+    def get_inactive_ctrls(self, device_uri: str) -> List:
+        return self.memo('get_inactive_ctrls', device_uri)
+
+    def get_camera_stream_settings(self, device_uri: str) -> List:
+        return self.memo('get_camera_stream_settings', device_uri)
+
+    def get_camera_report(self, device_uri: str):
+        return self.memo('get_camera_report', device_uri)
+
+    def set_controls(self, device_uri: str, values: dict) -> None:
+        try:
+            self.inspector.set_controls(device_uri, values)
+        finally:
+            # Even a failed batch may have written some of its values
+            self.invalidate(device_uri, self.control_queries)
+
+
+def _run_query(future: Future, query, device_uri: str):
+    if not future.set_running_or_notify_cancel():
+        return
+    try:
+        future.set_result(query(device_uri))
+    except BaseException as exc:
+        future.set_exception(exc)
+
+
+def _copy_outcome(done: Future, waiter: Future):
+    if not waiter.set_running_or_notify_cancel():
+        return
+    if done.cancelled():
+        waiter.set_exception(CancelledError())
+    elif done.exception() is not None:
+        waiter.set_exception(done.exception())
+    else:
+        waiter.set_result(done.result())
@@ -5,10 +5,17 @@
 #
 #  MIT License
 #
+import importlib.util
 import subprocess
 import re
+import queue
+import threading
+import time
 
-from typing import ClassVar, List
+import v4l2_ioctl
+
+from fractions import Fraction
+from typing import Callable, ClassVar, List
 from dataclasses import dataclass, field
 
 
@@ -43,6 +50,158 @@ class Control_Menu_Entry:
     menu_list: list = field(default_factory=list)
 
 
+@dataclass
+class Probe_Result:
+    uri: str = ""
+    result: object = None
+    # Empty when the probe succeeded
+    error: str = ""
+
+
+@dataclass
+class Camera_Report:
+    """ Everything known about one device node, gathered in a single query """
+    uri: str = ""
+    camera_info: Camera_Info = None
+    formats: list = field(default_factory=list)
+    ctrl_menus: list = field(default_factory=list)
+    inactive_ctrls: list = field(default_factory=list)
+    # [pixel format, width/height, frames per second], see get_camera_stream_settings
+    stream_settings: list = field(default_factory=list)
+
+
+# Frame sizes and rates offered when a device accepts a range rather than a list
+common_frame_sizes: List[tuple] = [(320, 240), (640, 480), (800, 600), (1024, 768), (1280, 720),
+                                   (1280, 960), (1600, 1200), (1920, 1080), (2560, 1440), (3840, 2160)]
+common_frame_rates: List[int] = [120, 90, 60, 50, 30, 25, 24, 20, 15, 10, 5]
+
+
+def format_interval(interval: Fraction) -> str:
+    """ Frame interval as v4l2-ctl shows it: 0.033s (30.000 fps) """
+    return f"{float(interval):.3f}s ({float(1 / interval):.3f} fps)"
+
+
+def parse_frame_interval(frame_rate: str) -> Fraction:
+    """ Frames per second: 30.000 (30/1) -> Fraction(1, 30); None if there is no rate """
+    match = re.search(r'\((\d+)/(\d+)\)', frame_rate)
+    if match:
+        if int(match.group(1)) == 0 or int(match.group(2)) == 0:
+            return None
+        return Fraction(int(match.group(2)), int(match.group(1)))
+    try:
+        return 1 / Fraction(frame_rate.split(" ", maxsplit=1)[0])
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
+@dataclass
+class Interval_Range:
+    """ Stepwise or continuous frame intervals, in seconds """
+    minimum: Fraction = Fraction(0)
+    maximum: Fraction = Fraction(0)
+    # 0 when any interval between minimum and maximum is accepted
+    step: Fraction = Fraction(0)
+
+    def contains(self, interval: Fraction) -> bool:
+        if not self.minimum <= interval <= self.maximum:
+            return False
+        return self.step == 0 or (interval - self.minimum) % self.step == 0
+
+    def expand(self) -> List[Fraction]:
+        """ Both ends of the range and the common frame rates inside it, fastest first """
+        candidates = [self.minimum, self.maximum] + [Fraction(1, rate) for rate in common_frame_rates]
+        return sorted(set(interval for interval in candidates
+                          if interval != 0 and self.contains(interval)))
+
+
+@dataclass
+class Frame_Size:
+    width: int = 0
+    height: int = 0
+    # Frame intervals (seconds per frame) as exact fractions
+    intervals: List[Fraction] = field(default_factory=list)
+    interval_range: Interval_Range = None
+    # Picked out of a Frame_Size_Range rather than listed by the device
+    from_range: bool = False
+
+    @property
+    def label(self) -> str:
+        if self.from_range:
+            return f"Stepwise {self.width}x{self.height}"
+        return f"Discrete {self.width}x{self.height}"
+
+    def all_intervals(self) -> List[Fraction]:
+        if self.interval_range is None:
+            return self.intervals
+        return sorted(set(self.intervals + self.interval_range.expand()))
+
+
+@dataclass
+class Frame_Size_Range:
+    """ Stepwise or continuous frame sizes. Sensors behind CSI bridges can accept
+    thousands of sizes, so only the triple is kept; expand() picks a usable few
+    """
+    min_width: int = 0
+    max_width: int = 0
+    step_width: int = 1
+    min_height: int = 0
+    max_height: int = 0
+    step_height: int = 1
+    # Intervals at the largest size; drivers rarely report them per size
+    intervals: List[Fraction] = field(default_factory=list)
+    interval_range: Interval_Range = None
+
+    @property
+    def continuous(self) -> bool:
+        return self.step_width == 1 and self.step_height == 1
+
+    @property
+    def label(self) -> str:
+        size_range = f"{self.min_width}x{self.min_height} - {self.max_width}x{self.max_height}"
+        if self.continuous:
+            return f"Continuous {size_range}"
+        return f"Stepwise {size_range} with step {self.step_width}/{self.step_height}"
+
+    def contains(self, width: int, height: int) -> bool:
+        if not (self.min_width <= width <= self.max_width and self.min_height <= height <= self.max_height):
+            return False
+        return ((width - self.min_width) % max(self.step_width, 1) == 0
+                and (height - self.min_height) % max(self.step_height, 1) == 0)
+
+    def frame_size(self, width: int, height: int) -> Frame_Size:
+        return Frame_Size(width, height, list(self.intervals), self.interval_range, from_range=True)
+
+    def expand(self) -> List[Frame_Size]:
+        """ The smallest and largest size plus the common sizes that fit, snapped down to the step """
+        candidates = [(self.min_width, self.min_height), (self.max_width, self.max_height)]
+        for width, height in common_frame_sizes:
+            if width > self.max_width or height > self.max_height:
+                continue
+            if width < self.min_width or height < self.min_height:
+                continue
+            width -= (width - self.min_width) % max(self.step_width, 1)
+            height -= (height - self.min_height) % max(self.step_height, 1)
+            candidates.append((width, height))
+        sizes = sorted(set(candidates), key=lambda size: (size[0] * size[1], size[0]))
+        return [self.frame_size(width, height) for width, height in sizes]
+
+
+def parse_interval_range(value: str) -> Interval_Range:
+    """ Stepwise 0.033s - 1.000s with step 0.000s (1.000-30.000 fps)
+    Continuous 0.033s - 1.000s (1.000-30.000 fps)
+    The rates carry the same precision as the seconds, and the ends are exact for whole rates
+    """
+    match = re.fullmatch(r'(Stepwise|Continuous) [\d.]+s - [\d.]+s(?: with step ([\d.]+)s)? '
+                         r'\(([\d.]+)-([\d.]+) fps\)', value)
+    if match is None:
+        return None
+    slowest, fastest = Fraction(match.group(3)), Fraction(match.group(4))
+    if slowest == 0 or fastest == 0:
+        return None
+    step = Fraction(match.group(2)) if match.group(2) is not None else Fraction(0)
+    return Interval_Range(1 / fastest, 1 / slowest, step)
+
+
 @dataclass
 class Camera_Format:
 
@@ -52,9 +211,20 @@ class Camera_Format:
 
     index: str = ""
     type: str = ""
+    # Example: 'YUYV' (YUYV 4:2:2)
     pixel_format: str = ""
     format_name: str = ""
-    size_list: list = field(default_factory=list)
+    frame_sizes: List[Frame_Size] = field(default_factory=list)
+    frame_size_ranges: List[Frame_Size_Range] = field(default_factory=list)
+    # The size the following Interval lines belong to
+    last_size: object = field(default=None, repr=False, compare=False)
+
+    @property
+    def fourcc(self) -> str:
+        try:
+            return self.pixel_format.split("'")[1]
+        except IndexError:
+            return ""
 
     def set_attribute(self, key: str, value: str) -> None:
         attr_name = None
@@ -69,15 +239,114 @@ class Camera_Format:
             try:
                 size_name = self.size_names[key]
                 if size_name == 'size':
-                    self.size_list.append([value])
+                    self.add_size(value)
                 elif size_name == 'interval':
-                    self.size_list[-1].append(value)
+                    self.add_interval(value)
                 else:
                     print('Bad size_name')
             except KeyError:
                 # TODO Throw exception here
                 print(f"Could not find key: {key}")
 
+    def add_size(self, value: str) -> None:
+        # Discrete 640x480
+        # Stepwise 16x16 - 1920x1080 with step 8/8
+        # Continuous 16x16 - 1920x1080
+        self.last_size = None
+        match = re.fullmatch(r'Discrete (\d+)x(\d+)', value)
+        if match:
+            self.last_size = Frame_Size(int(match.group(1)), int(match.group(2)))
+            self.frame_sizes.append(self.last_size)
+            return
+        match = re.fullmatch(r'(Stepwise|Continuous) (\d+)x(\d+) - (\d+)x(\d+)(?: with step (\d+)/(\d+))?', value)
+        if match is None:
+            print(f"Unknown frame size: {value}")
+            return
+        step_width, step_height = 1, 1
+        if match.group(6) is not None:
+            step_width, step_height = int(match.group(6)), int(match.group(7))
+        self.last_size = Frame_Size_Range(int(match.group(2)), int(match.group(4)), step_width,
+                                          int(match.group(3)), int(match.group(5)), step_height)
+        self.frame_size_ranges.append(self.last_size)
+
+    def add_interval(self, value: str) -> None:
+        if self.last_size is None:
+            return
+        # Discrete 0.033s (30.000 fps)
+        # v4l2-ctl rounds to three decimals, so the rate is the more exact of the two
+        match = re.fullmatch(r'Discrete [\d.]+s \(([\d.]+) fps\)', value)
+        if match:
+            if Fraction(match.group(1)) != 0:
+                self.last_size.intervals.append(1 / Fraction(match.group(1)))
+            return
+        interval_range = parse_interval_range(value)
+        if interval_range is None:
+            print(f"Unknown frame interval: {value}")
+            return
+        self.last_size.interval_range = interval_range
+
+
+class Format_Catalogue:
+
+    """ The formats of one device, indexed by (fourcc, width, height) so the
+    image size and frame rate lists can be filled and matched without string searches.
+    Size ranges are expanded the first time a format's sizes are asked for.
+    """
+
+    def __init__(self, formats: List[Camera_Format] = None):
+        self.formats = {}
+        self.index = {}
+        # fourcc -> sizes picked out of the format's ranges
+        self.expanded = {}
+        for camera_format in formats or []:
+            self.add(camera_format)
+
+    def add(self, camera_format: Camera_Format):
+        fourcc = camera_format.fourcc
+        self.formats[fourcc] = camera_format
+        self.expanded.pop(fourcc, None)
+        for frame_size in camera_format.frame_sizes:
+            self.index[(fourcc, frame_size.width, frame_size.height)] = frame_size
+
+    def format(self, fourcc: str) -> Camera_Format:
+        return self.formats.get(fourcc)
+
+    def frame_sizes(self, fourcc: str) -> List[Frame_Size]:
+        camera_format = self.formats.get(fourcc)
+        if camera_format is None:
+            return []
+        if fourcc not in self.expanded:
+            expanded = []
+            for size_range in camera_format.frame_size_ranges:
+                for frame_size in size_range.expand():
+                    key = (fourcc, frame_size.width, frame_size.height)
+                    if key not in self.index:
+                        self.index[key] = frame_size
+                        expanded.append(frame_size)
+            self.expanded[fourcc] = expanded
+        return camera_format.frame_sizes + self.expanded[fourcc]
+
+    def frame_size(self, fourcc: str, width: int, height: int) -> Frame_Size:
+        """ The listed size, or one made from a range that accepts it """
+        key = (fourcc, width, height)
+        frame_size = self.index.get(key)
+        if frame_size is None and fourcc in self.formats:
+            for size_range in self.formats[fourcc].frame_size_ranges:
+                if size_range.contains(width, height):
+                    frame_size = size_range.frame_size(width, height)
+                    self.index[key] = frame_size
+                    break
+        return frame_size
+
+    def intervals(self, fourcc: str, width: int, height: int) -> List[Fraction]:
+        frame_size = self.frame_size(fourcc, width, height)
+        if frame_size is None:
+            return []
+        return frame_size.all_intervals()
+
+    def __contains__(self, key) -> bool:
+        return self.frame_size(*key) is not None
+
 
 class Camera_Inspector:
 
@@ -89,55 +358,72 @@ class Camera_Inspector:
     Some devices have multiple uris, such as depth cameras
     """
 
-    def get_control_list_menus(self, uri: str):
-        try:
-            to_return = subprocess.check_output(
-                ["v4l2-ctl", "-d", uri, "--list-ctrls-menus"], encoding='utf-8')
-        except Exception as exc:
-            print(exc)
-            to_return = None
-        return to_return
+    # Devices are probed in parallel; a slow UVC device should not hold up the others
+    probe_workers: int = 4
+    # Seconds before a probe of a single device is reported as hung
+    probe_timeout: float = 10.0
+    # Lists the cameras without asking the devices, e.g. a Sysfs_Enumerator; None to always ask
+    device_enumerator = None
 
-    def get_camera_info(self, camera: Camera_Info):
-        try:
-            # We use the first uri in the camera list to get the device info
-            # That may be incorrect, cameras that have multiple URIs (like depth cameras)
-            # may have different info for each stream ...
-            uri = camera.uri_list[0]
-            if uri is None:
-                print(f"Unable to find camera device URI: {camera.title}")
-                return
-            camera_info = subprocess.check_output(
-                ["v4l2-ctl", "--info", "-d", uri], encoding='utf-8')
-        except Exception as exc:
-            # TODO Propogate Exception
-            print(f"Unable to get device info: {exc}")
-        # Parse everything into a dictionary
-        info_dict = {'capabilities_list': [], 'device_caps_list': []}
-        for line in camera_info.splitlines():
-            if len(line) == 0:
-                continue
+    def probe_devices(self, uris: List[str], probe: Callable, on_result: Callable = None) -> List[Probe_Result]:
+        """ Run probe(uri) for every uri, at most probe_workers at a time
+        Results are returned in the order of uris. A probe that raises or runs longer
+        than probe_timeout is reported in Probe_Result.error and does not hold back the
+        others: its thread is abandoned and a new one takes its place for the devices
+        still waiting. on_result, if given, is called with each Probe_Result as it completes.
+        """
+        results = [Probe_Result(uri) for uri in uris]
+        waiting = list(range(len(uris)))
+        # Index -> when its probe started, for the probes still counted as running
+        running = {}
+        finished = queue.Queue()
+
+        def run_probe(index):
             try:
-                key, value = line.split(':', maxsplit=1)
-                info_dict[key.strip()] = value.strip()
-            except ValueError:
-                # This is a capability; key indicates Regular or Device Caps
-                if key.strip() == 'Capabilities':
-                    info_dict['capabilities_list'].append(line.strip())
-                elif key.strip() == 'Device Caps':
-                    info_dict['device_caps_list'].append(line.strip())
-                else:
-                    print(f"Unknown line: {line}")
+                finished.put((index, probe(uris[index]), None))
+            except Exception as exc:
+                finished.put((index, None, str(exc) or type(exc).__name__))
+
+        def report(index):
+            if on_result is not None:
+                on_result(results[index])
+
+        while len(waiting) > 0 or len(running) > 0:
+            while len(waiting) > 0 and len(running) < self.probe_workers:
+                index = waiting.pop(0)
+                running[index] = time.monotonic()
+                # Daemon threads, so a hung device cannot keep the application from exiting
+                threading.Thread(target=run_probe, args=(index,), name=f"probe {uris[index]}",
+                                 daemon=True).start()
+            try:
+                index, result, error = finished.get(timeout=0.05)
+                # A probe already reported as hung may still finish; it is ignored
+                if running.pop(index, None) is not None:
+                    results[index].result, results[index].error = result, error
+                    report(index)
+            except queue.Empty:
+                pass
+            now = time.monotonic()
+            for index in [index for index, started in running.items() if now - started > self.probe_timeout]:
+                del running[index]
+                results[index].error = f"No response after {self.probe_timeout} seconds"
+                report(index)
+        for result in results:
+            if result.error:
+                print(f"Unable to probe {result.uri}: {result.error}")
+        return results
+
+    def run_v4l2_ctl(self, args: List[str]):
+        """ Run v4l2-ctl with args, return its output or None on failure """
         try:
-            camera.driver_name = info_dict['Driver name']
-            camera.driver_version = info_dict['Driver version']
-            camera.capabilities_code = info_dict['Capabilities']
-            camera.capabilities_list = info_dict['capabilities_list']
-            camera.device_caps_code = info_dict['Device Caps']
-            camera.device_caps_list = info_dict['device_caps_list']
+            return subprocess.check_output(
+                ["v4l2-ctl"] + args, encoding='utf-8', timeout=self.probe_timeout)
         except Exception as exc:
-            # TODO
-            print(f"Issue with setting device info: {exc}")
+            print(exc)
+            return None
+
+    def get_control_list_menus(self, uri: str):
+        return self.run_v4l2_ctl(["-d", uri, "--list-ctrls-menus"])
 
     def parse_device(self,device_entry) -> Camera_Info:
         try:
@@ -162,15 +448,43 @@ class Camera_Inspector:
 
     def list_cameras(self) -> List:
         """ Return a list of cameras, if any"""
+        to_return = self.list_devices()
+
+        # Get the control menus and extended info for each camera, all cameras at once
+        cameras = {camera.uri_list[0]: camera for camera in to_return if len(camera.uri_list) > 0}
+        self.probe_devices(list(cameras), lambda uri: self.probe_camera(cameras[uri]))
+
+        return to_return
+
+    def list_devices(self) -> List:
+        """ Return the cameras and their uris, without the extended info """
+        if self.device_enumerator is None:
+            return self.query_devices()
+        cameras, unresolved = self.device_enumerator.list_devices()
+        if cameras is None:
+            return self.query_devices()
+        if len(unresolved) > 0:
+            # Only the devices that could not be placed are asked
+            cameras = self.merge_devices(cameras, unresolved, self.query_devices(unresolved))
+        return cameras
+
+    def merge_devices(self, cameras: List, unresolved: List[str], queried: List) -> List:
+        """ cameras plus the queried cameras with unresolved nodes, in node order """
+        cameras = cameras + [camera for camera in queried
+                             if any(uri in unresolved for uri in camera.uri_list)]
+        cameras.sort(key=lambda camera: min(int(re.sub(r'\D', '', uri) or 0) for uri in camera.uri_list))
+        return cameras
+
+    def query_devices(self, uris: List[str] = None) -> List:
+        """ The cameras as the devices report them; uris, if given, are the nodes of interest """
+        list_devices = self.run_v4l2_ctl(["--list-devices"])
+        if list_devices is None:
+            return []
+        return self.parse_devices(list_devices)
+
+    def parse_devices(self, list_devices: str) -> List:
         to_return = []
-        try:
-            list_devices = subprocess.check_output(
-                ["v4l2-ctl", "--list-devices"], encoding='utf-8')
-        except Exception as exc:
-            print(exc)
-            list_devices = None
         if list_devices is not None:
-            camera = None
             # Omit media0
             # For example: HD Pro Webcam C920 (usb-3610000.xhci-2.1.3.1):
             #	                /dev/video0
@@ -186,34 +500,51 @@ class Camera_Inspector:
             camera_list = self.parse_device_list(list_devices)
             for camera_entry in camera_list:
                 camera_info=self.parse_device(camera_entry)
-                to_return.append(camera_info)
-                for uri_string in camera_info.uri_list :
-                    ctrl_list_menus = self.get_control_list_menus(uri_string)
-                    camera_info.ctrl_menu_list.append(ctrl_list_menus)
+                if camera_info is not None:
+                    to_return.append(camera_info)
+        return to_return
 
+    def probe_camera(self, camera: Camera_Info) -> Camera_Info:
+        # One v4l2-ctl call per node; the first node also supplies the device info
+        for uri_string in camera.uri_list:
+            output = self.run_v4l2_ctl(["-d", uri_string, "--info", "--list-ctrls-menus"])
+            self.parse_probe(camera, uri_string, output)
+        return camera
 
-        # Get the extended info for each camera
-        for camera in to_return:
-            self.get_camera_info(camera)
+    def parse_probe(self, camera: Camera_Info, uri: str, output: str) -> None:
+        if output is None:
+            camera.ctrl_menu_list.append(None)
+            return
+        sections = self.split_sections(output)
+        camera.ctrl_menu_list.append(sections['controls'])
+        if uri == camera.uri_list[0]:
+            self.parse_camera_info(sections['info'], camera)
 
-        return to_return
+    def describe_node(self, device_uri: str) -> Camera_Info:
+        """ Camera_Info for a single node, e.g. one that was just plugged in """
+        camera = Camera_Info(uri_list=[device_uri])
+        self.get_camera_info(camera)
+        return camera
 
     def get_camera_info(self, camera: Camera_Info):
-        try:
-            # We use the first uri in the camera list to get the device info
-            # That may be incorrect, cameras that have multiple URIs (like depth cameras)
-            # may have different info for each stream ...
-            uri = camera.uri_list[0]
-            if uri is None:
-                print(f"Unable to find camera device URI: {camera.title}")
-                return
-            camera_info = subprocess.check_output(
-                ["v4l2-ctl", "--info", "-d", uri], encoding='utf-8')
-        except Exception as exc:
+        # We use the first uri in the camera list to get the device info
+        # That may be incorrect, cameras that have multiple URIs (like depth cameras)
+        # may have different info for each stream ...
+        uri = camera.uri_list[0]
+        if uri is None:
+            print(f"Unable to find camera device URI: {camera.camera_name}")
+            return
+        camera_info = self.run_v4l2_ctl(["--info", "-d", uri])
+        if camera_info is None:
             # TODO Propogate Exception
-            print(f"Unable to get device info: {exc}")
+            print(f"Unable to get device info: {uri}")
+            return
+        self.parse_camera_info(camera_info, camera)
+
+    def parse_camera_info(self, camera_info: str, camera: Camera_Info):
         # Parse everything into a dictionary
         info_dict = {'capabilities_list': [], 'device_caps_list': []}
+        key = ''
         for line in camera_info.splitlines():
             if len(line) == 0:
                 continue
@@ -228,6 +559,11 @@ class Camera_Inspector:
                     info_dict['device_caps_list'].append(line.strip())
                 else:
                     print(f"Unknown line: {line}")
+        # Nodes probed on their own (hotplug) do not have a name or bus yet
+        if camera.camera_name == "":
+            camera.camera_name = info_dict.get('Card type', "")
+        if camera.bus_address == "":
+            camera.bus_address = info_dict.get('Bus info', "")
         try:
             camera.driver_name = info_dict['Driver name']
             camera.driver_version = info_dict['Driver version']
@@ -239,154 +575,164 @@ class Camera_Inspector:
             # TODO
             print(f"Issue with setting device info: {exc}")
 
-
     def camera_formats(self, device_uri: str):
         """ Return the camera formats"""
+        formats = self.run_v4l2_ctl(["--list-formats-ext", "-d", device_uri])
+        if formats is None:
+            return []
+        return self.parse_camera_formats(formats)
+
+    def parse_camera_formats(self, formats: str):
         to_return = []
-        try:
-            formats = subprocess.check_output(
-                ["v4l2-ctl", "--list-formats-ext", "-d", device_uri], encoding='utf-8')
-        except Exception as exc:
-            print(exc)
-            formats = None
         # Each format begins with [number]
         pattern = r"^\[\d+\]"
-        if formats is not None:
-            camera_format = None
-            for line in formats.splitlines():
-                if len(line) == 0:
-                    continue
-                # camera = None
+        camera_format = None
+        for line in formats.splitlines():
+            if len(line) == 0:
+                continue
+            try:
                 key, value = line.split(':', maxsplit=1)
-                key = key.strip()
-                value = value.strip()
-                # print(f"Key: {key} : Value: {value}")
-                match = re.match(pattern, key)
-                if match:
-                    camera_format = Camera_Format()
-                    to_return.append(camera_format)
-                    # Add the name of the format
-                    camera_format.set_attribute('Pixel Format',value)
-                elif camera_format is not None:
-                    camera_format.set_attribute(key, value)
+            except ValueError:
+                print(f"Unknown line: {line}")
+                continue
+            key = key.strip()
+            value = value.strip()
+            match = re.match(pattern, key)
+            if match:
+                camera_format = Camera_Format()
+                to_return.append(camera_format)
+                # Add the name of the format
+                camera_format.set_attribute('Pixel Format',value)
+            elif camera_format is not None:
+                camera_format.set_attribute(key, value)
 
         return to_return
 
     def get_inactive_ctrls(self, device_uri: str) -> list:
         ctrl_menus = self.get_control_list_menus(device_uri)
+        if ctrl_menus is None:
+            return []
+        return self.parse_inactive_ctrls(ctrl_menus)
+
+    def parse_inactive_ctrls(self, ctrl_menus: str) -> list:
         inactive_ctrl_list = []
-        if ctrl_menus is not None:
-            in_menu = False  # Parsing a menu entry?
-            ctrl_menu_entry = None
-            for line in ctrl_menus.splitlines():
-                if len(line) == 0:
-                    in_menu = False
-                    continue
-                elif line.startswith("Camera Controls"):
-                    in_menu = False
+        in_menu = False  # Parsing a menu entry?
+        for line in ctrl_menus.splitlines():
+            if len(line) == 0:
+                in_menu = False
+                continue
+            elif line.startswith("Camera Controls"):
+                in_menu = False
+                continue
+            elif line.startswith("User Controls"):
+                in_menu = False
+                continue
+            if in_menu:
+                # Does this line fit the profile?
+                # decimal : string or decimal : decimal (hex)
+                to_test = line.split(':')
+                if to_test[0].strip().isdecimal():
                     continue
-                elif line.startswith("User Controls"):
+                else:
+                    # Done parsing the menu entries
                     in_menu = False
-                    continue
-                if in_menu:
-                    # Does this line fit the profile?
-                    # decimal : string or decimal : decimal (hex)
-                    to_test = line.split(':')
-                    if to_test[0].strip().isdecimal():
-                        ctrl_menu_entry.menu_list.append(
-                            [to_test[0].strip(), to_test[1].strip()])
-                        continue
-                    else:
-                        # Done parsing the menu entries
-                        in_menu = False
-                # Get the title
-                if 'flags=inactive' in line:
-                    title = (line.split("0x")[0]).strip()
-                    inactive_ctrl_list.append(title)
+            if '(menu)' in line or '(intmenu)' in line:
+                in_menu = True
+            # Get the title
+            if 'flags=inactive' in line:
+                title = (line.split("0x")[0]).strip()
+                inactive_ctrl_list.append(title)
 
         return inactive_ctrl_list
 
     def get_ctrl_menus(self, device_uri: str) -> list:
         ctrl_menus = self.get_control_list_menus(device_uri)
+        if ctrl_menus is None:
+            return []
+        return self.parse_ctrl_menus(ctrl_menus)
+
+    def parse_ctrl_menus(self, ctrl_menus: str) -> list:
         ctrl_menu_entry_list = []
-        if ctrl_menus is not None:
-            in_menu = False   # Parsing a menu entry?
-            ctrl_menu_entry = None
-            for line in ctrl_menus.splitlines():
+        in_menu = False   # Parsing a menu entry?
+        ctrl_menu_entry = None
+        for line in ctrl_menus.splitlines():
 
-                if len(line) == 0:
-                    in_menu = False
-                    continue
-                elif line.startswith("Camera Controls"):
-                    in_menu = False
+            if len(line) == 0:
+                in_menu = False
+                continue
+            elif line.startswith("Camera Controls"):
+                in_menu = False
+                continue
+            elif line.startswith("User Controls"):
+                in_menu = False
+                continue
+
+            if in_menu:
+                # Does this line fit the profile?
+                # decimal : string or decimal : decimal (hex)
+                to_test = line.split(':')
+                if to_test[0].strip().isdecimal():
+                    ctrl_menu_entry.menu_list.append(
+                        [to_test[0].strip(), to_test[1].strip()])
                     continue
-                elif line.startswith("User Controls"):
+                else:
+                    # Done parsing the menu entries
                     in_menu = False
-                    continue
 
-                if in_menu:
-                    # Does this line fit the profile?
-                    # decimal : string or decimal : decimal (hex)
-                    to_test = line.split(':')
-                    if to_test[0].strip().isdecimal():
-                        ctrl_menu_entry.menu_list.append(
-                            [to_test[0].strip(), to_test[1].strip()])
-                        continue
-                    else:
-                        # Done parsing the menu entries
-                        in_menu = False
+            ctrl_menu_entry = Control_Menu_Entry()
+            ctrl_menu_entry_list.append(ctrl_menu_entry)
+            # Get the title
+            ctrl_menu_entry.title = (line.split("0x")[0]).strip()
+            # Get the menu type
+            try:
+                ctrl_menu_entry.menu_type = re.search(
+                    r'\((.*?)\)', line).group(1)
+            except:
+                pass
+            if 'menu' in ctrl_menu_entry.menu_type:
+                in_menu = True
 
-                ctrl_menu_entry = Control_Menu_Entry()
-                ctrl_menu_entry_list.append(ctrl_menu_entry)
-                # Get the title
-                ctrl_menu_entry.title = (line.split("0x")[0]).strip()
-                # Get the menu type
-                try:
-                    ctrl_menu_entry.menu_type = re.search(
-                        r'\((.*?)\)', line).group(1)
-                except:
-                    pass
-                if 'menu' in ctrl_menu_entry.menu_type:
-                    in_menu = True
-
-                # get the ioctl address; it's in hex 0xXXXXX
-                try:
-                    ctrl_menu_entry.address = re.search(
-                        r'0x([0-9a-fA-F]+)\s*', line).group(1)
-                except:
-                    pass
-                # Get the key=value pairs
-                vals = re.findall(r'([^\s|:]+)=\s*([^\s|:]+)', line)
-                ctrl_menu_entry.key_value_list = vals
-                # Get the flags at the end of the line, CSV names
-                flags = line.split(',')
-                if len(flags) > 1:
-                    del flags[0]
-                else:
-                    flags = []
-                ctrl_menu_entry.flags_list = flags
-                # print(line)
-            # print("-------------------------------------------")
-            # print(ctrl_menu_entry_list)
-            # print("-------------------------------------------")
+            # get the ioctl address; it's in hex 0xXXXXX
+            try:
+                ctrl_menu_entry.address = re.search(
+                    r'0x([0-9a-fA-F]+)\s*', line).group(1)
+            except:
+                pass
+            # Get the key=value pairs
+            vals = re.findall(r'([^\s|:]+)=\s*([^\s|:]+)', line)
+            ctrl_menu_entry.key_value_list = vals
+            # Get the flags at the end of the line, CSV names
+            flags = line.split(',')
+            if len(flags) > 1:
+                del flags[0]
+            else:
+                flags = []
+            ctrl_menu_entry.flags_list = flags
         return ctrl_menu_entry_list
 
+    def set_controls(self, device_uri: str, values: dict) -> None:
+        """ Set several controls in one call, in the order given; raises on failure """
+        settings = ",".join(f"{name}={value}" for name, value in values.items())
+        subprocess.check_output(["v4l2-ctl", "-d", device_uri, "-c", settings],
+                                encoding='utf-8', stderr=subprocess.STDOUT,
+                                timeout=self.probe_timeout)
+
     def get_camera_all(self, device_uri: str):
-        camera_info = ""
-        try:
-            camera_info = subprocess.check_output(
-                ["v4l2-ctl", "--all", "-d", device_uri], encoding='utf-8')
-        except Exception as exc:
+        camera_info = self.run_v4l2_ctl(["--all", "-d", device_uri])
+        if camera_info is None:
             # TODO Propogate Exception
-            print(f"Unable to get device info: {exc}")
+            print(f"Unable to get device info: {device_uri}")
+            return ""
         return camera_info
 
     def get_camera_stream_settings(self, device_uri: str):
+        camera_info = self.get_camera_all(device_uri)
+        return self.parse_stream_settings(camera_info)
+
+    def parse_stream_settings(self, camera_info: str):
         pixel_format = ""
         image_size = ""
         frame_rate = ""
-        camera_info = self.get_camera_all(device_uri)
-
         for line in camera_info.splitlines():
             key = line.split(":", maxsplit=1)
             title = key[0].strip()
@@ -401,6 +747,316 @@ class Camera_Inspector:
         to_return = [pixel_format, image_size, frame_rate]
         return to_return
 
+    """ Output of a combined v4l2-ctl call is split on its top level headers
+    Driver Info:                          -> info
+    Format Video Capture:                 -> settings
+    Streaming Parameters Video Capture:   -> settings
+    ioctl: VIDIOC_ENUM_FMT                -> formats
+    User Controls, Camera Controls, ...   -> controls
+    Anything else (Media Driver Info, Interface Info, ...) is dropped.
+    Section bodies are indented, so only unindented lines can start a section.
+    """
+    section_headers: ClassVar = [('Driver Info', 'info'),
+                                 ('Format Video', 'settings'),
+                                 ('Streaming Parameters', 'settings'),
+                                 ('ioctl: VIDIOC_ENUM_FMT', 'formats')]
+
+    def split_sections(self, output: str) -> dict:
+        sections = {'info': [], 'formats': [], 'controls': [], 'settings': []}
+        current = None
+        for line in output.splitlines():
+            if len(line) > 0 and not line[0].isspace():
+                current = None
+                for header, section in self.section_headers:
+                    if line.startswith(header):
+                        current = section
+                        break
+                else:
+                    if line.rstrip().endswith('Controls'):
+                        current = 'controls'
+                if current == 'controls':
+                    # Control class headers stay in the section, parse_ctrl_menus skips them
+                    sections[current].append(line)
+                continue
+            if current is not None:
+                sections[current].append(line)
+        return {section: "\n".join(lines) for section, lines in sections.items()}
+
+    def get_camera_report(self, device_uri: str):
+        """ Everything the UI needs when switching to a camera, from one v4l2-ctl call """
+        output = self.run_v4l2_ctl(["-d", device_uri, "--info", "--get-fmt-video", "--get-parm",
+                                    "--list-formats-ext", "--list-ctrls-menus"])
+        if output is None:
+            return None
+        return self.parse_camera_report(device_uri, output)
+
+    def parse_camera_report(self, device_uri: str, output: str):
+        sections = self.split_sections(output)
+        camera_info = Camera_Info(uri_list=[device_uri])
+        self.parse_camera_info(sections['info'], camera_info)
+        return Camera_Report(device_uri, camera_info,
+                             self.parse_camera_formats(sections['formats']),
+                             self.parse_ctrl_menus(sections['controls']),
+                             self.parse_inactive_ctrls(sections['controls']),
+                             self.parse_stream_settings(sections['settings']))
+
+
+class Ioctl_Camera_Inspector(Camera_Inspector):
+
+    """ Camera_Inspector that queries /dev/videoN through V4L2 ioctls
+    Returns the same Camera_Info, Camera_Format and Control_Menu_Entry objects as the
+    v4l2-ctl backend. Any query that fails at the ioctl level (no permission, not a
+    V4L2 node, ioctl not implemented by the driver) falls back to v4l2-ctl.
+    The registry supplies the device nodes and their transports; pass a
+    Fake_Device_Registry to run without hardware.
+    """
+
+    def __init__(self, registry=None):
+        if registry is None:
+            registry = v4l2_ioctl.Device_Registry()
+        self.registry = registry
+        # uri -> {control title: (control id, control type)}, for writing controls by name
+        self.control_ids = {}
+
+    def _fallback(self, query: str, uri: str, exc: Exception):
+        print(f"ioctl {query} failed on {uri}: {exc}; falling back to v4l2-ctl")
+
+    def _fill_camera_info(self, camera: Camera_Info, vcap) -> None:
+        camera.driver_name = vcap.driver.decode(errors='replace')
+        camera.driver_version = v4l2_ioctl.decode_version(vcap.version)
+        camera.capabilities_code = f"0x{vcap.capabilities:08x}"
+        camera.capabilities_list = v4l2_ioctl.flags_to_names(
+            vcap.capabilities, v4l2_ioctl.CAPABILITY_NAMES)
+        camera.device_caps_code = f"0x{vcap.device_caps:08x}"
+        camera.device_caps_list = v4l2_ioctl.flags_to_names(
+            vcap.device_caps, v4l2_ioctl.CAPABILITY_NAMES)
+
+    def query_devices(self, uris: List[str] = None) -> List:
+        """ Return a list of cameras, grouped by bus address like v4l2-ctl --list-devices """
+        to_return = []
+        cameras = {}
+        for uri in uris or self.registry.nodes():
+            try:
+                with self.registry.open(uri) as transport:
+                    vcap = v4l2_ioctl.V4L2_Device(transport).query_capabilities()
+            except OSError as exc:
+                # Not every node can be opened (permissions, busy metadata nodes)
+                print(f"Unable to query {uri}: {exc}")
+                continue
+            bus_address = vcap.bus_info.decode(errors='replace')
+            camera_info = cameras.get(bus_address)
+            if camera_info is None:
+                camera_info = Camera_Info(vcap.card.decode(errors='replace'), bus_address)
+                # The first node on the bus supplies the device info, as with v4l2-ctl
+                self._fill_camera_info(camera_info, vcap)
+                cameras[bus_address] = camera_info
+                to_return.append(camera_info)
+            camera_info.uri_list.append(uri)
+        if len(to_return) == 0:
+            return super().query_devices(uris)
+        return to_return
+
+    def probe_camera(self, camera: Camera_Info) -> Camera_Info:
+        # VIDIOC_QUERYCAP in list_devices has already filled in the device info
+        if camera.driver_name == "":
+            self.get_camera_info(camera)
+        return camera
+
+    def get_camera_info(self, camera: Camera_Info):
+        uri = camera.uri_list[0]
+        try:
+            with self.registry.open(uri) as transport:
+                vcap = v4l2_ioctl.V4L2_Device(transport).query_capabilities()
+        except OSError as exc:
+            self._fallback('VIDIOC_QUERYCAP', uri, exc)
+            return super().get_camera_info(camera)
+        if camera.camera_name == "":
+            camera.camera_name = vcap.card.decode(errors='replace')
+        if camera.bus_address == "":
+            camera.bus_address = vcap.bus_info.decode(errors='replace')
+        self._fill_camera_info(camera, vcap)
+
+    def camera_formats(self, device_uri: str):
+        """ Return the camera formats"""
+        to_return = []
+        try:
+            with self.registry.open(device_uri) as transport:
+                device = v4l2_ioctl.V4L2_Device(transport)
+                for fmtdesc in device.enum_formats():
+                    camera_format = Camera_Format()
+                    camera_format.index = str(fmtdesc.index)
+                    camera_format.type = 'Video Capture'
+                    compressed = ''
+                    if fmtdesc.flags & v4l2_ioctl.V4L2_FMT_FLAG_COMPRESSED:
+                        compressed = ', compressed'
+                    camera_format.pixel_format = (f"'{v4l2_ioctl.fourcc_to_string(fmtdesc.pixelformat)}' "
+                                                  f"({fmtdesc.description.decode(errors='replace')}{compressed})")
+                    for frmsize in device.enum_frame_sizes(fmtdesc.pixelformat):
+                        if frmsize.type == v4l2_ioctl.V4L2_FRMSIZE_TYPE_DISCRETE:
+                            width = frmsize.discrete.width
+                            height = frmsize.discrete.height
+                            frame_size = Frame_Size(width, height)
+                            camera_format.frame_sizes.append(frame_size)
+                        else:
+                            stepwise = frmsize.stepwise
+                            width = stepwise.max_width
+                            height = stepwise.max_height
+                            frame_size = Frame_Size_Range(stepwise.min_width, stepwise.max_width,
+                                                          stepwise.step_width, stepwise.min_height,
+                                                          stepwise.max_height, stepwise.step_height)
+                            camera_format.frame_size_ranges.append(frame_size)
+                        self._query_intervals(device, fmtdesc.pixelformat, width, height, frame_size)
+                    to_return.append(camera_format)
+        except OSError as exc:
+            self._fallback('VIDIOC_ENUM_FMT', device_uri, exc)
+            return super().camera_formats(device_uri)
+        return to_return
+
+    def _query_intervals(self, device, pixelformat: int, width: int, height: int, frame_size):
+        for frmival in device.enum_frame_intervals(pixelformat, width, height):
+            if frmival.type == v4l2_ioctl.V4L2_FRMIVAL_TYPE_DISCRETE:
+                if frmival.discrete.numerator == 0 or frmival.discrete.denominator == 0:
+                    continue
+                frame_size.intervals.append(
+                    Fraction(frmival.discrete.numerator, frmival.discrete.denominator))
+                continue
+            stepwise = frmival.stepwise
+            if stepwise.min.denominator == 0 or stepwise.max.denominator == 0:
+                continue
+            step = Fraction(0)
+            if frmival.type == v4l2_ioctl.V4L2_FRMIVAL_TYPE_STEPWISE and stepwise.step.denominator != 0:
+                step = Fraction(stepwise.step.numerator, stepwise.step.denominator)
+            frame_size.interval_range = Interval_Range(
+                Fraction(stepwise.min.numerator, stepwise.min.denominator),
+                Fraction(stepwise.max.numerator, stepwise.max.denominator), step)
+
+    def _query_ctrl_menus(self, device_uri: str) -> list:
+        ctrl_menu_entry_list = []
+        with self.registry.open(device_uri) as transport:
+            device = v4l2_ioctl.V4L2_Device(transport)
+            for query in device.query_controls():
+                if query.type == v4l2_ioctl.V4L2_CTRL_TYPE_CTRL_CLASS:
+                    continue
+                if query.flags & v4l2_ioctl.V4L2_CTRL_FLAG_DISABLED:
+                    continue
+                ctrl_menu_entry = Control_Menu_Entry()
+                ctrl_menu_entry.title = v4l2_ioctl.control_name_to_title(
+                    query.name.decode(errors='replace'))
+                ctrl_menu_entry.address = f"{query.id:08x}"
+                ctrl_menu_entry.menu_type = v4l2_ioctl.CTRL_TYPE_NAMES.get(query.type, str(query.type))
+                key_value_list = []
+                if query.type == v4l2_ioctl.V4L2_CTRL_TYPE_INTEGER or query.type == v4l2_ioctl.V4L2_CTRL_TYPE_INTEGER64:
+                    key_value_list += [('min', str(query.minimum)), ('max', str(query.maximum)),
+                                       ('step', str(query.step))]
+                elif query.type == v4l2_ioctl.V4L2_CTRL_TYPE_MENU or query.type == v4l2_ioctl.V4L2_CTRL_TYPE_INTEGER_MENU:
+                    key_value_list += [('min', str(query.minimum)), ('max', str(query.maximum))]
+                    ctrl_menu_entry.menu_list = device.query_menu(query)
+                if query.type != v4l2_ioctl.V4L2_CTRL_TYPE_BUTTON:
+                    key_value_list.append(('default', str(query.default_value)))
+                if not query.flags & v4l2_ioctl.V4L2_CTRL_FLAG_WRITE_ONLY and \
+                        query.type != v4l2_ioctl.V4L2_CTRL_TYPE_BUTTON:
+                    value = device.get_control(
+                        query.id, query.type == v4l2_ioctl.V4L2_CTRL_TYPE_INTEGER64)
+                    key_value_list.append(('value', str(value)))
+                flags = v4l2_ioctl.flags_to_names(query.flags, v4l2_ioctl.CTRL_FLAG_NAMES)
+                if len(flags) > 0:
+                    key_value_list.append(('flags', flags[0]))
+                ctrl_menu_entry.key_value_list = key_value_list
+                ctrl_menu_entry.flags_list = flags
+                ctrl_menu_entry_list.append(ctrl_menu_entry)
+        return ctrl_menu_entry_list
+
+    def get_ctrl_menus(self, device_uri: str) -> list:
+        try:
+            return self._query_ctrl_menus(device_uri)
+        except OSError as exc:
+            self._fallback('VIDIOC_QUERY_EXT_CTRL', device_uri, exc)
+            return super().get_ctrl_menus(device_uri)
+
+    def get_inactive_ctrls(self, device_uri: str) -> list:
+        try:
+            ctrl_menu_entry_list = self._query_ctrl_menus(device_uri)
+        except OSError as exc:
+            self._fallback('VIDIOC_QUERY_EXT_CTRL', device_uri, exc)
+            return super().get_inactive_ctrls(device_uri)
+        return [ctrl_menu_entry.title for ctrl_menu_entry in ctrl_menu_entry_list
+                if 'inactive' in ctrl_menu_entry.flags_list]
+
+    def set_controls(self, device_uri: str, values: dict) -> None:
+        try:
+            with self.registry.open(device_uri) as transport:
+                device = v4l2_ioctl.V4L2_Device(transport)
+                controls = self.control_ids.get(device_uri, {})
+                if any(name not in controls for name in values):
+                    controls = {}
+                    for query in device.query_controls():
+                        title = v4l2_ioctl.control_name_to_title(query.name.decode(errors='replace'))
+                        controls[title] = (query.id, query.type)
+                    self.control_ids[device_uri] = controls
+                missing = [name for name in values if name not in controls]
+                if len(missing) > 0:
+                    raise OSError(f"Unknown control: {', '.join(missing)}")
+                int64_ids = [ctrl_id for ctrl_id, ctrl_type in controls.values()
+                             if ctrl_type == v4l2_ioctl.V4L2_CTRL_TYPE_INTEGER64]
+                # One VIDIOC_S_EXT_CTRLS for the whole batch
+                device.set_controls({controls[name][0]: value for name, value in values.items()},
+                                    int64_ids)
+        except OSError as exc:
+            self._fallback('VIDIOC_S_EXT_CTRLS', device_uri, exc)
+            super().set_controls(device_uri, values)
+
+    def get_camera_stream_settings(self, device_uri: str):
+        try:
+            with self.registry.open(device_uri) as transport:
+                device = v4l2_ioctl.V4L2_Device(transport)
+                pix = device.get_format().fmt.pix
+                descriptions = {fmtdesc.pixelformat: fmtdesc.description.decode(errors='replace')
+                                for fmtdesc in device.enum_formats()}
+                timeperframe = device.get_stream_parameters().parm.capture.timeperframe
+        except OSError as exc:
+            self._fallback('VIDIOC_G_FMT', device_uri, exc)
+            return super().get_camera_stream_settings(device_uri)
+        fourcc = v4l2_ioctl.fourcc_to_string(pix.pixelformat)
+        pixel_format = f"'{fourcc}' ({descriptions.get(pix.pixelformat, fourcc)})"
+        image_size = f"{pix.width}/{pix.height}"
+        frame_rate = ""
+        if timeperframe.numerator != 0 and timeperframe.denominator != 0:
+            frame_rate = (f"{timeperframe.denominator / timeperframe.numerator:.3f} "
+                          f"({timeperframe.denominator}/{timeperframe.numerator})")
+        to_return = [pixel_format, image_size, frame_rate]
+        return to_return
+
+    def get_camera_report(self, device_uri: str):
+        camera_info = Camera_Info(uri_list=[device_uri])
+        self.get_camera_info(camera_info)
+        ctrl_menus = self.get_ctrl_menus(device_uri)
+        inactive_ctrls = [ctrl_menu_entry.title for ctrl_menu_entry in ctrl_menus
+                          if 'inactive' in ctrl_menu_entry.flags_list]
+        return Camera_Report(device_uri, camera_info, self.camera_formats(device_uri),
+                             ctrl_menus, inactive_ctrls,
+                             self.get_camera_stream_settings(device_uri))
+
+
+def create_camera_inspector(backend: str = 'auto', sysfs_root: str = '/sys') -> Camera_Inspector:
+    """ backend is 'ioctl', 'v4l2-ctl', 'gst' (GStreamer device discovery) or 'auto' (ioctl where
+    the platform supports it)
+    The cameras are listed from sysfs_root where it describes them; None always asks the devices
+    """
+    if backend == 'gst':
+        from camera_caps_gst_discovery import Gst_Camera_Inspector
+        return Gst_Camera_Inspector()
+    if backend == 'v4l2-ctl':
+        inspector = Camera_Inspector()
+    elif backend == 'auto' and importlib.util.find_spec('fcntl') is None:
+        # The ioctls go through fcntl, which only POSIX platforms have
+        inspector = Camera_Inspector()
+    else:
+        inspector = Ioctl_Camera_Inspector()
+    if sysfs_root is not None:
+        from camera_caps_sysfs import Sysfs_Enumerator
+        inspector.device_enumerator = Sysfs_Enumerator(sysfs_root)
+    return inspector
+
 
 """ 
 def main():
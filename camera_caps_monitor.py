@@ -0,0 +1,146 @@
+#
+#  Camera Capabilities
+#
+#  Copyright (C) 2021-2024 JetsonHacks (info@jetsonhacks.com)
+#
+#  MIT License
+#
+#  Hotplug monitor
+#  Watches /dev for videoN nodes coming and going and reports only the nodes
+#  that changed. inotify is used when the C library provides it, otherwise /dev
+#  is polled. A node counts as present when it exists in /dev and, if sysfs is
+#  mounted, under /sys/class/video4linux. Both roots are configurable so the
+#  monitor can run against a fake tree in a temporary directory.
+#
+import ctypes
+import os
+import re
+import select
+import struct
+import threading
+from typing import Callable, List, Set, Tuple
+
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_inotify_event = struct.Struct('iIII')
+
+
+def _open_inotify(path: str, mask: int):
+    """ Return an inotify file descriptor watching path, or None if unavailable """
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        inotify_init1 = libc.inotify_init1
+        inotify_add_watch = libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    fd = inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    if fd < 0:
+        return None
+    if inotify_add_watch(fd, os.fsencode(path), mask) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+def _read_inotify_names(fd) -> List[str]:
+    names = []
+    try:
+        data = os.read(fd, 4096)
+    except BlockingIOError:
+        return names
+    offset = 0
+    while offset + _inotify_event.size <= len(data):
+        _, _, _, name_length = _inotify_event.unpack_from(data, offset)
+        offset += _inotify_event.size
+        name = data[offset:offset + name_length].rstrip(b'\0')
+        names.append(os.fsdecode(name))
+        offset += name_length
+    return names
+
+
+class Device_Monitor:
+
+    def __init__(self, on_change: Callable, dev_root: str = '/dev', sysfs_root: str = '/sys',
+                 poll_interval: float = 2.0, settle_time: float = 0.5):
+        # on_change(added, removed) is called from the monitor thread with sorted uri lists
+        self.on_change = on_change
+        self.dev_root = dev_root
+        self.sysfs_root = sysfs_root
+        self.poll_interval = poll_interval
+        # udev sets node permissions shortly after the node appears
+        self.settle_time = settle_time
+        self.known = self.scan()
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.using_inotify = False
+
+    def scan(self) -> Set[str]:
+        """ The video device nodes present right now """
+        try:
+            names = [name for name in os.listdir(self.dev_root) if re.fullmatch(r'video\d+', name)]
+        except OSError:
+            return set()
+        class_dir = os.path.join(self.sysfs_root, 'class', 'video4linux')
+        if os.path.isdir(class_dir):
+            # A stale /dev entry without a kernel device behind it does not count
+            names = [name for name in names if os.path.exists(os.path.join(class_dir, name))]
+        return set(os.path.join(self.dev_root, name) for name in names)
+
+    def check(self) -> Tuple[List[str], List[str]]:
+        """ Compare against the last scan; report and remember the difference """
+        current = self.scan()
+        added = sorted(current - self.known, key=self.node_number)
+        removed = sorted(self.known - current, key=self.node_number)
+        self.known = current
+        if (added or removed) and self.on_change is not None:
+            self.on_change(added, removed)
+        return added, removed
+
+    def node_number(self, uri: str) -> int:
+        return int(re.sub(r'\D', '', os.path.basename(uri)) or 0)
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name='device-monitor', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=self.poll_interval + 1)
+            self.thread = None
+
+    def run(self):
+        fd = _open_inotify(self.dev_root, IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_ATTRIB)
+        self.using_inotify = fd is not None
+        try:
+            while not self.stop_event.is_set():
+                if fd is None:
+                    self.stop_event.wait(self.poll_interval)
+                    self.check()
+                    continue
+                # Wake up now and then to notice stop()
+                readable, _, _ = select.select([fd], [], [], self.poll_interval)
+                if not readable:
+                    continue
+                names = _read_inotify_names(fd)
+                if not any(re.fullmatch(r'video\d+', name) for name in names):
+                    continue
+                # Let a burst of events (several nodes per camera) finish, then diff once
+                self.stop_event.wait(self.settle_time)
+                while select.select([fd], [], [], 0)[0]:
+                    _read_inotify_names(fd)
+                self.check()
+        except Exception as exc:
+            print(f"Device monitor stopped: {exc}")
+        finally:
+            if fd is not None:
+                os.close(fd)
@@ -0,0 +1,90 @@
+#
+#  Camera Capabilities
+#
+#  Copyright (C) 2021-2024 JetsonHacks (info@jetsonhacks.com)
+#
+#  MIT License
+#
+#  Camera switch
+#  Selecting a camera needs its formats, current settings and controls. On a slow
+#  camera those queries take seconds, so they run on a worker thread, one stage at
+#  a time, and each result is handed over as soon as it arrives: the pixel format
+#  list first, usually straight from the formats probed at startup, the controls
+#  last. The inactive controls are read from the flags of the control menus rather
+#  than queried again. A switch that was superseded by another camera selection
+#  cancels the query it is waiting on, which kills the v4l2-ctl still running, and
+#  delivers nothing more; the receiver also compares the switch against the
+#  current one and drops anything stale.
+#
+import threading
+from concurrent.futures import CancelledError
+from typing import Callable
+
+
+class Camera_Switch:
+
+    # In the order they are queried and delivered
+    stages = ('formats', 'settings', 'controls')
+
+    def __init__(self, device_uri: str, camera_inspector, on_stage: Callable):
+        self.device_uri = device_uri
+        self.camera_inspector = camera_inspector
+        # on_stage(switch, stage, result) is called from the switch thread; result is None on failure
+        self.on_stage = on_stage
+        self.cancelled = False
+        # The query being waited on, for cancel
+        self.future = None
+        self.thread = threading.Thread(target=self.run, name=f"camera-switch {device_uri}",
+                                       daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def cancel(self):
+        """ Cancel the query and skip the stages not yet delivered """
+        self.cancelled = True
+        future = self.future
+        if future is not None:
+            future.cancel()
+
+    def submit(self, query: str):
+        """ query(device_uri) through the inspector, cancellable where it offers submit_query """
+        submit_query = getattr(self.camera_inspector, 'submit_query', None)
+        if submit_query is None:
+            # Without a Memo_Camera_Inspector the query cannot be cancelled
+            return getattr(self.camera_inspector, query)(self.device_uri)
+        self.future = submit_query(query, self.device_uri)
+        if self.cancelled:
+            # Cancelled before there was a query to cancel
+            self.future.cancel()
+        return self.future.result()
+
+    def query(self, stage: str):
+        if stage == 'formats':
+            return self.submit('camera_formats')
+        if stage == 'settings':
+            return self.submit('get_camera_stream_settings')
+        ctrl_menus = self.submit('get_ctrl_menus')
+        return ctrl_menus, inactive_ctrls(ctrl_menus)
+
+    def run(self):
+        for stage in self.stages:
+            if self.cancelled:
+                return
+            try:
+                result = self.query(stage)
+            except CancelledError:
+                return
+            except Exception as exc:
+                print(f"Unable to get {stage} of {self.device_uri}: {exc}")
+                result = None
+            if self.cancelled:
+                return
+            self.on_stage(self, stage, result)
+
+
+def inactive_ctrls(ctrl_menus: list) -> list:
+    """ Titles of the controls flagged inactive, as get_inactive_ctrls lists them """
+    return [ctrl_menu.title for ctrl_menu in ctrl_menus
+            if any(key == 'flags' and 'inactive' in value for key, value in ctrl_menu.key_value_list)
+            or 'inactive' in ctrl_menu.flags_list]
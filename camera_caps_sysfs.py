@@ -0,0 +1,130 @@
+#
+#  Camera Capabilities
+#
+#  Copyright (C) 2021-2024 JetsonHacks (info@jetsonhacks.com)
+#
+#  MIT License
+#
+#  Sysfs enumeration
+#  Which cameras exist, on which bus and with which nodes can be read from
+#  /sys/class/video4linux without opening a device or running v4l2-ctl. Each
+#  videoN directory has the device name, the node index within its device and a
+#  device symlink to the physical device; nodes sharing a physical device are one
+#  camera. The bus address is rebuilt the way the kernel builds bus_info:
+#    USB   usb-<host controller>-<devpath>, as usb_make_path does (uvcvideo)
+#    PCI   PCI:<pci name>
+#  Platform devices (the Tegra capture nodes, for example) name their bus_info
+#  themselves, so their nodes are reported as unresolved and the caller asks the
+#  device instead.
+#
+import os
+import re
+from typing import Dict, List, Tuple
+
+from camera_caps_model import Camera_Info
+
+# VIDIOC_QUERYCAP has 32 byte card and bus_info fields
+V4L2_STRING_LENGTH = 31
+
+
+class Sysfs_Enumerator:
+
+    def __init__(self, sysfs_root: str = '/sys', dev_root: str = '/dev'):
+        self.sysfs_root = sysfs_root
+        self.dev_root = dev_root
+
+    @property
+    def class_dir(self) -> str:
+        return os.path.join(self.sysfs_root, 'class', 'video4linux')
+
+    def read_attribute(self, path: str) -> str:
+        """ The stripped contents of a sysfs attribute, or None """
+        try:
+            with open(path, 'r') as attribute_file:
+                return attribute_file.read().strip()
+        except (OSError, UnicodeDecodeError):
+            return None
+
+    def resolve(self, path: str) -> str:
+        """ Where a sysfs symlink points """
+        # sysfs links are relative and lead straight to a directory; os.path.realpath
+        # would lstat every component of the path on the way, which adds up over hundreds of nodes
+        try:
+            return os.path.normpath(os.path.join(os.path.dirname(path), os.readlink(path)))
+        except OSError:
+            return os.path.realpath(path)
+
+    def node_number(self, node_name: str) -> int:
+        return int(re.sub(r'\D', '', node_name) or 0)
+
+    def usb_device(self, device_path: str) -> str:
+        """ The USB device directory above a USB interface, or None """
+        # uvcvideo binds to an interface (1-2:1.0); the descriptors are on its parent
+        for _ in range(3):
+            if os.path.exists(os.path.join(device_path, 'idVendor')):
+                return device_path
+            device_path = os.path.dirname(device_path)
+        return None
+
+    def bus_address(self, device_path: str) -> Tuple[str, str]:
+        """ (physical device path, bus address) for the device behind a node, or (None, None) """
+        usb_path = self.usb_device(device_path)
+        if usb_path is not None:
+            devpath = self.read_attribute(os.path.join(usb_path, 'devpath'))
+            # The root hub is usbN; its parent is the host controller, e.g. 3610000.xhci
+            hub_path = usb_path
+            while hub_path != os.path.dirname(hub_path) and not re.fullmatch(r'usb\d+', os.path.basename(hub_path)):
+                hub_path = os.path.dirname(hub_path)
+            if devpath is None or hub_path == os.path.dirname(hub_path):
+                return None, None
+            controller = os.path.basename(os.path.dirname(hub_path))
+            return usb_path, f"usb-{controller}-{devpath}"[:V4L2_STRING_LENGTH]
+        subsystem = os.path.basename(os.path.realpath(os.path.join(device_path, 'subsystem')))
+        if subsystem == 'pci':
+            return device_path, f"PCI:{os.path.basename(device_path)}"[:V4L2_STRING_LENGTH]
+        return None, None
+
+    def list_devices(self) -> Tuple[List[Camera_Info], List[str]]:
+        """ The cameras that sysfs fully describes, and the uris of the nodes it does not
+        Returns (None, []) when there is no video4linux class directory to read.
+        Cameras are in the order of their first node, like v4l2-ctl --list-devices.
+        """
+        try:
+            node_names = [name for name in os.listdir(self.class_dir) if re.fullmatch(r'video\d+', name)]
+        except OSError:
+            return None, []
+        node_names.sort(key=self.node_number)
+        # Device path -> (physical device path, bus address); a device usually has several nodes
+        bus_addresses = {}
+        cameras: Dict[str, Camera_Info] = {}
+        # Physical device path -> [(node index, node number, uri)]
+        nodes: Dict[str, list] = {}
+        unresolved = []
+        for node_name in node_names:
+            node_dir = self.resolve(os.path.join(self.class_dir, node_name))
+            uri = os.path.join(self.dev_root, node_name)
+            name = self.read_attribute(os.path.join(node_dir, 'name'))
+            index = self.read_attribute(os.path.join(node_dir, 'index'))
+            device_link = os.path.join(node_dir, 'device')
+            if name is None or not os.path.exists(device_link):
+                unresolved.append(uri)
+                continue
+            link_target = self.resolve(device_link)
+            if link_target not in bus_addresses:
+                bus_addresses[link_target] = self.bus_address(link_target)
+            device_path, bus_address = bus_addresses[link_target]
+            if device_path is None:
+                unresolved.append(uri)
+                continue
+            try:
+                index = int(index)
+            except (TypeError, ValueError):
+                index = 0
+            if device_path not in cameras:
+                cameras[device_path] = Camera_Info(name[:V4L2_STRING_LENGTH], bus_address)
+                nodes[device_path] = []
+            nodes[device_path].append((index, self.node_number(node_name), uri))
+        for device_path, camera in cameras.items():
+            # Node index 0 is the main node of a device; it supplies the device info
+            camera.uri_list = [uri for _, _, uri in sorted(nodes[device_path])]
+        return list(cameras.values()), unresolved
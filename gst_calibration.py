@@ -0,0 +1,267 @@
+#
+#  Camera Capabilities
+#
+#  Copyright (C) 2021-2024 JetsonHacks (info@jetsonhacks.com)
+#
+#  MIT License
+#
+#  Decoder and sink calibration
+#  Which MJPEG or H.264 decoder and which video sink is fastest depends on the
+#  board, the JetPack release and the installed plugins, more than element ranks
+#  say. camera_caps.py --calibrate measures it: for each resolution class a test
+#  clip is encoded once, then every installed decoder candidate decodes it and
+#  every sink displays videotestsrc frames, timing throughput and process CPU time
+#  per frame. The ranking is cached per host in
+#  ~/.cache/camera-caps/calibration.json and the preview pipeline builder follows
+#  it; candidates that were not measured come after the measured ones.
+#
+import json
+import os
+import platform
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from typing import Dict, List
+
+from gst_pipeline_builder import (DECODERS, NVMM_CONVERTERS, RESOLUTION_CLASSES, SINKS, Candidate,
+                                  Pipeline_Builder, _chain)
+
+CALIBRATION_VERSION = 1
+
+# Media type -> (encoders to make the test clip, parser to read it back), first installed wins
+ENCODERS: Dict[str, tuple] = {
+    'image/jpeg': ([_chain('jpegenc'), _chain('nvjpegenc'), _chain('avenc_mjpeg')], 'jpegparse'),
+    'video/x-h264': ([_chain('x264enc', tune='zerolatency', **{'speed-preset': 'ultrafast'}),
+                      _chain('openh264enc'), _chain('avenc_h264_omx')], 'h264parse'),
+}
+# Measured as a baseline for the sinks; it cannot show a preview
+BASELINE_SINKS: List[Candidate] = [_chain('fakesink')]
+
+
+def default_calibration_path() -> str:
+    cache_home = os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))
+    return os.path.join(cache_home, 'camera-caps', 'calibration.json')
+
+
+def host_key() -> str:
+    """ Changes with the board, the kernel and the JetPack (L4T) release """
+    tegra_release = ""
+    try:
+        with open('/etc/nv_tegra_release', 'r') as release_file:
+            tegra_release = release_file.readline().strip()
+    except OSError:
+        pass
+    return "|".join([platform.node(), platform.machine(), platform.release(), tegra_release])
+
+
+@dataclass
+class Measurement:
+    # 'decoder' or 'sink'
+    stage: str = ""
+    media_type: str = ""
+    resolution: str = ""
+    # The element that names the candidate (Candidate.ranked)
+    element: str = ""
+    launch: str = ""
+    frames: int = 0
+    seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    # Empty when the pipeline ran to the end
+    error: str = ""
+
+    @property
+    def frames_per_second(self) -> float:
+        return self.frames / self.seconds if self.seconds > 0 else 0.0
+
+    @property
+    def cpu_per_frame(self) -> float:
+        return self.cpu_seconds / self.frames if self.frames > 0 else 0.0
+
+
+class Gst_Runner:
+    """ Runs a gst-launch description to end of stream and times it """
+
+    def __init__(self, Gst=None, timeout: float = 60.0):
+        if Gst is None:
+            from gst_loader import load_gst
+            Gst = load_gst()
+        self.Gst = Gst
+        self.timeout = timeout
+
+    def run(self, launch: str) -> tuple:
+        """ (wall seconds, process CPU seconds, error or "") """
+        Gst = self.Gst
+        try:
+            pipeline = Gst.parse_launch(launch)
+        except Exception as exc:
+            return 0.0, 0.0, str(exc)
+        bus = pipeline.get_bus()
+        start, cpu_start = time.monotonic(), time.process_time()
+        error = ""
+        if pipeline.set_state(Gst.State.PLAYING) == Gst.StateChangeReturn.FAILURE:
+            error = "Unable to start"
+        else:
+            message = bus.timed_pop_filtered(int(self.timeout * Gst.SECOND),
+                                             Gst.MessageType.EOS | Gst.MessageType.ERROR)
+            if message is None:
+                error = f"No end of stream after {self.timeout} seconds"
+            elif message.type == Gst.MessageType.ERROR:
+                error = str(message.parse_error()[0])
+        seconds, cpu_seconds = time.monotonic() - start, time.process_time() - cpu_start
+        pipeline.set_state(Gst.State.NULL)
+        return seconds, cpu_seconds, error
+
+
+class Calibration:
+
+    def __init__(self, registry, runner, frames: int = 120, resolutions: List[str] = None):
+        self.builder = Pipeline_Builder(registry)
+        self.runner = runner
+        self.frames = frames
+        self.resolutions = [resolution for resolution in RESOLUTION_CLASSES
+                            if resolutions is None or resolution[0] in resolutions]
+
+    def launch_elements(self, candidate: Candidate) -> str:
+        return " ! ".join(element.launch_string() for element in candidate.elements)
+
+    def measure(self, stage: str, media_type: str, resolution: str, candidate: Candidate,
+                launch: str) -> Measurement:
+        seconds, cpu_seconds, error = self.runner.run(launch)
+        measurement = Measurement(stage, media_type, resolution, candidate.ranked, launch,
+                                  self.frames, seconds, cpu_seconds, error)
+        print(f"{stage:<8} {media_type:<13} {resolution:<6} {candidate.ranked:<14} "
+              + (f"failed: {error}" if error else
+                 f"{measurement.frames_per_second:>8.1f} fps {measurement.cpu_per_frame * 1000:>7.2f} ms CPU/frame"))
+        return measurement
+
+    def decoder_measurements(self, workdir: str) -> List[Measurement]:
+        measurements = []
+        for media_type, (encoders, parser) in ENCODERS.items():
+            encoder = self.builder.choose(encoders)
+            if encoder is None:
+                print(f"No encoder installed for {media_type}; its decoders are not measured")
+                continue
+            decoders = [candidate for candidate in DECODERS[media_type] if self.builder.available(candidate)]
+            for name, width, height in self.resolutions:
+                # Encoded once, so the decoders are timed on their own
+                clip = os.path.join(workdir, f"{name}.{media_type.split('/')[1]}")
+                _, _, error = self.runner.run(
+                    f"videotestsrc num-buffers={self.frames} pattern=ball ! "
+                    f"video/x-raw, width={width}, height={height}, format=I420 ! "
+                    f"{self.launch_elements(encoder)} ! {parser} ! filesink location={clip}")
+                if error:
+                    print(f"Unable to encode the {name} {media_type} clip: {error}")
+                    continue
+                for decoder in decoders:
+                    stages = [f"filesrc location={clip}", self.launch_elements(decoder)]
+                    if parser not in stages[1]:
+                        stages.insert(1, parser)
+                    if decoder.output_nvmm:
+                        converter = self.builder.choose(NVMM_CONVERTERS)
+                        if converter is None:
+                            continue
+                        stages.append(self.launch_elements(converter))
+                    stages.append("fakesink sync=false")
+                    measurements.append(self.measure('decoder', media_type, name, decoder, " ! ".join(stages)))
+        return measurements
+
+    def sink_measurements(self) -> List[Measurement]:
+        measurements = []
+        sinks = [candidate for candidate in SINKS + BASELINE_SINKS if self.builder.available(candidate)]
+        for name, width, height in self.resolutions:
+            for sink in sinks:
+                launch = (f"videotestsrc num-buffers={self.frames} pattern=ball ! "
+                          f"video/x-raw, width={width}, height={height} ! videoconvert ! "
+                          f"{self.launch_elements(sink)} sync=false")
+                measurements.append(self.measure('sink', 'video/x-raw', name, sink, launch))
+        return measurements
+
+    def run(self) -> List[Measurement]:
+        with tempfile.TemporaryDirectory(prefix='camera-caps-calibration-') as workdir:
+            return self.decoder_measurements(workdir) + self.sink_measurements()
+
+
+def rank_measurements(measurements: List[Measurement]) -> dict:
+    """ {'decoders': {media type: {resolution: [element, ...]}}, 'sinks': {resolution: [element, ...]}}
+    Candidates within 5% of the best throughput come first, least CPU time per frame
+    first; the rest follow by throughput. Failed runs and the baseline sinks are left out.
+    """
+    baseline = {candidate.ranked for candidate in BASELINE_SINKS}
+    groups: Dict[tuple, List[Measurement]] = {}
+    for measurement in measurements:
+        if measurement.error or (measurement.stage == 'sink' and measurement.element in baseline):
+            continue
+        groups.setdefault((measurement.stage, measurement.media_type, measurement.resolution), []).append(measurement)
+    ranking = {'decoders': {}, 'sinks': {}}
+    for (stage, media_type, resolution), group in groups.items():
+        fastest = max(measurement.frames_per_second for measurement in group)
+        ordered = sorted(group, key=lambda measurement: (
+            (False, measurement.cpu_per_frame) if measurement.frames_per_second >= 0.95 * fastest
+            else (True, -measurement.frames_per_second)))
+        elements = [measurement.element for measurement in ordered]
+        if stage == 'decoder':
+            ranking['decoders'].setdefault(media_type, {})[resolution] = elements
+        else:
+            ranking['sinks'][resolution] = elements
+    return ranking
+
+
+class Calibration_Cache:
+    """ Calibration rankings by host; see host_key """
+
+    def __init__(self, path: str = None):
+        if path is None:
+            path = default_calibration_path()
+        self.path = path
+
+    def load(self) -> dict:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as calibration_file:
+                contents = json.load(calibration_file)
+        except (OSError, ValueError):
+            return {}
+        if contents.get('version') != CALIBRATION_VERSION:
+            return {}
+        return contents.get('hosts', {})
+
+    def ranking(self, host: str = None) -> dict:
+        """ The ranking measured on this host, or None if it has not been calibrated """
+        entry = self.load().get(host or host_key())
+        return None if entry is None else entry['ranking']
+
+    def store(self, measurements: List[Measurement], gstreamer_version: str = "", host: str = None) -> dict:
+        hosts = self.load()
+        ranking = rank_measurements(measurements)
+        hosts[host or host_key()] = {
+            'created': time.time(),
+            'gstreamer': gstreamer_version,
+            'ranking': ranking,
+            'measurements': [asdict(measurement) for measurement in measurements],
+        }
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as calibration_file:
+                json.dump({'version': CALIBRATION_VERSION, 'hosts': hosts}, calibration_file, indent=1)
+            os.replace(temp_path, self.path)
+        except OSError as exc:
+            print(f"Unable to write calibration {self.path}: {exc}")
+        return ranking
+
+
+def calibrate_host(frames: int = 120, path: str = None) -> int:
+    """ Measure this host, store the ranking and print it; returns the exit status """
+    from gst_loader import load_gst
+    from gst_pipeline_builder import Gst_Element_Registry
+    Gst = load_gst()
+    measurements = Calibration(Gst_Element_Registry(Gst), Gst_Runner(Gst), frames).run()
+    if not any(measurement.error == "" for measurement in measurements):
+        print("Nothing could be measured")
+        return 1
+    ranking = Calibration_Cache(path).store(measurements, Gst.version_string())
+    for media_type, resolutions in ranking['decoders'].items():
+        for resolution, elements in resolutions.items():
+            print(f"{media_type} {resolution}: {', '.join(elements)}")
+    for resolution, elements in ranking['sinks'].items():
+        print(f"sink {resolution}: {', '.join(elements)}")
+    return 0
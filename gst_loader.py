@@ -0,0 +1,53 @@
+#
+#  Camera Capabilities
+#
+#  Copyright (C) 2021-2024 JetsonHacks (info@jetsonhacks.com)
+#
+#  MIT License
+#
+#  GStreamer loader
+#  Importing gi and GStreamer and running Gst.init take a noticeable part of
+#  startup on eMMC based boards, and only previews need them. Modules use the Gst
+#  stand-in below as if it were gi.repository.Gst; the first attribute lookup
+#  imports and initialises GStreamer.
+#
+import threading
+
+from startup_profile import startup_profile
+
+_gst = None
+_lock = threading.Lock()
+
+
+def load_gst():
+    """ Import and initialise GStreamer once; returns the Gst module """
+    global _gst
+    if _gst is not None:
+        return _gst
+    with _lock:
+        if _gst is None:
+            with startup_profile.phase('Gst import and init'):
+                import gi
+                gi.require_version('Gst', '1.0')
+                gi.require_version('GstVideo', '1.0')
+                from gi.repository import Gst
+                # GstVideo is required for running video for GstXvImageSink in QWidget
+                from gi.repository import GstVideo  # noqa: F401
+                Gst.init(None)
+            _gst = Gst
+    return _gst
+
+
+def gst_loaded() -> bool:
+    return _gst is not None
+
+
+class _Lazy_Gst:
+
+    """ Stands in for gi.repository.Gst until something is looked up on it """
+
+    def __getattr__(self, name):
+        return getattr(load_gst(), name)
+
+
+Gst = _Lazy_Gst()
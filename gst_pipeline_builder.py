@@ -0,0 +1,490 @@
+#
+#  Camera Capabilities
+#
+#  Copyright (C) 2021-2024 JetsonHacks (info@jetsonhacks.com)
+#
+#  MIT License
+#
+#  Preview pipeline builder
+#  A preview pipeline is source ! caps ! [parser ! decoder] ! [converter] ! crop ! sink.
+#  With a crop, a tee after the decoder feeds any extra region of interest windows.
+#  Which decoder, converter and sink exist depends on the machine: Jetsons have
+#  nvv4l2decoder and nvvidconv, desktops jpegdec and avdec_*, some SoCs V4L2 or
+#  VA-API decoders. The builder offers each stage a list of candidates and takes
+#  the best one that is installed: hardware before software, then by element rank.
+#  The result is a Pipeline_Graph, which gives the gst-launch string for the copy
+#  button and can create the Gst.Pipeline directly. When a new selection only
+#  changes the frame size or rate, a running v4l2src pipeline is renegotiated
+#  through its named capsfilters instead of being rebuilt (see caps_changes).
+#
+#  Availability comes from an element registry. Gst_Element_Registry asks
+#  Gst.ElementFactory, which needs GStreamer loaded; until the first preview loads
+#  it, Plugin_File_Registry looks for the plugin files instead, so startup stays
+#  free of GStreamer.
+#
+#  A host calibration (gst_calibration.py) can replace the static order: with a
+#  ranking, the decoders and sinks it measured come first, fastest first for the
+#  resolution class of the preview.
+#
+import glob
+import os
+import re
+import shlex
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+# GstRank values
+RANK_NONE = 0
+RANK_MARGINAL = 64
+RANK_SECONDARY = 128
+RANK_PRIMARY = 256
+
+
+@dataclass
+class Element_Spec:
+    factory: str = ""
+    properties: dict = field(default_factory=dict)
+    # Element name in the pipeline, for elements looked up later (the "cropper")
+    name: str = None
+
+    @classmethod
+    def parse(cls, text: str) -> 'Element_Spec':
+        """ 'v4l2src device=/dev/video0' -> Element_Spec('v4l2src', {'device': '/dev/video0'}) """
+        words = shlex.split(text)
+        properties = dict(word.split('=', 1) for word in words[1:] if '=' in word)
+        name = properties.pop('name', None)
+        return cls(words[0], properties, name)
+
+    def launch_string(self) -> str:
+        if self.factory == 'capsfilter':
+            return str(self.properties['caps'])
+        words = [self.factory]
+        if self.name is not None:
+            words.append(f"name={self.name}")
+        for key, value in self.properties.items():
+            if isinstance(value, bool):
+                value = 'true' if value else 'false'
+            words.append(f"{key}={value}")
+        return " ".join(words)
+
+
+def caps_element(caps: str, name: str = None) -> Element_Spec:
+    return Element_Spec('capsfilter', {'caps': caps}, name)
+
+
+@dataclass
+class Candidate:
+    """ One way to do a stage, in the order the elements are linked """
+    elements: List[Element_Spec] = field(default_factory=list)
+    hardware: bool = False
+    # The element whose rank decides between candidates of the same kind
+    ranked: str = ""
+    # Memory the output is in; NVMM buffers need nvvidconv before system memory elements
+    output_nvmm: bool = False
+
+
+def _chain(*factories, hardware=False, output_nvmm=False, **properties) -> Candidate:
+    """ Candidate of plain elements; properties go to the last element """
+    elements = [Element_Spec(factory) for factory in factories]
+    elements[-1].properties.update(properties)
+    return Candidate(elements, hardware, factories[-1], output_nvmm)
+
+
+# Media type -> decoding candidates, hardware first. Raw video needs none.
+DECODERS: Dict[str, List[Candidate]] = {
+    'image/jpeg': [
+        _chain('nvv4l2decoder', hardware=True, output_nvmm=True, mjpeg=1),
+        _chain('nvjpegdec', hardware=True),
+        _chain('v4l2jpegdec', hardware=True),
+        _chain('jpegdec'),
+        _chain('avdec_mjpeg'),
+    ],
+    'video/x-h264': [
+        _chain('h264parse', 'nvv4l2decoder', hardware=True, output_nvmm=True),
+        _chain('h264parse', 'v4l2h264dec', hardware=True),
+        _chain('h264parse', 'vaapih264dec', hardware=True),
+        _chain('h264parse', 'nvh264dec', hardware=True),
+        _chain('h264parse', 'avdec_h264'),
+        _chain('h264parse', 'openh264dec'),
+    ],
+    'video/x-h265': [
+        _chain('h265parse', 'nvv4l2decoder', hardware=True, output_nvmm=True),
+        _chain('h265parse', 'v4l2h265dec', hardware=True),
+        _chain('h265parse', 'vaapih265dec', hardware=True),
+        _chain('h265parse', 'nvh265dec', hardware=True),
+        _chain('h265parse', 'avdec_h265'),
+        _chain('h265parse', 'libde265dec'),
+    ],
+}
+# Name, width, height; a frame size falls in the smallest class at least as large
+RESOLUTION_CLASSES = [('480p', 640, 480), ('720p', 1280, 720), ('1080p', 1920, 1080), ('2160p', 3840, 2160)]
+
+
+def resolution_class(width: int, height: int) -> str:
+    for name, class_width, class_height in RESOLUTION_CLASSES:
+        if width * height <= class_width * class_height:
+            return name
+    return RESOLUTION_CLASSES[-1][0]
+
+
+# Sources that renegotiate a running stream when downstream caps change; v4l2src
+# stops streaming, sets the new format and restarts without closing the device
+RENEGOTIATING_SOURCES = ('v4l2src',)
+# Capsfilters that change with the frame size and rate, named so they can be found in a running pipeline
+SOURCE_CAPS = 'source_caps'
+SCALE_CAPS = 'scale_caps'
+# The tee that region of interest branches are linked to (roi_branches.py)
+ROI_TEE = 'roi_tee'
+
+
+# Out of NVMM memory into system memory
+NVMM_CONVERTERS: List[Candidate] = [_chain('nvvidconv', hardware=True)]
+# Into a format the sink takes
+CONVERTERS: List[Candidate] = [_chain('videoconvert')]
+# Sinks that can draw into a Qt window through GstVideoOverlay
+SINKS: List[Candidate] = [_chain('xvimagesink'), _chain('ximagesink'), _chain('glimagesink')]
+# Sinks that scale to the window themselves, in the Xv overlay or on the GPU
+SCALING_SINKS = ('xvimagesink', 'glimagesink')
+# Raw formats nvvidconv takes from system memory
+NVVIDCONV_RAW_FORMATS = ('I420', 'NV12', 'YUY2', 'UYVY', 'YVYU', 'GRAY8', 'BGRx', 'RGBA')
+
+
+class Gst_Element_Registry:
+    """ Element ranks from the GStreamer registry """
+
+    def __init__(self, Gst=None):
+        if Gst is None:
+            from gst_loader import load_gst
+            Gst = load_gst()
+        self.Gst = Gst
+        self.ranks = {}
+
+    def rank(self, factory: str) -> int:
+        """ The rank of the element factory, or None when it is not installed """
+        if factory not in self.ranks:
+            element_factory = self.Gst.ElementFactory.find(factory)
+            self.ranks[factory] = None if element_factory is None else element_factory.get_rank()
+        return self.ranks[factory]
+
+
+class Plugin_File_Registry:
+
+    """ Guesses availability from the plugin files, without loading GStreamer
+    Only elements whose plugin always registers them are listed; decoders that
+    register only when their hardware is present (v4l2*dec, vaapi*, nvh264dec) need
+    Gst_Element_Registry. Ranks are the usual defaults.
+    """
+
+    # Element -> (plugin files that provide it, rank)
+    plugins: Dict[str, Tuple[tuple, int]] = {
+        'nvv4l2decoder': (('libgstnvvideo4linux2.so',), RANK_PRIMARY + 10),
+        'nvvidconv': (('libgstnvvidconv.so',), RANK_PRIMARY),
+        'nvjpegdec': (('libgstnvjpeg.so',), RANK_PRIMARY),
+        'jpegdec': (('libgstjpeg.so',), RANK_PRIMARY),
+        'avdec_mjpeg': (('libgstlibav.so',), RANK_SECONDARY),
+        'avdec_h264': (('libgstlibav.so',), RANK_PRIMARY),
+        'avdec_h265': (('libgstlibav.so',), RANK_PRIMARY),
+        'openh264dec': (('libgstopenh264.so',), RANK_MARGINAL),
+        'libde265dec': (('libgstde265.so',), RANK_SECONDARY),
+        'h264parse': (('libgstvideoparsersbad.so',), RANK_PRIMARY + 1),
+        'h265parse': (('libgstvideoparsersbad.so',), RANK_SECONDARY),
+        'videoconvert': (('libgstvideoconvert.so', 'libgstvideoconvertscale.so'), RANK_NONE),
+        'videoscale': (('libgstvideoscale.so', 'libgstvideoconvertscale.so'), RANK_NONE),
+        'videocrop': (('libgstvideocrop.so',), RANK_NONE),
+        'tee': (('libgstcoreelements.so',), RANK_NONE),
+        'queue': (('libgstcoreelements.so',), RANK_NONE),
+        'xvimagesink': (('libgstxvimagesink.so',), RANK_PRIMARY),
+        'ximagesink': (('libgstximagesink.so',), RANK_SECONDARY),
+        'glimagesink': (('libgstopengl.so',), RANK_SECONDARY),
+    }
+
+    def __init__(self, plugin_dirs: List[str] = None):
+        if plugin_dirs is None:
+            plugin_dirs = self.default_plugin_dirs()
+        self.files = set()
+        for plugin_dir in plugin_dirs:
+            try:
+                self.files.update(os.listdir(plugin_dir))
+            except OSError:
+                continue
+
+    @staticmethod
+    def default_plugin_dirs() -> List[str]:
+        plugin_dirs = []
+        for variable in ('GST_PLUGIN_PATH_1_0', 'GST_PLUGIN_PATH', 'GST_PLUGIN_SYSTEM_PATH_1_0'):
+            plugin_dirs += [path for path in os.environ.get(variable, "").split(os.pathsep) if path]
+        for pattern in ('/usr/lib/*/gstreamer-1.0', '/usr/lib/gstreamer-1.0',
+                        '/usr/local/lib/*/gstreamer-1.0', '/usr/local/lib/gstreamer-1.0'):
+            plugin_dirs += sorted(glob.glob(pattern))
+        return plugin_dirs
+
+    def rank(self, factory: str) -> int:
+        plugin = self.plugins.get(factory)
+        if plugin is None or not any(file_name in self.files for file_name in plugin[0]):
+            return None
+        return plugin[1]
+
+
+class Fake_Element_Registry:
+    """ Element -> rank, for machines made up in tests """
+
+    def __init__(self, ranks: Dict[str, int]):
+        self.ranks = ranks
+
+    def rank(self, factory: str) -> int:
+        return self.ranks.get(factory)
+
+
+def make_element(element_spec: Element_Spec, Gst):
+    """ A configured Gst.Element for an Element_Spec """
+    element = Gst.ElementFactory.make(element_spec.factory, element_spec.name)
+    if element is None:
+        raise RuntimeError(f"Unable to create {element_spec.factory}")
+    for key, value in element_spec.properties.items():
+        if isinstance(value, bool):
+            value = 'true' if value else 'false'
+        # Converts the text to the property's type, caps included, as gst-launch does
+        Gst.util_set_object_arg(element, key, str(value))
+    return element
+
+
+@dataclass
+class Pipeline_Graph:
+    """ The elements of a linear pipeline, in link order """
+    elements: List[Element_Spec] = field(default_factory=list)
+    # Stages for which nothing suitable is installed
+    missing: List[str] = field(default_factory=list)
+    # How the element named "cropper" crops, in the order to try; see roi_crop.py
+    crop_strategies: List[str] = field(default_factory=list)
+    # Whether the frames at the tee named ROI_TEE are in NVMM memory; None without a tee
+    roi_nvmm: bool = None
+
+    def launch_string(self) -> str:
+        return " ! ".join(element.launch_string() for element in self.elements)
+
+    def create(self, Gst=None):
+        """ A Gst.Pipeline with the elements created, configured and linked """
+        if Gst is None:
+            from gst_loader import load_gst
+            Gst = load_gst()
+        pipeline = Gst.Pipeline.new(None)
+        previous = None
+        for element_spec in self.elements:
+            element = make_element(element_spec, Gst)
+            pipeline.add(element)
+            if previous is not None and not previous.link(element):
+                raise RuntimeError(f"Unable to link {previous.get_name()} to {element.get_name()}")
+            previous = element
+        return pipeline
+
+    def caps_changes(self, other: 'Pipeline_Graph') -> Dict[str, str]:
+        """ Capsfilter name -> new caps, if a running pipeline of this graph can become other
+        by renegotiating: the same elements, with only the frame size and rate of the named
+        capsfilters changing. None when other needs a new pipeline.
+        """
+        if len(self.elements) != len(other.elements) or len(self.elements) == 0 or \
+                self.elements[0].factory not in RENEGOTIATING_SOURCES:
+            return None
+        changes = {}
+        for element, other_element in zip(self.elements, other.elements):
+            if element == other_element:
+                continue
+            if element.factory != 'capsfilter' or element.name not in (SOURCE_CAPS, SCALE_CAPS) or \
+                    element.name != other_element.name:
+                return None
+            # Same media type and pixel format; only width, height and framerate may differ
+            fixed = lambda caps: [field.strip() for field in str(caps).split(',')
+                                  if field.split('=')[0].strip() not in ('width', 'height', 'framerate')]
+            if fixed(element.properties['caps']) != fixed(other_element.properties['caps']):
+                return None
+            changes[element.name] = str(other_element.properties['caps'])
+        return changes
+
+    def renegotiate(self, pipeline, changes: Dict[str, str], Gst=None):
+        """ Apply caps_changes to a running pipeline built from this graph
+        The capsfilters send a reconfigure event upstream and the source renegotiates
+        within a few frames. A region of interest no longer fits, so the crop is reset.
+        """
+        if Gst is None:
+            from gst_loader import load_gst
+            Gst = load_gst()
+        cropper = pipeline.get_by_name('cropper')
+        if cropper is not None:
+            for side in ('top', 'left', 'bottom', 'right'):
+                cropper.set_property(side, 0)
+        for name, caps in changes.items():
+            pipeline.get_by_name(name).set_property('caps', Gst.Caps.from_string(caps))
+
+
+class Pipeline_Builder:
+
+    def __init__(self, registry, ranking: dict = None):
+        self.registry = registry
+        # gst_calibration.rank_measurements output, or None for the static order
+        self.ranking = ranking
+
+    def available(self, candidate: Candidate) -> bool:
+        return all(self.registry.rank(element.factory) is not None for element in candidate.elements)
+
+    def measured_order(self, stage: str, resolution: str, media_type: str = None) -> List[str]:
+        """ The calibrated order of elements for a stage ('decoders' or 'sinks'), fastest first """
+        if not self.ranking:
+            return []
+        by_resolution = self.ranking.get(stage, {})
+        if media_type is not None:
+            by_resolution = by_resolution.get(media_type, {})
+        if resolution in by_resolution:
+            return by_resolution[resolution]
+        # The nearest class that was measured
+        names = [name for name, _, _ in RESOLUTION_CLASSES]
+        measured = [name for name in names if name in by_resolution]
+        if resolution not in names or len(measured) == 0:
+            return []
+        nearest = min(measured, key=lambda name: abs(names.index(name) - names.index(resolution)))
+        return by_resolution[nearest]
+
+    def choose(self, candidates: List[Candidate], measured_order: List[str] = ()) -> Candidate:
+        """ The best installed candidate, None if none is
+        Candidates in measured_order come first, in that order; the rest follow,
+        hardware first, then by the highest rank.
+        """
+        installed = [candidate for candidate in candidates if self.available(candidate)]
+        if len(installed) == 0:
+            return None
+        measured_order = list(measured_order)
+        # sorted() is stable, so equal candidates keep their listed order
+        return sorted(installed, key=lambda candidate: (
+            measured_order.index(candidate.ranked) if candidate.ranked in measured_order else len(measured_order),
+            not candidate.hardware,
+            -self.registry.rank(candidate.ranked)))[0]
+
+    def copy_elements(self, candidate: Candidate) -> List[Element_Spec]:
+        return [Element_Spec(element.factory, dict(element.properties), element.name)
+                for element in candidate.elements]
+
+    def add_crop(self, graph: Pipeline_Graph, caps: str, decoded: bool, nvmm_converter: Element_Spec,
+                 sink: Candidate, width: int, height: int, v4l2_crop: bool) -> bool:
+        """ Add the element named "cropper" where cropping is cheapest, and the strategies to use it
+        (see roi_crop.py); False when nothing installed can crop
+        """
+        scale_caps = caps_element(f"video/x-raw, width={width}, height={height}", SCALE_CAPS)
+        sink_scales = sink is not None and sink.ranked in SCALING_SINKS
+        raw_format = re.search(r'format=\s*(\w+)', caps)
+        if v4l2_crop and graph.elements[0].factory == 'v4l2src':
+            # The driver crops before capture; the cropper is the fallback if it refuses while streaming
+            graph.crop_strategies.append('v4l2')
+        if nvmm_converter is not None:
+            # Out of NVMM memory anyway: VIC crops and scales back to the frame size
+            nvmm_converter.name = 'cropper'
+            graph.elements.append(scale_caps)
+            graph.crop_strategies.append('nvvidconv')
+        elif sink_scales and self.registry.rank('videocrop') is not None:
+            graph.elements.append(Element_Spec('videocrop', name='cropper'))
+            graph.crop_strategies.append('sink')
+        elif not decoded and raw_format is not None and raw_format.group(1) in NVVIDCONV_RAW_FORMATS and \
+                self.choose(NVMM_CONVERTERS) is not None:
+            graph.elements += [Element_Spec('nvvidconv', name='cropper'), scale_caps]
+            graph.crop_strategies.append('nvvidconv')
+        elif self.registry.rank('videocrop') is not None:
+            graph.elements.append(Element_Spec('videocrop', name='cropper'))
+            if not decoded and self.registry.rank('videoscale') is not None:
+                # The sink cannot scale, so the region is scaled back to the frame size in software
+                graph.elements += [Element_Spec('videoscale'), scale_caps]
+                graph.crop_strategies.append('videoscale')
+            else:
+                graph.crop_strategies.append('sink')
+        return len(graph.crop_strategies) > 0
+
+    def add_roi_tee(self, graph: Pipeline_Graph, nvmm: bool):
+        """ A tee for region of interest windows, then a queue for the main window's branch """
+        if self.registry.rank('tee') is None or self.registry.rank('queue') is None:
+            return
+        graph.elements += [Element_Spec('tee', name=ROI_TEE), Element_Spec('queue')]
+        graph.roi_nvmm = nvmm
+
+    def preview(self, source: Element_Spec, caps: str, width: int, height: int,
+                sync: bool = False, crop: bool = True, v4l2_crop: bool = False) -> Pipeline_Graph:
+        """ source ! caps ! decode ! tee ! queue ! convert ! crop ! sink for a preview window
+        With crop, an element named "cropper" is included for the region of interest,
+        placed where cropping costs least (see add_crop). v4l2_crop says the driver
+        can crop the capture itself (VIDIOC_S_SELECTION). Decoded frames also go to
+        the tee, for more regions in windows of their own (see roi_branch).
+        """
+        graph = Pipeline_Graph([source, caps_element(caps, SOURCE_CAPS)])
+        resolution = resolution_class(width, height)
+        media_type = caps.split(',')[0].strip()
+        nvmm = '(memory:NVMM)' in media_type
+        media_type = media_type.split('(')[0]
+        decoded = media_type != 'video/x-raw'
+        if decoded:
+            decoder = self.choose(DECODERS.get(media_type, []),
+                                  self.measured_order('decoders', resolution, media_type))
+            if decoder is None:
+                graph.missing.append(f"decoder for {media_type}")
+            else:
+                graph.elements += self.copy_elements(decoder)
+                nvmm = decoder.output_nvmm
+        if crop:
+            self.add_roi_tee(graph, nvmm)
+        nvmm_converter = None
+        if nvmm:
+            converter = self.choose(NVMM_CONVERTERS)
+            if converter is None:
+                graph.missing.append("converter out of NVMM memory")
+            else:
+                converter_elements = self.copy_elements(converter)
+                nvmm_converter = converter_elements[-1]
+                graph.elements += converter_elements
+        sink = self.choose(SINKS, self.measured_order('sinks', resolution))
+        if crop and not self.add_crop(graph, caps, decoded, nvmm_converter, sink, width, height, v4l2_crop):
+            graph.missing.append("videocrop, so no region of interest")
+        converter = self.choose(CONVERTERS)
+        if converter is not None:
+            graph.elements += self.copy_elements(converter)
+        if sink is None:
+            graph.missing.append("video sink")
+        else:
+            sink_elements = self.copy_elements(sink)
+            sink_elements[-1].properties['sync'] = sync
+            graph.elements += sink_elements
+        return graph
+
+    def roi_branch(self, graph: Pipeline_Graph, region: Tuple[int, int, int, int],
+                   frame_size: Tuple[int, int]) -> List[Element_Spec]:
+        """ queue ! crop ! convert ! sink showing region (x, y, width, height) of the frames
+        at the graph's tee, or None if the graph has no tee or nothing can crop them.
+        The queue leaks, so a slow window drops its own frames without holding up the tee.
+        """
+        if graph.roi_nvmm is None:
+            return None
+        x, y, width, height = region
+        frame_width, frame_height = frame_size
+        elements = [Element_Spec('queue', {'leaky': 'downstream', 'max-size-buffers': 2,
+                                           'max-size-bytes': 0, 'max-size-time': 0})]
+        nvvidconv = self.choose(NVMM_CONVERTERS)
+        if nvvidconv is not None:
+            # VIC crops, and takes the frames out of NVMM memory where they are in it
+            elements += [Element_Spec('nvvidconv', {'left': x, 'top': y, 'right': x + width, 'bottom': y + height}),
+                         caps_element(f"video/x-raw, width={width}, height={height}")]
+        elif graph.roi_nvmm or self.registry.rank('videocrop') is None:
+            return None
+        else:
+            elements.append(Element_Spec('videocrop', {'left': x, 'top': y, 'right': frame_width - x - width,
+                                                       'bottom': frame_height - y - height}))
+        converter = self.choose(CONVERTERS)
+        if converter is not None:
+            elements += self.copy_elements(converter)
+        sink = self.choose(SINKS, self.measured_order('sinks', resolution_class(width, height)))
+        if sink is None:
+            return None
+        sink_elements = self.copy_elements(sink)
+        sink_elements[-1].properties['sync'] = False
+        return elements + sink_elements
+
+
+def default_registry():
+    """ The GStreamer registry once GStreamer is loaded, the plugin files before """
+    from gst_loader import gst_loaded, load_gst
+    if gst_loaded():
+        return Gst_Element_Registry(load_gst())
+    return Plugin_File_Registry()
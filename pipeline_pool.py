@@ -0,0 +1,221 @@
+#
+#  Camera Capabilities
+#
+#  Copyright (C) 2021-2024 JetsonHacks (info@jetsonhacks.com)
+#
+#  MIT License
+#
+#  Warm pipeline pool
+#  Bringing a preview up from nothing opens the device, negotiates the format and
+#  initialises the decoder, which takes from a fraction of a second (uvcvideo) to a
+#  few seconds (Argus). With the pool enabled (camera_caps.py --warm-pool N), a
+#  preview window that is closed parks its pipeline instead of releasing it:
+#    PAUSED   the device stays open and streaming, the buffers stay allocated;
+#             resuming is immediate, but the camera keeps running
+#    READY    the device stays open but streaming stops and buffers are freed;
+#             resuming renegotiates the format
+#  The most recently closed pipelines are kept, up to a count and an estimated
+#  memory cap; the least recently used ones are released past either. A parked
+#  pipeline holds its device, so a different pipeline for the same device takes
+#  its place only after it is released.
+#
+import os
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Tuple
+
+# Buffers assumed per element src pad when estimating memory: the v4l2src minimum,
+# and a typical downstream buffer pool
+BUFFERS_PER_STAGE = 4
+# Bits per pixel of raw formats; formats not listed count as 32
+RAW_FORMAT_BITS = {
+    'I420': 12, 'YV12': 12, 'NV12': 12, 'NV21': 12,
+    'YUY2': 16, 'UYVY': 16, 'YVYU': 16, 'NV16': 16, 'RGB16': 16, 'GRAY16_LE': 16,
+    'RGB': 24, 'BGR': 24, 'GRAY8': 8,
+}
+
+
+def caps_frame_bytes(structure) -> int:
+    """ Bytes in one frame of a caps structure (a Gst.Structure), 0 if unknown
+    Compressed frames are counted at 2 bytes a pixel, which is what drivers usually reserve.
+    """
+    has_width, width = structure.get_int('width')
+    has_height, height = structure.get_int('height')
+    if not (has_width and has_height):
+        return 0
+    if structure.get_name().startswith('video/x-raw'):
+        bits = RAW_FORMAT_BITS.get(structure.get_string('format'), 32)
+    else:
+        bits = 16
+    return width * height * bits // 8
+
+
+def estimate_pipeline_bytes(pipeline, Gst) -> int:
+    """ Rough memory held by the buffers of a negotiated pipeline """
+    total = 0
+    iterator = pipeline.iterate_elements()
+    while True:
+        result, element = iterator.next()
+        if result != Gst.IteratorResult.OK:
+            break
+        pad = element.get_static_pad('src')
+        caps = pad.get_current_caps() if pad is not None else None
+        if caps is not None and caps.get_size() > 0:
+            total += caps_frame_bytes(caps.get_structure(0)) * BUFFERS_PER_STAGE
+    return total
+
+
+def process_resident_bytes() -> int:
+    """ Resident memory of this process, 0 where /proc is not available """
+    try:
+        with open('/proc/self/statm', 'r') as statm_file:
+            return int(statm_file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+@dataclass
+class Pool_Entry:
+    device_uri: str = ""
+    driver: str = ""
+    pipeline: object = None
+    # The Pipeline_Graph the pipeline was built from, or None for a hand edited command line
+    graph: object = None
+    command_line: str = ""
+    # Estimated by estimate_pipeline_bytes when parked
+    memory_bytes: int = 0
+
+
+@dataclass
+class Pool_Stats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    # Estimated memory of the parked pipelines
+    resident_bytes: int = 0
+    parked: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        requests = self.hits + self.misses
+        return self.hits / requests if requests else 0.0
+
+    def summary(self) -> str:
+        return (f"{self.hits} hits, {self.misses} misses ({self.hit_rate:.0%} hit rate), "
+                f"{self.evictions} evicted, {self.parked} parked using about "
+                f"{self.resident_bytes / 2 ** 20:.1f} MiB, process resident "
+                f"{process_resident_bytes() / 2 ** 20:.1f} MiB")
+
+
+class Pipeline_Pool:
+
+    def __init__(self, capacity: int = 2, memory_limit: int = 256 * 2 ** 20, park_state: str = 'paused',
+                 Gst=None, estimate=estimate_pipeline_bytes):
+        self.capacity = capacity
+        self.memory_limit = memory_limit
+        self.park_state = park_state
+        self._Gst = Gst
+        self.estimate = estimate
+        # Device uri -> Pool_Entry, least recently parked first
+        self.entries: 'OrderedDict[str, Pool_Entry]' = OrderedDict()
+        self.stats = Pool_Stats()
+        self.lock = threading.Lock()
+
+    @property
+    def Gst(self):
+        if self._Gst is None:
+            from gst_loader import load_gst
+            self._Gst = load_gst()
+        return self._Gst
+
+    def release(self, entry: Pool_Entry):
+        """ Start releasing a parked pipeline's device; returns the Pipeline_Release """
+        from pipeline_release import Pipeline_Release
+        release = Pipeline_Release(entry.pipeline, entry.device_uri, entry.driver, Gst=self.Gst)
+        release.start()
+        return release
+
+    def park(self, device_uri: str, driver: str, pipeline, graph, command_line: str):
+        """ Keep a pipeline that was showing device_uri warm; evicts as needed """
+        Gst = self.Gst
+        state = Gst.State.PAUSED if self.park_state == 'paused' else Gst.State.READY
+        pipeline.set_state(state)
+        entry = Pool_Entry(device_uri, driver, pipeline, graph, command_line)
+        # In READY the buffers are freed
+        entry.memory_bytes = self.estimate(pipeline, Gst) if state == Gst.State.PAUSED else 0
+        with self.lock:
+            previous = self.entries.pop(device_uri, None)
+            self.entries[device_uri] = entry
+            evicted = self._evict()
+        if previous is not None:
+            evicted.append(previous)
+        for old_entry in evicted:
+            self.release(old_entry)
+
+    def _evict(self) -> list:
+        """ Take least recently used entries out until within the limits; call with the lock held """
+        evicted = []
+        while len(self.entries) > max(self.capacity, 0) or \
+                (len(self.entries) > 0 and self._resident_bytes() > self.memory_limit):
+            _, entry = self.entries.popitem(last=False)
+            evicted.append(entry)
+            self.stats.evictions += 1
+        self._update_stats()
+        return evicted
+
+    def _resident_bytes(self) -> int:
+        return sum(entry.memory_bytes for entry in self.entries.values())
+
+    def _update_stats(self):
+        self.stats.resident_bytes = self._resident_bytes()
+        self.stats.parked = len(self.entries)
+
+    def usable(self, entry: Pool_Entry, command_line: str, graph) -> bool:
+        """ Whether the parked pipeline can show command_line, as is or renegotiated """
+        if entry.command_line == command_line:
+            return True
+        return entry.graph is not None and graph is not None and entry.graph.caps_changes(graph) is not None
+
+    def take(self, device_uri: str, command_line: str, graph=None) -> Tuple[Pool_Entry, object]:
+        """ (entry, None) for a warm pipeline usable for command_line, to be set PLAYING
+        by the caller; otherwise (None, the Pipeline_Release of a parked pipeline that
+        must free the device first, or None).
+        """
+        with self.lock:
+            entry = self.entries.pop(device_uri, None)
+            if entry is not None and self.usable(entry, command_line, graph):
+                self.stats.hits += 1
+                self._update_stats()
+                return entry, None
+            self.stats.misses += 1
+            self._update_stats()
+        return None, (None if entry is None else self.release(entry))
+
+    def discard(self, device_uri: str):
+        """ Release the pipeline parked for a device, if there is one """
+        with self.lock:
+            entry = self.entries.pop(device_uri, None)
+            self._update_stats()
+        if entry is not None:
+            self.release(entry)
+
+    def clear(self, wait: bool = False):
+        """ Release every parked pipeline; with wait, until their devices are free """
+        with self.lock:
+            entries = list(self.entries.values())
+            self.entries.clear()
+            self._update_stats()
+        releases = [self.release(entry) for entry in entries]
+        if wait:
+            for release in releases:
+                release.wait(release.timeout)
+
+
+def parse_memory(text: str) -> int:
+    """ '256M' or '1G' or a plain byte count -> bytes; for the --warm-pool-memory argument """
+    match = re.fullmatch(r'\s*(\d+)\s*([KMG]?)i?B?\s*', text, re.IGNORECASE)
+    if match is None:
+        raise ValueError(f"not a memory size: {text}")
+    return int(match.group(1)) * 1024 ** ' KMG'.index(match.group(2).upper() or ' ')
@@ -0,0 +1,120 @@
+#
+#  Camera Capabilities
+#
+#  Copyright (C) 2021-2024 JetsonHacks (info@jetsonhacks.com)
+#
+#  MIT License
+#
+#  Pipeline release
+#  Stopping a preview means taking its pipeline to NULL, which closes the camera
+#  device. With uvcvideo that takes a few milliseconds, with the Argus daemon much
+#  longer, and a driver that is stuck can hold it indefinitely. The pipeline is
+#  stopped on a worker thread, waiting for the state change to complete rather
+#  than for a fixed time; the caller is told when the device is free, so the next
+#  pipeline on it starts right away. How long each release took is recorded per
+#  driver.
+#
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List
+
+
+@dataclass
+class Release_Stats:
+    # Driver name -> seconds for each release
+    seconds: Dict[str, List[float]] = field(default_factory=dict)
+    failures: int = 0
+
+    def __post_init__(self):
+        self.lock = threading.Lock()
+
+    def record(self, driver: str, seconds: float, error: str = None):
+        with self.lock:
+            self.seconds.setdefault(driver or "unknown", []).append(seconds)
+            if error is not None:
+                self.failures += 1
+
+    def summary(self) -> str:
+        with self.lock:
+            drivers = [f"{driver} {len(times)}x mean {sum(times) / len(times) * 1000:.0f} ms "
+                       f"max {max(times) * 1000:.0f} ms" for driver, times in self.seconds.items()]
+            failures = self.failures
+        return ", ".join(drivers) + (f", {failures} failed" if failures else "") if drivers else "none"
+
+
+# Shared by every preview window; printed when the application quits
+release_stats = Release_Stats()
+
+
+class Pipeline_Release:
+
+    def __init__(self, pipeline, device_uri: str, driver: str, timeout: float = 5.0, Gst=None,
+                 stats: Release_Stats = release_stats):
+        if Gst is None:
+            from gst_loader import load_gst
+            Gst = load_gst()
+        self.Gst = Gst
+        self.pipeline = pipeline
+        self.device_uri = device_uri
+        self.driver = driver
+        self.timeout = timeout
+        self.stats = stats
+        self.released = threading.Event()
+        # Set with released: how long it took, and the error or None
+        self.seconds = None
+        self.error = None
+        self.callbacks: List[Callable] = []
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, name=f"pipeline-release {device_uri}",
+                                       daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def notify(self, callback: Callable):
+        """ Call callback(release, seconds, error) once the device is released
+        From the release thread, or right away from this one if it already is.
+        """
+        with self.lock:
+            if not self.released.is_set():
+                self.callbacks.append(callback)
+                return
+        callback(self, self.seconds, self.error)
+
+    def wait(self, timeout: float = None) -> bool:
+        """ Block until the device is released; False if it was not within timeout """
+        return self.released.wait(timeout)
+
+    def stop(self) -> str:
+        """ Take the pipeline to NULL; returns an error message, or None once it is there """
+        Gst = self.Gst
+        result = self.pipeline.set_state(Gst.State.NULL)
+        if result == Gst.StateChangeReturn.ASYNC:
+            result, _, _ = self.pipeline.get_state(int(self.timeout * Gst.SECOND))
+        if result == Gst.StateChangeReturn.FAILURE:
+            return "state change to NULL failed"
+        if result == Gst.StateChangeReturn.ASYNC:
+            return f"not stopped after {self.timeout} seconds"
+        return None
+
+    def run(self):
+        start = time.monotonic()
+        try:
+            error = self.stop()
+        except Exception as exc:
+            error = str(exc)
+        seconds = time.monotonic() - start
+        self.stats.record(self.driver, seconds, error)
+        # The last reference goes with the release, freeing the elements here rather than on the GUI thread
+        self.pipeline = None
+        if error is None:
+            print(f"Released {self.device_uri} ({self.driver}) in {seconds * 1000:.0f} ms")
+        else:
+            print(f"Releasing {self.device_uri} ({self.driver}): {error}")
+        with self.lock:
+            self.seconds, self.error = seconds, error
+            self.released.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback(self, seconds, error)
@@ -0,0 +1,200 @@
+#
+#  Camera Capabilities
+#
+#  Copyright (C) 2021-2024 JetsonHacks (info@jetsonhacks.com)
+#
+#  MIT License
+#
+#  Pipeline stream statistics
+#  How a preview is actually doing: buffer probes on the source's src pad and the
+#  sink's sink pad time each buffer as it passes, the bus counts the QoS messages
+#  of buffers dropped or late, and a latency query asks the pipeline what latency
+#  it reports. Once a second the preview window samples them into a Stream_Stats:
+#  frames per second, inter-frame jitter, frames lost between source and sink,
+#  and the time from capture to the sink.
+#
+#  The probes run on the streaming threads for every buffer, so they do little:
+#  each counter has one writer, its pad's streaming thread, which publishes its
+#  totals as one tuple; the sampler reads that tuple and takes the difference from
+#  the previous one. Neither waits on a lock. At 4K30 that is thirty small tuples
+#  a second per pad.
+#
+import math
+import time
+from dataclasses import dataclass
+from typing import Tuple
+
+# Totals published by a Buffer_Counter: buffers, intervals, sum of the intervals and
+# of their squares (seconds), latency measurements and their sum (seconds)
+EMPTY_TOTALS = (0, 0, 0.0, 0.0, 0, 0.0)
+# GST_CLOCK_TIME_NONE, the timestamp of a buffer that has none
+CLOCK_TIME_NONE = 2 ** 64 - 1
+
+
+@dataclass
+class Stream_Stats:
+    """ One sample of a preview's stream; rates and means are over the sample's interval """
+    # Frames per second reaching the sink, and leaving the source
+    fps: float = 0.0
+    source_fps: float = 0.0
+    # Standard deviation of the time between frames at the sink
+    jitter_ms: float = 0.0
+    # Buffers the source sent that did not reach the sink in the interval
+    lost: int = 0
+    # QoS: buffers the elements dropped since the pipeline started, and late buffer reports
+    dropped: int = 0
+    late: int = 0
+    # Mean time from capture to the sink, measured from the buffer timestamps; None unless live
+    latency_ms: float = None
+    # The latency the pipeline reports (Gst.Query.new_latency); None if it does not answer
+    reported_latency_ms: float = None
+
+    def summary(self) -> str:
+        text = f"{self.fps:.1f} fps ±{self.jitter_ms:.1f} ms"
+        if self.lost or self.dropped or self.late:
+            text += f", {self.lost} lost, {self.dropped} dropped, {self.late} late"
+        if self.latency_ms is not None:
+            text += f", {self.latency_ms:.0f} ms latency"
+        elif self.reported_latency_ms is not None:
+            text += f", {self.reported_latency_ms:.0f} ms reported latency"
+        return text
+
+
+class Buffer_Counter:
+    """ Times the buffers passing a pad; written by the pad's streaming thread only """
+
+    def __init__(self, element=None):
+        # With an element, the time each buffer took from capture is measured against its clock
+        self.element = element
+        self.last_arrival = None
+        self.totals = EMPTY_TOTALS
+
+    def on_buffer(self, buffer, now: float):
+        buffers, intervals, interval_sum, interval_squares, latencies, latency_sum = self.totals
+        if self.last_arrival is not None:
+            interval = now - self.last_arrival
+            intervals += 1
+            interval_sum += interval
+            interval_squares += interval * interval
+        self.last_arrival = now
+        latency = self.buffer_latency(buffer)
+        if latency is not None:
+            latencies += 1
+            latency_sum += latency
+        # One assignment, so the sampler sees all of these or none
+        self.totals = (buffers + 1, intervals, interval_sum, interval_squares, latencies, latency_sum)
+
+    def buffer_latency(self, buffer) -> float:
+        """ Seconds since the buffer was captured, for live sources that stamp buffers with
+        the running time of their capture (v4l2src, nvarguscamerasrc); None otherwise
+        """
+        if self.element is None:
+            return None
+        clock = self.element.get_clock()
+        pts = buffer.pts
+        if clock is None or pts == CLOCK_TIME_NONE:
+            return None
+        running_time = clock.get_time() - self.element.get_base_time()
+        if running_time < pts:
+            return None
+        return (running_time - pts) / 1e9
+
+
+class Pipeline_Stats:
+
+    def __init__(self, pipeline, Gst=None):
+        if Gst is None:
+            from gst_loader import load_gst
+            Gst = load_gst()
+        self.Gst = Gst
+        self.pipeline = pipeline
+        self.source = Buffer_Counter()
+        self.sink = None
+        # (pad, probe id) to remove in detach
+        self.probes = []
+        # Element name -> buffers dropped, from its latest QoS message; written on the GUI thread
+        self.qos_dropped = {}
+        self.late = 0
+        self.last_sample = None
+        # The most recent Stream_Stats, see sample
+        self.latest = None
+
+    def attach(self):
+        """ Probe the pipeline's first source and sink; a pipeline without either goes unmeasured """
+        Gst = self.Gst
+        source = first_element(self.pipeline.iterate_sources(), Gst)
+        sink = first_element(self.pipeline.iterate_sinks(), Gst)
+        if source is None or sink is None:
+            return
+        self.sink = Buffer_Counter(sink)
+        for element, pad_name, counter in ((source, 'src', self.source), (sink, 'sink', self.sink)):
+            pad = element.get_static_pad(pad_name)
+            if pad is not None:
+                self.probes.append((pad, pad.add_probe(Gst.PadProbeType.BUFFER, self.on_probe, counter)))
+
+    def detach(self):
+        for pad, probe_id in self.probes:
+            pad.remove_probe(probe_id)
+        self.probes = []
+
+    def on_probe(self, pad, info, counter: Buffer_Counter):
+        buffer = info.get_buffer()
+        if buffer is not None:
+            counter.on_buffer(buffer, time.monotonic())
+        return self.Gst.PadProbeReturn.OK
+
+    def on_qos(self, message):
+        """ A QoS message from the bus """
+        _, _, dropped = message.parse_qos_stats()
+        self.qos_dropped[message.src.get_name()] = dropped
+        self.late += 1
+
+    def reported_latency(self) -> float:
+        """ Minimum latency the pipeline reports, in seconds, or None """
+        query = self.Gst.Query.new_latency()
+        if not self.pipeline.query(query):
+            return None
+        _, min_latency, _ = query.parse_latency()
+        return min_latency / 1e9
+
+    def sample(self) -> Stream_Stats:
+        """ Stream_Stats since the previous sample; also kept as latest """
+        source = self.source.totals
+        sink = self.sink.totals if self.sink is not None else EMPTY_TOTALS
+        stats = Stream_Stats(dropped=sum(self.qos_dropped.values()), late=self.late)
+        if self.last_sample is not None:
+            last_source, last_sink = self.last_sample
+            source_delta = difference(source, last_source)
+            sink_delta = difference(sink, last_sink)
+            stats.fps, stats.jitter_ms = interval_stats(sink_delta)
+            stats.source_fps, _ = interval_stats(source_delta)
+            stats.lost = max(source_delta[0] - sink_delta[0], 0)
+            latencies, latency_sum = sink_delta[4], sink_delta[5]
+            if latencies > 0:
+                stats.latency_ms = latency_sum / latencies * 1000
+        reported = self.reported_latency()
+        if reported is not None:
+            stats.reported_latency_ms = reported * 1000
+        self.last_sample = (source, sink)
+        self.latest = stats
+        return stats
+
+
+def difference(totals: Tuple, previous: Tuple) -> Tuple:
+    return tuple(value - previous_value for value, previous_value in zip(totals, previous))
+
+
+def interval_stats(delta: Tuple) -> Tuple[float, float]:
+    """ (frames per second, jitter in ms) from the difference of two totals """
+    _, intervals, interval_sum, interval_squares, _, _ = delta
+    if intervals == 0 or interval_sum <= 0:
+        return 0.0, 0.0
+    mean = interval_sum / intervals
+    variance = max(interval_squares / intervals - mean * mean, 0.0)
+    return 1 / mean, math.sqrt(variance) * 1000
+
+
+def first_element(iterator, Gst):
+    """ The first element a Gst.Iterator gives, or None """
+    result, element = iterator.next()
+    return element if result == Gst.IteratorResult.OK else None
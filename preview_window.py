@@ -7,16 +7,16 @@
 #
 from PyQt5.QtWidgets import QMainWindow, QApplication, QVBoxLayout, QWidget
 from PyQt5.QtGui import QMouseEvent, QPaintEvent, QPainter, QPen, QColor
-from PyQt5.QtCore import Qt, QRect, QPoint, pyqtSignal, QEvent
+from PyQt5.QtCore import Qt, QRect, QPoint, pyqtSignal, QEvent, QTimer
 from PyQt5.QtCore import qInstallMessageHandler, QtDebugMsg, QtWarningMsg, QtCriticalMsg, QtFatalMsg
 
-import time
+from pipeline_release import Pipeline_Release
+from pipeline_stats import Pipeline_Stats
+from roi_branches import ROI_SINK_PREFIX, ROI_Branch
+from roi_crop import apply_crop, reset_crop
 
-import gi
-from gi.repository import Gst, GstVideo
-
-gi.require_version('Gst', '1.0')
-gi.require_version('GstVideo', '1.0')
+# GStreamer is loaded on first use, when the first preview starts
+from gst_loader import Gst
 
 import camera_caps_dataclasses
 
@@ -28,9 +28,15 @@ def messageFilter(mode, context, message):
         # Default handler behavior (you can replace this with your own handling logic)
         print(message)
 
-qInstallMessageHandler(messageFilter)
+message_filter_installed = False
+
 
-# GstVideo is required for running video for GstXvImageSink in QWidget
+def install_message_filter():
+    # Installed with the first preview window rather than at import
+    global message_filter_installed
+    if not message_filter_installed:
+        qInstallMessageHandler(messageFilter)
+        message_filter_installed = True
 
 
 class PreviewWindow(QMainWindow):
@@ -44,6 +50,7 @@ class PreviewWindow(QMainWindow):
 
 
     def setup(self):
+        install_message_filter()
         # self.setWindowFlags(Qt.FramelessWindowHint)
         self.setFocusPolicy(Qt.StrongFocus)
         video_frame = self.setup_video_frame()
@@ -51,12 +58,29 @@ class PreviewWindow(QMainWindow):
         self.setStyleSheet("background-color:black;")
         # The device uri of the camera
         self.device_uri = None
+        # Driver of the camera, for the release timings
+        self.driver_name = ""
+        # Pipeline_Pool that keeps the pipeline warm when the window is closed; None to release it
+        self.pipeline_pool = None
         self.base_title = ""
+        # The title for the stream shown, before its statistics
+        self.stream_title = ""
+        # Samples the stream statistics into the title while the window shows
+        self.stats_timer = QTimer(self)
+        self.stats_timer.setInterval(1000)
+        self.stats_timer.timeout.connect(self.update_stream_stats)
         self.video_widget.winId = self.video_widget.winId()
         self.video_widget.pipeline = None
         self.app_closing = False
         # camera_settings is the current caps filter for the camera
         self.camera_settings = None
+        # Where the main window's region of interest is cropped from the frame, and by which strategy
+        self.crop_region = None
+        self.crop_strategy = None
+        # Windows showing more regions of interest, each fed by a branch off the pipeline's tee
+        self.roi_windows = []
+        # The Pipeline_Builder the preview was built with, for the branches
+        self.pipeline_builder = None
         self.setGeometry(100, 100, 640, 480)
         self.setWindowTitle('Video Window')
         self.overlay_window = TransparentOverlay()
@@ -72,6 +96,22 @@ class PreviewWindow(QMainWindow):
     def show(self):
         super().show()
         self.overlay_window.show()
+        self.stats_timer.start()
+
+    def set_stream_title(self, title: str):
+        self.stream_title = title
+        self.setWindowTitle(title)
+
+    def update_stream_stats(self):
+        stats = self.video_widget.stats
+        if stats is None or self.isHidden():
+            return
+        self.setWindowTitle(f"{self.stream_title} - {stats.sample().summary()}")
+
+    def stream_stats(self):
+        """ The latest Stream_Stats of the preview (see pipeline_stats.py), or None """
+        stats = self.video_widget.stats
+        return stats.latest if stats is not None else None
         
     def setup_video_frame(self):
         video_frame = QWidget()
@@ -83,22 +123,29 @@ class PreviewWindow(QMainWindow):
         return video_frame
 
     def closeEvent(self, event):
+        self.close_rois()
+        # Before the pipeline is parked or released
+        self.reset_roi()
+        self.stats_timer.stop()
         if self.app_closing is True:
             # The app is closing down; Closed caps dialog window
             # TODO - Should shutdown GStreamer pipelines here
             self.overlay_window.close()
-            # If there's a pipeline, stop it and dispose
+            # If there's a pipeline, stop it and dispose; the device is closed before the app exits
             if self.video_widget.pipeline is not None:
-                self.video_widget.close_pipeline()
+                self.video_widget.close_pipeline(self.device_uri, self.driver_name, wait=True)
             event.accept()
         else:
             # Emitting event.accept() closes window; we want to hide it instead
             event.ignore()
             self.hide()
             self.overlay_window.hide()
-            # If there's a pipeline, stop it and dispose
-            if self.video_widget.pipeline is not None:
-                self.video_widget.close_pipeline()
+            # If there's a pipeline, keep it warm if there is a pool, otherwise stop it and dispose
+            if self.video_widget.pipeline is not None and self.pipeline_pool is not None:
+                pipeline, graph, cmd_line = self.video_widget.detach_pipeline()
+                self.pipeline_pool.park(self.device_uri, self.driver_name, pipeline, graph, cmd_line)
+            elif self.video_widget.pipeline is not None:
+                self.video_widget.close_pipeline(self.device_uri, self.driver_name)
 
     # Map the client area's rectangle to global coordinates
     def global_client_rect(self):
@@ -179,13 +226,101 @@ class PreviewWindow(QMainWindow):
 
     def onEscPressed(self):
         print("Escape key was pressed!")
-        # Reset the videocrop
+        self.reset_roi()
+
+    def forget_roi(self):
+        # A new pipeline shows the whole frame
+        self.crop_region = None
+        self.crop_strategy = None
+        self.overlay_window.roi_rectangle = None
+
+    def reset_roi(self):
+        # Back to the whole frame; a capture crop would otherwise outlast the pipeline, and camera-caps
+        self.forget_roi()
         pipeline = self.video_widget.pipeline
-        cropper = pipeline.get_by_name("cropper")
-        cropper.set_property('top', 0)
-        cropper.set_property('left', 0)
-        cropper.set_property('bottom', 0)
-        cropper.set_property('right', 0)
+        if pipeline is None or self.camera_settings is None:
+            return
+        graph = self.video_widget.graph
+        reset_crop(pipeline, graph.crop_strategies if graph is not None else None, self.device_uri,
+                   self.frame_size())
+
+    def frame_size(self):
+        return int(self.camera_settings.image_width), int(self.camera_settings.image_height)
+
+    def crop_strategies(self, shared_capture: bool = False):
+        """ The strategies the main window's region may use; with shared_capture, none that crop the device """
+        graph = self.video_widget.graph
+        if graph is None:
+            return None
+        if shared_capture or len(self.roi_windows) > 0:
+            # A capture crop would reach the region of interest windows too
+            return [strategy for strategy in graph.crop_strategies if strategy != 'v4l2']
+        return graph.crop_strategies
+
+    def frame_region(self, screen_rect: QRect):
+        """ The region of the frame under a rectangle drawn on the window, as (x, y, width, height) """
+        frame_width, frame_height = self.frame_size()
+        if self.crop_region is None:
+            shown, displayed = (0, 0, frame_width, frame_height), (frame_width, frame_height)
+        elif self.crop_strategy == 'sink':
+            # The sink scales the region itself, keeping its aspect ratio
+            shown, displayed = self.crop_region, self.crop_region[2:]
+        else:
+            # The region was scaled to the frame size before the sink
+            shown, displayed = self.crop_region, (frame_width, frame_height)
+        x, y, width, height = self.translate_coordinates_aspect_ratio(
+            self.width(), self.height(), displayed[0], displayed[1],
+            screen_rect.x(), screen_rect.y(), screen_rect.width(), screen_rect.height())
+        scale_x, scale_y = shown[2] / displayed[0], shown[3] / displayed[1]
+        return (shown[0] + int(x * scale_x), shown[1] + int(y * scale_y),
+                max(1, int(width * scale_x)), max(1, int(height * scale_y)))
+
+    def add_roi_window(self, screen_rect: QRect):
+        """ Show the region under screen_rect in a window of its own, leaving this one as it is """
+        pipeline = self.video_widget.pipeline
+        graph = self.video_widget.graph
+        if pipeline is None or graph is None or self.pipeline_builder is None:
+            print("More regions of interest need the preview pipeline camera-caps builds, not a hand edited one")
+            return
+        region = self.frame_region(screen_rect)
+        element_specs = self.pipeline_builder.roi_branch(graph, region, self.frame_size())
+        if element_specs is None:
+            print("No installed element can crop a region of interest branch")
+            return
+        if self.crop_strategy == 'v4l2':
+            # The capture crop would reach the new window; crop this window in the pipeline instead
+            reset_crop(pipeline, ['v4l2'], self.device_uri, self.frame_size())
+            self.crop_strategy = apply_crop(pipeline, self.crop_strategies(shared_capture=True), self.device_uri,
+                                            self.crop_region, self.frame_size())
+        x, y, width, height = region
+        roi_window = ROI_Window(self.roi_window_closed)
+        roi_window.setWindowTitle(f"{self.base_title} - region {width}x{height} at {x},{y}")
+        # Regions larger than the screen can take are shown at half size
+        scale = 1 if width <= 1280 and height <= 720 else 0.5
+        roi_window.resize(max(160, int(width * scale)), max(120, int(height * scale)))
+        roi_window.show()
+        roi_window.branch = ROI_Branch(pipeline, element_specs, roi_window.video_frame.winId())
+        try:
+            roi_window.branch.attach()
+        except RuntimeError as exc:
+            print(f"Unable to add the region of interest: {exc}")
+            roi_window.branch.detach()
+            roi_window.close()
+            return
+        self.roi_windows.append(roi_window)
+        print(f"Region of interest window {width}x{height} at {x},{y}")
+
+    def roi_window_closed(self, roi_window):
+        if roi_window in self.roi_windows:
+            self.roi_windows.remove(roi_window)
+        if roi_window.branch is not None:
+            roi_window.branch.detach()
+            roi_window.branch = None
+
+    def close_rois(self):
+        """ Close the region of interest windows, removing their branches """
+        for roi_window in list(self.roi_windows):
+            roi_window.close()
 
          # self.hide()
         
@@ -337,47 +472,89 @@ class PreviewWindow(QMainWindow):
     
     def set_roi ( self, screen_rect: QRect) :
         pipeline = self.video_widget.pipeline
-        video_width = int(self.camera_settings.image_width)
-        video_height = int(self.camera_settings.image_height)
-
-        # def translate_coordinates_aspect_ratio(self, window_width, window_height, video_width, video_height, rect_x, rect_y, rect_width, rect_height):
-        translated_coordinates = self.translate_coordinates_aspect_ratio(self.width(), self.height(), video_width, video_height,  
-                                                                         screen_rect.x(), screen_rect.y(), screen_rect.width(), screen_rect.height())
-        # print(f"Translated coordinates: {translated_coordinates}")
-        # Retrieve the videocrop element
-        cropper = pipeline.get_by_name("cropper")
-        # Calculate the scale factor
-        # scale_factor = self.calculate_scale_to_fit(translated_coordinates[2], translated_coordinates[3], self.width(), self.height())
-        # print(f"Scale factor: {scale_factor}")
-        # Setup the amount to crop from each side
-        bottom_offset = video_height - (translated_coordinates[1] + translated_coordinates[3])
-        right_offset = video_width - (translated_coordinates[0] + translated_coordinates[2])
-        print(f"Crop rect: {translated_coordinates[1]}@{translated_coordinates[0]} x {bottom_offset}@{right_offset}")
-        cropper.set_property('top', translated_coordinates[1])
-        cropper.set_property('left', translated_coordinates[0])
-        cropper.set_property('bottom', bottom_offset)
-        cropper.set_property('right', right_offset)
+        # The region in frame pixels; the pipeline's crop strategies decide where it is cropped
+        region = self.frame_region(screen_rect)
+        self.crop_strategy = apply_crop(pipeline, self.crop_strategies(), self.device_uri,
+                                        region, self.frame_size())
+        self.crop_region = region if self.crop_strategy is not None else None
+        print(f"Crop rect: {region[2]}x{region[3]}@{region[0]},{region[1]} by {self.crop_strategy}")
+
+
+class ROI_Window(QMainWindow):
+    """ Shows one region of interest; its ROI_Branch draws into video_frame """
+
+    def __init__(self, on_closed, parent=None):
+        super().__init__(parent)
+        # on_closed(roi_window) when the window is closed
+        self.on_closed = on_closed
+        self.branch = None
+        self.video_frame = QWidget()
+        self.setCentralWidget(self.video_frame)
+        self.setStyleSheet("background-color:black;")
+
+    def closeEvent(self, event):
+        self.on_closed(self)
+        event.accept()
 
 class VideoWidget(QMainWindow):
 
     def __init__(self, parent=None):
         QWidget.__init__(self, parent)
         self.pipeline = None
+        # The last pipeline stopped, see close_pipeline
+        self.release = None
+        # The Pipeline_Graph the pipeline was built from; None for hand edited command lines
+        self.graph = None
+        self.cmd_line = ""
+        self.bus_handlers = []
+        # Pipeline_Stats measuring the pipeline's stream
+        self.stats = None
         self.start_point = None
         self.end_point = None
 
     def has_video(self):
         return self.pipeline is not None
 
-    def close_pipeline(self):
-        if self.pipeline is not None:
-            self.stop_pipeline()
-            # Wait for the pipeline to stop everything
-            # before deallocating
-            time.sleep(1)
-            self.pipeline = None
+    def close_pipeline(self, device_uri: str = None, driver: str = "", wait: bool = False):
+        """ Stop the pipeline on a worker thread and forget it; returns the Pipeline_Release, or None
+        With wait, return only once the device is released (or the release timed out).
+        """
+        if self.pipeline is None:
+            return None
+        pipeline, _, _ = self.detach_pipeline()
+        self.release = Pipeline_Release(pipeline, device_uri, driver)
+        self.release.start()
+        if wait:
+            self.release.wait(self.release.timeout)
+        return self.release
+
+    def detach_pipeline(self):
+        """ Disconnect the pipeline from this widget and forget it, leaving its state alone
+        Returns (pipeline, graph, command line).
+        """
+        pipeline, graph, cmd_line = self.pipeline, self.graph, self.cmd_line
+        # The bus watch belongs to the GUI thread's main context; remove it here
+        bus = pipeline.get_bus()
+        bus.remove_signal_watch()
+        bus.disable_sync_message_emission()
+        for handler_id in self.bus_handlers:
+            bus.disconnect(handler_id)
+        self.bus_handlers = []
+        if self.stats is not None:
+            self.stats.detach()
+            self.stats = None
+        self.pipeline = None
+        self.graph = None
+        return pipeline, graph, cmd_line
+
+    def pending_release(self):
+        """ The Pipeline_Release still closing the device, or None """
+        if self.release is not None and not self.release.released.is_set():
+            return self.release
+        return None
 
-    def setup_pipeline(self, launch_cmd):
+    def setup_pipeline(self, launch_cmd, pipeline=None, graph=None):
+        # pipeline, if given, is launch_cmd already built from graph (see gst_pipeline_builder.py)
 
         # Working Test Patterns
         # launch_str = "videotestsrc ! video/x-raw,width=640,height=480 ! videoconvert ! xvimagesink"
@@ -389,20 +566,27 @@ class VideoWidget(QMainWindow):
 
         # ToDo - Try Except block, check to see if string parsed
         print(launch_cmd)
-        self.pipeline = Gst.parse_launch(launch_cmd)
+        if pipeline is None:
+            pipeline = Gst.parse_launch(launch_cmd)
+        self.pipeline = pipeline
+        self.graph = graph
         self.cmd_line = launch_cmd
 
         bus = self.pipeline.get_bus()
         bus.add_signal_watch()
         bus.enable_sync_message_emission()
-        bus.connect("message", self.on_message)
-        bus.connect("sync-message::element", self.on_sync_message)
+        self.bus_handlers = [bus.connect("message", self.on_message),
+                             bus.connect("sync-message::element", self.on_sync_message)]
+        self.stats = Pipeline_Stats(self.pipeline)
+        self.stats.attach()
 
     def on_message(self, bus, message):
         message_type = message.type
         if message_type == Gst.MessageType.ERROR:
             err, debug = message.parse_error()
             print(f"Bus error message: {err} {debug}")
+        elif message_type == Gst.MessageType.QOS and self.stats is not None:
+            self.stats.on_qos(message)
 
     def on_sync_message(self, bus, message):
         structure = message.get_structure()
@@ -411,10 +595,28 @@ class VideoWidget(QMainWindow):
         message_name = structure.get_name()
 
         if message_name == "prepare-window-handle":
+            if message.src.get_name().startswith(ROI_SINK_PREFIX):
+                # Region of interest windows give their sinks a window up front
+                return
             assert self.winId
             # Message.src should be a sink, e.g. GstXvImageSink
             message.src.set_window_handle(self.winId)
 
+    def renegotiate(self, launch_cmd, graph) -> bool:
+        """ Change the running pipeline into graph without rebuilding it, if only the
+        frame size or rate differ; False when it needs rebuilding
+        """
+        if self.pipeline is None or self.graph is None or graph is None:
+            return False
+        changes = self.graph.caps_changes(graph)
+        if changes is None:
+            return False
+        print(launch_cmd)
+        self.graph.renegotiate(self.pipeline, changes, Gst)
+        self.graph = graph
+        self.cmd_line = launch_cmd
+        return True
+
     def start_pipeline(self):
         self.pipeline.set_state(Gst.State.PLAYING)
 
@@ -454,29 +656,30 @@ class TransparentOverlay(QWidget):
 
 
     def mousePressEvent(self, event):
-        if self.roi_rectangle is None:
-            self.start_point = event.pos()
-            self.end_point = None
-            self.update()
+        self.start_point = event.pos()
+        self.end_point = None
+        self.update()
 
     def mouseMoveEvent(self, event):
-        if self.roi_rectangle is None:
-            if event.buttons() == Qt.LeftButton:
-                self.end_point = event.pos()
-                self.update()
-
-    def mouseReleaseEvent(self, event):
-        if self.roi_rectangle is None:
+        if event.buttons() == Qt.LeftButton:
             self.end_point = event.pos()
             self.update()
-            # Set the ROI rectangle based on the start and end points
-            if self.start_point and self.end_point:
-                self.roi_rectangle = QRect(self.start_point, self.end_point)
-                self.roi_rectangle = self.roi_rectangle.normalized()  # Normalize to ensure correct geometry
+
+    def mouseReleaseEvent(self, event):
+        self.end_point = event.pos()
+        self.update()
+        if self.start_point and self.end_point:
+            rectangle = QRect(self.start_point, self.end_point).normalized()
+            if self.roi_rectangle is None:
+                # The first ROI crops this window
+                self.roi_rectangle = rectangle
                 print(f"ROI set to: {self.roi_rectangle}")  # Optionally print or log the ROI for debugging
                 self.video_window.set_roi(self.roi_rectangle)
-            self.start_point = None
-            self.end_point = None
+            elif rectangle.width() > 1 and rectangle.height() > 1:
+                # Later ones open a window each; the stream here carries on
+                self.video_window.add_roi_window(rectangle)
+        self.start_point = None
+        self.end_point = None
 
     def paintEvent(self, event):
         self.setAttribute(Qt.WA_TranslucentBackground)
@@ -0,0 +1,88 @@
+#
+#  Camera Capabilities
+#
+#  Copyright (C) 2021-2024 JetsonHacks (info@jetsonhacks.com)
+#
+#  MIT License
+#
+#  Region of interest branches
+#  Each extra region of interest on a camera is shown in a window of its own, fed
+#  from the preview pipeline's tee: the device is opened and the frames decoded
+#  once, and every region crops its own copy. A branch is linked to the tee while
+#  the pipeline plays and brings its elements up to the pipeline's state. It is
+#  removed from an idle probe on its tee pad, between buffers, so neither adding
+#  nor removing a branch stops the main window's stream.
+#
+from typing import List
+
+from gst_pipeline_builder import ROI_TEE, Element_Spec, make_element
+
+
+# Prefix of the branch sinks' names; the main window leaves their window handle requests alone
+ROI_SINK_PREFIX = 'roi_sink'
+
+
+class ROI_Branch:
+
+    # Numbers the branch sinks, whose names must be unique within a pipeline
+    count = 0
+
+    def __init__(self, pipeline, element_specs: List[Element_Spec], window_handle: int, Gst=None):
+        if Gst is None:
+            from gst_loader import load_gst
+            Gst = load_gst()
+        self.Gst = Gst
+        self.pipeline = pipeline
+        self.element_specs = element_specs
+        # Where the branch's sink draws
+        self.window_handle = window_handle
+        self.elements = []
+        self.tee_pad = None
+
+    def attach(self):
+        """ Create the branch and link it to the tee of the running pipeline """
+        Gst = self.Gst
+        tee = self.pipeline.get_by_name(ROI_TEE)
+        if tee is None:
+            raise RuntimeError("The pipeline has no tee for regions of interest")
+        ROI_Branch.count += 1
+        self.element_specs[-1].name = f"{ROI_SINK_PREFIX}{ROI_Branch.count}"
+        self.elements = [make_element(element_spec, Gst) for element_spec in self.element_specs]
+        # Set before the sink starts, so it draws into the window instead of asking for one
+        self.elements[-1].set_window_handle(self.window_handle)
+        previous = None
+        for element in self.elements:
+            self.pipeline.add(element)
+            if previous is not None and not previous.link(element):
+                raise RuntimeError(f"Unable to link {previous.get_name()} to {element.get_name()}")
+            previous = element
+        # Downstream first, so each element is ready for the buffers the one before it sends
+        for element in reversed(self.elements):
+            element.sync_state_with_parent()
+        self.tee_pad = tee.request_pad_simple('src_%u') if hasattr(tee, 'request_pad_simple') \
+            else tee.get_request_pad('src_%u')
+        if self.tee_pad.link(self.elements[0].get_static_pad('sink')) != Gst.PadLinkReturn.OK:
+            raise RuntimeError("Unable to link the region of interest branch to the tee")
+
+    def detach(self):
+        """ Unlink the branch between buffers, then stop and remove its elements """
+        Gst = self.Gst
+        if self.tee_pad is None:
+            # Never linked, so no buffers to wait for
+            self.remove_elements()
+            return
+        tee_pad, self.tee_pad = self.tee_pad, None
+
+        def on_idle(pad, info):
+            pad.unlink(self.elements[0].get_static_pad('sink'))
+            pad.get_parent_element().release_request_pad(pad)
+            self.remove_elements()
+            return Gst.PadProbeReturn.REMOVE
+
+        tee_pad.add_probe(Gst.PadProbeType.IDLE, on_idle)
+
+    def remove_elements(self):
+        for element in self.elements:
+            element.set_state(self.Gst.State.NULL)
+            self.pipeline.remove(element)
+        self.elements = []
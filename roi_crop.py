@@ -0,0 +1,147 @@
+#
+#  Camera Capabilities
+#
+#  Copyright (C) 2021-2024 JetsonHacks (info@jetsonhacks.com)
+#
+#  MIT License
+#
+#  Region of interest crop
+#  The preview window crops to the region drawn over it. Where that happens
+#  decides what it costs per frame:
+#    v4l2        the driver crops the capture (VIDIOC_S_SELECTION), so the bytes
+#                outside the region are never captured; few drivers allow it
+#                while streaming, so the pipeline's cropper stays as a fallback
+#    nvvidconv   VIC hardware crops and scales back to the frame size (Jetson)
+#    sink        videocrop passes a crop rectangle on; xvimagesink or
+#                glimagesink scale the region to the window in hardware
+#    videoscale  videocrop, then a software rescale to the frame size, for
+#                sinks that cannot scale
+#  The pipeline builder picks the strategies (Pipeline_Graph.crop_strategies);
+#  benchmarks/roi_crop_benchmark.py measures the CPU time of each.
+#
+from typing import Dict, Tuple
+
+from v4l2_ioctl import V4L2_SEL_TGT_CROP_BOUNDS, V4L2_SEL_TGT_CROP_DEFAULT, Device_Transport, V4L2_Device
+
+
+def supports_v4l2_crop(device_uri: str, open_device=Device_Transport) -> bool:
+    """ Whether the driver reports crop bounds for the capture, so VIDIOC_S_SELECTION may work """
+    try:
+        with open_device(device_uri) as transport:
+            bounds = V4L2_Device(transport).get_selection(V4L2_SEL_TGT_CROP_BOUNDS)
+    except OSError:
+        return False
+    return bounds.width > 1 and bounds.height > 1
+
+
+class Videocrop_Strategy:
+    """ videocrop takes the amount to remove from each side """
+
+    name = 'sink'
+
+    def apply(self, pipeline, device_uri: str, region: Tuple[int, int, int, int],
+              frame_size: Tuple[int, int]) -> bool:
+        """ Crop to region (x, y, width, height) of the frame; False if this strategy could not """
+        cropper = pipeline.get_by_name('cropper')
+        if cropper is None:
+            return False
+        x, y, width, height = region
+        frame_width, frame_height = frame_size
+        cropper.set_property('top', y)
+        cropper.set_property('left', x)
+        cropper.set_property('bottom', frame_height - (y + height))
+        cropper.set_property('right', frame_width - (x + width))
+        return True
+
+    def reset(self, pipeline, device_uri, frame_size):
+        cropper = pipeline.get_by_name('cropper')
+        if cropper is not None:
+            for side in ('top', 'left', 'bottom', 'right'):
+                cropper.set_property(side, 0)
+
+
+class Videoscale_Strategy(Videocrop_Strategy):
+    # The same videocrop; the videoscale after it needs nothing
+    name = 'videoscale'
+
+
+class Nvvidconv_Strategy:
+    """ nvvidconv takes the rectangle's edges as coordinates; all zero is the whole frame """
+
+    name = 'nvvidconv'
+
+    def apply(self, pipeline, device_uri, region, frame_size) -> bool:
+        cropper = pipeline.get_by_name('cropper')
+        if cropper is None:
+            return False
+        x, y, width, height = region
+        cropper.set_property('left', x)
+        cropper.set_property('top', y)
+        cropper.set_property('right', x + width)
+        cropper.set_property('bottom', y + height)
+        return True
+
+    def reset(self, pipeline, device_uri, frame_size):
+        Videocrop_Strategy().reset(pipeline, device_uri, frame_size)
+
+
+class V4L2_Strategy:
+    """ The driver crops; the region is mapped from the frame onto the crop bounds """
+
+    name = 'v4l2'
+
+    def __init__(self, open_device=Device_Transport):
+        self.open_device = open_device
+
+    def apply(self, pipeline, device_uri, region, frame_size) -> bool:
+        x, y, width, height = region
+        frame_width, frame_height = frame_size
+        try:
+            with self.open_device(device_uri) as transport:
+                device = V4L2_Device(transport)
+                bounds = device.get_selection(V4L2_SEL_TGT_CROP_BOUNDS)
+                scale_x, scale_y = bounds.width / frame_width, bounds.height / frame_height
+                device.set_crop(bounds.left + int(x * scale_x), bounds.top + int(y * scale_y),
+                                int(width * scale_x), int(height * scale_y))
+        except OSError as exc:
+            # EBUSY from most drivers while streaming
+            print(f"{device_uri} cannot crop the capture: {exc}")
+            return False
+        return True
+
+    def reset(self, pipeline, device_uri, frame_size):
+        try:
+            with self.open_device(device_uri) as transport:
+                device = V4L2_Device(transport)
+                default = device.get_selection(V4L2_SEL_TGT_CROP_DEFAULT)
+                device.set_crop(default.left, default.top, default.width, default.height)
+        except OSError:
+            pass
+
+
+# Each has a name, apply and reset as Videocrop_Strategy does
+CROP_STRATEGIES: Dict[str, object] = {strategy.name: strategy for strategy in
+                                      (V4L2_Strategy(), Nvvidconv_Strategy(),
+                                       Videocrop_Strategy(), Videoscale_Strategy())}
+
+
+def apply_crop(pipeline, strategies, device_uri: str, region: Tuple[int, int, int, int],
+               frame_size: Tuple[int, int]) -> str:
+    """ Crop with the first of strategies (names) that works; returns its name, or None
+    Pipelines from a hand edited command line have no strategies; their cropper is
+    taken to be a videocrop.
+    """
+    strategies = strategies or ['sink']
+    for name in strategies:
+        if CROP_STRATEGIES[name].apply(pipeline, device_uri, region, frame_size):
+            # A fallback may still hold an earlier region
+            for other in strategies:
+                if other != name:
+                    CROP_STRATEGIES[other].reset(pipeline, device_uri, frame_size)
+            return name
+    return None
+
+
+def reset_crop(pipeline, strategies, device_uri: str, frame_size: Tuple[int, int]):
+    for name in strategies or ['sink']:
+        CROP_STRATEGIES[name].reset(pipeline, device_uri, frame_size)
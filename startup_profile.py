@@ -0,0 +1,63 @@
+#
+#  Camera Capabilities
+#
+#  Copyright (C) 2021-2024 JetsonHacks (info@jetsonhacks.com)
+#
+#  MIT License
+#
+#  Startup profile
+#  camera_caps.py --profile-startup prints how long each startup phase took,
+#  to stderr, once the main window has been painted for the first time (or the
+#  dump has been written). Phases that run later, such as loading GStreamer for
+#  the first preview, are printed as they finish. Phases are always recorded;
+#  enabling only controls the printing. Import this module before any other so
+#  the import phase is measured from the start.
+#
+import sys
+import time
+from contextlib import contextmanager
+
+
+class Startup_Profile:
+
+    def __init__(self):
+        self.enabled = False
+        self.started = time.perf_counter()
+        self.last_mark = self.started
+        # (name, seconds) in the order they finished
+        self.phases = []
+        self.reported = False
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.last_mark = time.perf_counter()
+            self.add(name, self.last_mark - start)
+
+    def mark(self, name: str):
+        """ Record the time since the previous mark or phase (or since start) as a phase """
+        now = time.perf_counter()
+        self.add(name, now - self.last_mark)
+        self.last_mark = now
+
+    def add(self, name: str, seconds: float):
+        self.phases.append((name, seconds))
+        if self.enabled and self.reported:
+            print(f"startup: {name:<32} {seconds * 1000:>8.1f} ms (after startup)", file=sys.stderr)
+
+    def report(self):
+        if self.reported:
+            return
+        self.reported = True
+        if not self.enabled:
+            return
+        for name, seconds in self.phases:
+            print(f"startup: {name:<32} {seconds * 1000:>8.1f} ms", file=sys.stderr)
+        total = time.perf_counter() - self.started
+        print(f"startup: {'total':<32} {total * 1000:>8.1f} ms", file=sys.stderr)
+
+
+startup_profile = Startup_Profile()
@@ -0,0 +1,911 @@
+#
+#  Camera Capabilities
+#
+#  Copyright (C) 2021-2024 JetsonHacks (info@jetsonhacks.com)
+#
+#  MIT License
+#
+#  Native V4L2 ioctl layer
+#  Talks to /dev/videoN directly instead of spawning v4l2-ctl.
+#  The structures mirror linux/videodev2.h for the 64 bit ABI used on Jetson.
+#  A Transport is anything with an ioctl(request, arg) method; Device_Transport
+#  uses the real file descriptor, Fake_Transport answers from a Fake_Device
+#  description so the layer can be exercised without hardware.
+#
+import ctypes
+import errno
+import os
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+# ioctl request encoding, see asm-generic/ioctl.h
+_IOC_NRBITS = 8
+_IOC_TYPEBITS = 8
+_IOC_SIZEBITS = 14
+_IOC_NRSHIFT = 0
+_IOC_TYPESHIFT = _IOC_NRSHIFT + _IOC_NRBITS
+_IOC_SIZESHIFT = _IOC_TYPESHIFT + _IOC_TYPEBITS
+_IOC_DIRSHIFT = _IOC_SIZESHIFT + _IOC_SIZEBITS
+_IOC_WRITE = 1
+_IOC_READ = 2
+
+
+def _IOC(direction, ioc_type, number, size):
+    return ((direction << _IOC_DIRSHIFT) | (ord(ioc_type) << _IOC_TYPESHIFT) |
+            (number << _IOC_NRSHIFT) | (size << _IOC_SIZESHIFT))
+
+
+def _IOR(ioc_type, number, struct_type):
+    return _IOC(_IOC_READ, ioc_type, number, ctypes.sizeof(struct_type))
+
+
+def _IOW(ioc_type, number, struct_type):
+    return _IOC(_IOC_WRITE, ioc_type, number, ctypes.sizeof(struct_type))
+
+
+def _IOWR(ioc_type, number, struct_type):
+    return _IOC(_IOC_READ | _IOC_WRITE, ioc_type, number, ctypes.sizeof(struct_type))
+
+
+V4L2_BUF_TYPE_VIDEO_CAPTURE = 1
+V4L2_BUF_TYPE_VIDEO_CAPTURE_MPLANE = 9
+
+V4L2_FMT_FLAG_COMPRESSED = 0x0001
+V4L2_FMT_FLAG_EMULATED = 0x0002
+
+V4L2_FRMSIZE_TYPE_DISCRETE = 1
+V4L2_FRMSIZE_TYPE_CONTINUOUS = 2
+V4L2_FRMSIZE_TYPE_STEPWISE = 3
+
+V4L2_FRMIVAL_TYPE_DISCRETE = 1
+V4L2_FRMIVAL_TYPE_CONTINUOUS = 2
+V4L2_FRMIVAL_TYPE_STEPWISE = 3
+
+V4L2_CTRL_TYPE_INTEGER = 1
+V4L2_CTRL_TYPE_BOOLEAN = 2
+V4L2_CTRL_TYPE_MENU = 3
+V4L2_CTRL_TYPE_BUTTON = 4
+V4L2_CTRL_TYPE_INTEGER64 = 5
+V4L2_CTRL_TYPE_CTRL_CLASS = 6
+V4L2_CTRL_TYPE_STRING = 7
+V4L2_CTRL_TYPE_BITMASK = 8
+V4L2_CTRL_TYPE_INTEGER_MENU = 9
+V4L2_CTRL_TYPE_U8 = 0x0100
+V4L2_CTRL_TYPE_U16 = 0x0101
+V4L2_CTRL_TYPE_U32 = 0x0102
+V4L2_CTRL_TYPE_AREA = 0x0106
+
+V4L2_CTRL_FLAG_DISABLED = 0x0001
+V4L2_CTRL_FLAG_GRABBED = 0x0002
+V4L2_CTRL_FLAG_READ_ONLY = 0x0004
+V4L2_CTRL_FLAG_UPDATE = 0x0008
+V4L2_CTRL_FLAG_INACTIVE = 0x0010
+V4L2_CTRL_FLAG_SLIDER = 0x0020
+V4L2_CTRL_FLAG_WRITE_ONLY = 0x0040
+V4L2_CTRL_FLAG_VOLATILE = 0x0080
+V4L2_CTRL_FLAG_HAS_PAYLOAD = 0x0100
+V4L2_CTRL_FLAG_EXECUTE_ON_WRITE = 0x0200
+V4L2_CTRL_FLAG_MODIFY_LAYOUT = 0x0400
+V4L2_CTRL_FLAG_NEXT_CTRL = 0x80000000
+V4L2_CTRL_FLAG_NEXT_COMPOUND = 0x40000000
+
+V4L2_CTRL_WHICH_CUR_VAL = 0
+
+V4L2_SEL_TGT_CROP = 0x0000
+V4L2_SEL_TGT_CROP_DEFAULT = 0x0001
+V4L2_SEL_TGT_CROP_BOUNDS = 0x0002
+
+V4L2_EVENT_CTRL = 3
+V4L2_EVENT_CTRL_CH_VALUE = 0x0001
+V4L2_EVENT_CTRL_CH_FLAGS = 0x0002
+V4L2_EVENT_CTRL_CH_RANGE = 0x0004
+V4L2_EVENT_SUB_FL_SEND_INITIAL = 0x0001
+V4L2_EVENT_SUB_FL_ALLOW_FEEDBACK = 0x0002
+
+# Names as printed by v4l2-ctl, so both backends produce the same strings
+CTRL_TYPE_NAMES = {V4L2_CTRL_TYPE_INTEGER: 'int', V4L2_CTRL_TYPE_BOOLEAN: 'bool',
+                   V4L2_CTRL_TYPE_MENU: 'menu', V4L2_CTRL_TYPE_BUTTON: 'button',
+                   V4L2_CTRL_TYPE_INTEGER64: 'int64', V4L2_CTRL_TYPE_CTRL_CLASS: 'ctrl_class',
+                   V4L2_CTRL_TYPE_STRING: 'str', V4L2_CTRL_TYPE_BITMASK: 'bitmask',
+                   V4L2_CTRL_TYPE_INTEGER_MENU: 'intmenu', V4L2_CTRL_TYPE_U8: 'u8',
+                   V4L2_CTRL_TYPE_U16: 'u16', V4L2_CTRL_TYPE_U32: 'u32',
+                   V4L2_CTRL_TYPE_AREA: 'area'}
+
+CTRL_FLAG_NAMES = [(V4L2_CTRL_FLAG_DISABLED, 'disabled'), (V4L2_CTRL_FLAG_GRABBED, 'grabbed'),
+                   (V4L2_CTRL_FLAG_READ_ONLY, 'read-only'), (V4L2_CTRL_FLAG_UPDATE, 'update'),
+                   (V4L2_CTRL_FLAG_INACTIVE, 'inactive'), (V4L2_CTRL_FLAG_SLIDER, 'slider'),
+                   (V4L2_CTRL_FLAG_WRITE_ONLY, 'write-only'), (V4L2_CTRL_FLAG_VOLATILE, 'volatile'),
+                   (V4L2_CTRL_FLAG_HAS_PAYLOAD, 'has-payload'),
+                   (V4L2_CTRL_FLAG_EXECUTE_ON_WRITE, 'execute-on-write'),
+                   (V4L2_CTRL_FLAG_MODIFY_LAYOUT, 'modify-layout')]
+
+CAPABILITY_NAMES = [(0x00000001, 'Video Capture'), (0x00001000, 'Video Capture Multiplanar'),
+                    (0x00000002, 'Video Output'), (0x00002000, 'Video Output Multiplanar'),
+                    (0x00008000, 'Video Memory-to-Memory'),
+                    (0x00004000, 'Video Memory-to-Memory Multiplanar'),
+                    (0x00000004, 'Video Overlay'), (0x00000200, 'Video Output Overlay'),
+                    (0x00000010, 'VBI Capture'), (0x00000020, 'VBI Output'),
+                    (0x00000040, 'Sliced VBI Capture'), (0x00000080, 'Sliced VBI Output'),
+                    (0x00000100, 'RDS Capture'), (0x00000800, 'RDS Output'),
+                    (0x00100000, 'SDR Capture'), (0x00400000, 'SDR Output'),
+                    (0x00800000, 'Metadata Capture'), (0x08000000, 'Metadata Output'),
+                    (0x00010000, 'Tuner'), (0x10000000, 'Touch Device'),
+                    (0x00000400, 'HW Frequency Seek'), (0x00080000, 'Modulator'),
+                    (0x00020000, 'Audio'), (0x00040000, 'Radio'),
+                    (0x01000000, 'Read/Write'), (0x02000000, 'Async I/O'),
+                    (0x04000000, 'Streaming'), (0x00200000, 'Extended Pix Format'),
+                    (0x20000000, 'I/O MC'), (0x80000000, 'Device Capabilities')]
+
+
+class v4l2_capability(ctypes.Structure):
+    _fields_ = [('driver', ctypes.c_char * 16),
+                ('card', ctypes.c_char * 32),
+                ('bus_info', ctypes.c_char * 32),
+                ('version', ctypes.c_uint32),
+                ('capabilities', ctypes.c_uint32),
+                ('device_caps', ctypes.c_uint32),
+                ('reserved', ctypes.c_uint32 * 3)]
+
+
+class v4l2_fmtdesc(ctypes.Structure):
+    _fields_ = [('index', ctypes.c_uint32),
+                ('type', ctypes.c_uint32),
+                ('flags', ctypes.c_uint32),
+                ('description', ctypes.c_char * 32),
+                ('pixelformat', ctypes.c_uint32),
+                ('mbus_code', ctypes.c_uint32),
+                ('reserved', ctypes.c_uint32 * 3)]
+
+
+class v4l2_fract(ctypes.Structure):
+    _fields_ = [('numerator', ctypes.c_uint32),
+                ('denominator', ctypes.c_uint32)]
+
+
+class v4l2_frmsize_discrete(ctypes.Structure):
+    _fields_ = [('width', ctypes.c_uint32),
+                ('height', ctypes.c_uint32)]
+
+
+class v4l2_frmsize_stepwise(ctypes.Structure):
+    _fields_ = [('min_width', ctypes.c_uint32),
+                ('max_width', ctypes.c_uint32),
+                ('step_width', ctypes.c_uint32),
+                ('min_height', ctypes.c_uint32),
+                ('max_height', ctypes.c_uint32),
+                ('step_height', ctypes.c_uint32)]
+
+
+class _frmsize_union(ctypes.Union):
+    _fields_ = [('discrete', v4l2_frmsize_discrete),
+                ('stepwise', v4l2_frmsize_stepwise)]
+
+
+class v4l2_frmsizeenum(ctypes.Structure):
+    _anonymous_ = ('u',)
+    _fields_ = [('index', ctypes.c_uint32),
+                ('pixel_format', ctypes.c_uint32),
+                ('type', ctypes.c_uint32),
+                ('u', _frmsize_union),
+                ('reserved', ctypes.c_uint32 * 2)]
+
+
+class v4l2_frmival_stepwise(ctypes.Structure):
+    _fields_ = [('min', v4l2_fract),
+                ('max', v4l2_fract),
+                ('step', v4l2_fract)]
+
+
+class _frmival_union(ctypes.Union):
+    _fields_ = [('discrete', v4l2_fract),
+                ('stepwise', v4l2_frmival_stepwise)]
+
+
+class v4l2_frmivalenum(ctypes.Structure):
+    _anonymous_ = ('u',)
+    _fields_ = [('index', ctypes.c_uint32),
+                ('pixel_format', ctypes.c_uint32),
+                ('width', ctypes.c_uint32),
+                ('height', ctypes.c_uint32),
+                ('type', ctypes.c_uint32),
+                ('u', _frmival_union),
+                ('reserved', ctypes.c_uint32 * 2)]
+
+
+class v4l2_query_ext_ctrl(ctypes.Structure):
+    _fields_ = [('id', ctypes.c_uint32),
+                ('type', ctypes.c_uint32),
+                ('name', ctypes.c_char * 32),
+                ('minimum', ctypes.c_int64),
+                ('maximum', ctypes.c_int64),
+                ('step', ctypes.c_uint64),
+                ('default_value', ctypes.c_int64),
+                ('flags', ctypes.c_uint32),
+                ('elem_size', ctypes.c_uint32),
+                ('elems', ctypes.c_uint32),
+                ('nr_of_dims', ctypes.c_uint32),
+                ('dims', ctypes.c_uint32 * 4),
+                ('reserved', ctypes.c_uint32 * 32)]
+
+
+class _querymenu_union(ctypes.Union):
+    _pack_ = 1
+    _fields_ = [('name', ctypes.c_char * 32),
+                ('value', ctypes.c_int64)]
+
+
+class v4l2_querymenu(ctypes.Structure):
+    _pack_ = 1
+    _anonymous_ = ('u',)
+    _fields_ = [('id', ctypes.c_uint32),
+                ('index', ctypes.c_uint32),
+                ('u', _querymenu_union),
+                ('reserved', ctypes.c_uint32)]
+
+
+class _ext_control_union(ctypes.Union):
+    _pack_ = 1
+    _fields_ = [('value', ctypes.c_int32),
+                ('value64', ctypes.c_int64),
+                ('ptr', ctypes.c_void_p)]
+
+
+class v4l2_ext_control(ctypes.Structure):
+    _pack_ = 1
+    _anonymous_ = ('u',)
+    _fields_ = [('id', ctypes.c_uint32),
+                ('size', ctypes.c_uint32),
+                ('reserved2', ctypes.c_uint32 * 1),
+                ('u', _ext_control_union)]
+
+
+class v4l2_ext_controls(ctypes.Structure):
+    _fields_ = [('which', ctypes.c_uint32),
+                ('count', ctypes.c_uint32),
+                ('error_idx', ctypes.c_uint32),
+                ('request_fd', ctypes.c_int32),
+                ('reserved', ctypes.c_uint32 * 1),
+                ('controls', ctypes.POINTER(v4l2_ext_control))]
+
+
+class v4l2_pix_format(ctypes.Structure):
+    _fields_ = [('width', ctypes.c_uint32),
+                ('height', ctypes.c_uint32),
+                ('pixelformat', ctypes.c_uint32),
+                ('field', ctypes.c_uint32),
+                ('bytesperline', ctypes.c_uint32),
+                ('sizeimage', ctypes.c_uint32),
+                ('colorspace', ctypes.c_uint32),
+                ('priv', ctypes.c_uint32),
+                ('flags', ctypes.c_uint32),
+                ('ycbcr_enc', ctypes.c_uint32),
+                ('quantization', ctypes.c_uint32),
+                ('xfer_func', ctypes.c_uint32)]
+
+
+class _format_union(ctypes.Union):
+    # The kernel union holds structures with pointers, which forces 8 byte alignment
+    _fields_ = [('pix', v4l2_pix_format),
+                ('raw_data', ctypes.c_uint8 * 200),
+                ('_align', ctypes.c_void_p)]
+
+
+class v4l2_format(ctypes.Structure):
+    _fields_ = [('type', ctypes.c_uint32),
+                ('fmt', _format_union)]
+
+
+class v4l2_captureparm(ctypes.Structure):
+    _fields_ = [('capability', ctypes.c_uint32),
+                ('capturemode', ctypes.c_uint32),
+                ('timeperframe', v4l2_fract),
+                ('extendedmode', ctypes.c_uint32),
+                ('readbuffers', ctypes.c_uint32),
+                ('reserved', ctypes.c_uint32 * 4)]
+
+
+class _streamparm_union(ctypes.Union):
+    _fields_ = [('capture', v4l2_captureparm),
+                ('raw_data', ctypes.c_uint8 * 200)]
+
+
+class v4l2_streamparm(ctypes.Structure):
+    _fields_ = [('type', ctypes.c_uint32),
+                ('parm', _streamparm_union)]
+
+
+class v4l2_rect(ctypes.Structure):
+    _fields_ = [('left', ctypes.c_int32),
+                ('top', ctypes.c_int32),
+                ('width', ctypes.c_uint32),
+                ('height', ctypes.c_uint32)]
+
+
+class v4l2_selection(ctypes.Structure):
+    _fields_ = [('type', ctypes.c_uint32),
+                ('target', ctypes.c_uint32),
+                ('flags', ctypes.c_uint32),
+                ('r', v4l2_rect),
+                ('reserved', ctypes.c_uint32 * 9)]
+
+
+class v4l2_event_subscription(ctypes.Structure):
+    _fields_ = [('type', ctypes.c_uint32),
+                ('id', ctypes.c_uint32),
+                ('flags', ctypes.c_uint32),
+                ('reserved', ctypes.c_uint32 * 5)]
+
+
+class _event_ctrl_value(ctypes.Union):
+    _fields_ = [('value', ctypes.c_int32),
+                ('value64', ctypes.c_int64)]
+
+
+class v4l2_event_ctrl(ctypes.Structure):
+    _anonymous_ = ('u',)
+    _fields_ = [('changes', ctypes.c_uint32),
+                ('type', ctypes.c_uint32),
+                ('u', _event_ctrl_value),
+                ('flags', ctypes.c_uint32),
+                ('minimum', ctypes.c_int32),
+                ('maximum', ctypes.c_int32),
+                ('step', ctypes.c_int32),
+                ('default_value', ctypes.c_int32)]
+
+
+class _event_union(ctypes.Union):
+    _fields_ = [('ctrl', v4l2_event_ctrl),
+                ('data', ctypes.c_uint8 * 64)]
+
+
+class timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long),
+                ('tv_nsec', ctypes.c_long)]
+
+
+class v4l2_event(ctypes.Structure):
+    _fields_ = [('type', ctypes.c_uint32),
+                ('u', _event_union),
+                ('pending', ctypes.c_uint32),
+                ('sequence', ctypes.c_uint32),
+                ('timestamp', timespec),
+                ('id', ctypes.c_uint32),
+                ('reserved', ctypes.c_uint32 * 8)]
+
+
+VIDIOC_QUERYCAP = _IOR('V', 0, v4l2_capability)
+VIDIOC_ENUM_FMT = _IOWR('V', 2, v4l2_fmtdesc)
+VIDIOC_G_FMT = _IOWR('V', 4, v4l2_format)
+VIDIOC_G_PARM = _IOWR('V', 21, v4l2_streamparm)
+VIDIOC_QUERYMENU = _IOWR('V', 37, v4l2_querymenu)
+VIDIOC_G_EXT_CTRLS = _IOWR('V', 71, v4l2_ext_controls)
+VIDIOC_S_EXT_CTRLS = _IOWR('V', 72, v4l2_ext_controls)
+VIDIOC_ENUM_FRAMESIZES = _IOWR('V', 74, v4l2_frmsizeenum)
+VIDIOC_ENUM_FRAMEINTERVALS = _IOWR('V', 75, v4l2_frmivalenum)
+VIDIOC_DQEVENT = _IOR('V', 89, v4l2_event)
+VIDIOC_G_SELECTION = _IOWR('V', 94, v4l2_selection)
+VIDIOC_S_SELECTION = _IOWR('V', 95, v4l2_selection)
+VIDIOC_SUBSCRIBE_EVENT = _IOW('V', 90, v4l2_event_subscription)
+VIDIOC_UNSUBSCRIBE_EVENT = _IOW('V', 91, v4l2_event_subscription)
+VIDIOC_QUERY_EXT_CTRL = _IOWR('V', 103, v4l2_query_ext_ctrl)
+
+
+def fourcc_to_string(pixelformat: int) -> str:
+    """ Four character code as printed by v4l2-ctl, e.g. 0x56595559 -> 'YUYV' """
+    chars = [chr((pixelformat >> shift) & 0x7f) for shift in (0, 8, 16, 24)]
+    to_return = "".join(chars)
+    if pixelformat & (1 << 31):
+        to_return += '-BE'
+    return to_return
+
+
+def string_to_fourcc(fourcc: str) -> int:
+    fourcc = fourcc.ljust(4)[:4]
+    return (ord(fourcc[0]) | (ord(fourcc[1]) << 8) |
+            (ord(fourcc[2]) << 16) | (ord(fourcc[3]) << 24))
+
+
+def control_name_to_title(name: str) -> str:
+    """ 'Exposure, Auto Priority' -> 'exposure_auto_priority', same as v4l2-ctl name2var """
+    return "_".join(re.findall(r'[a-z0-9]+', name.lower()))
+
+
+def flags_to_names(flags: int, flag_names) -> List[str]:
+    return [name for bit, name in flag_names if flags & bit]
+
+
+def decode_version(version: int) -> str:
+    return f"{version >> 16}.{(version >> 8) & 0xff}.{version & 0xff}"
+
+
+class Device_Transport:
+    """ Issues ioctls against an open V4L2 device node """
+
+    def __init__(self, uri: str):
+        self.uri = uri
+        self.fd = os.open(uri, os.O_RDWR | os.O_NONBLOCK)
+
+    def ioctl(self, request: int, arg):
+        import fcntl
+        while True:
+            try:
+                fcntl.ioctl(self.fd, request, arg, True)
+                return arg
+            except InterruptedError:
+                continue
+
+    def fileno(self):
+        return self.fd
+
+    def wait_for_event(self, timeout: float) -> bool:
+        """ True when an event is ready for VIDIOC_DQEVENT; V4L2 signals events as POLLPRI """
+        import select
+        _, _, exceptional = select.select([], [], [self.fd], timeout)
+        return len(exceptional) > 0
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class Device_Registry:
+    """ Finds the V4L2 device nodes on this machine and opens them """
+
+    def __init__(self, dev_root: str = '/dev'):
+        self.dev_root = dev_root
+
+    def nodes(self) -> List[str]:
+        try:
+            names = [name for name in os.listdir(self.dev_root)
+                     if re.fullmatch(r'video\d+', name)]
+        except OSError:
+            return []
+        names.sort(key=lambda name: int(name[5:]))
+        return [os.path.join(self.dev_root, name) for name in names]
+
+    def open(self, uri: str):
+        return Device_Transport(uri)
+
+
+@dataclass
+class Fake_Control:
+    id: int = 0
+    type: int = V4L2_CTRL_TYPE_INTEGER
+    name: str = ""
+    minimum: int = 0
+    maximum: int = 0
+    step: int = 1
+    default_value: int = 0
+    flags: int = 0
+    value: int = 0
+    # Menu index -> name (menu) or value (intmenu)
+    menu: Dict[int, object] = field(default_factory=dict)
+
+
+@dataclass
+class Fake_Format:
+    fourcc: str = "YUYV"
+    description: str = ""
+    flags: int = 0
+    # (width, height) -> [(numerator, denominator), ...]
+    sizes: Dict[Tuple[int, int], List[Tuple[int, int]]] = field(default_factory=dict)
+    # (min_width, max_width, step_width, min_height, max_height, step_height) replaces sizes
+    size_range: Tuple[int, int, int, int, int, int] = None
+    # ((numerator, denominator) min, max, step) for every size in size_range; step (0, 0) is continuous
+    interval_range: Tuple[Tuple[int, int], Tuple[int, int], Tuple[int, int]] = None
+
+
+@dataclass
+class Fake_Device:
+    driver: str = "uvcvideo"
+    card: str = ""
+    bus_info: str = ""
+    version: int = 0x050a78
+    capabilities: int = 0x84a00001
+    device_caps: int = 0x04200001
+    formats: List[Fake_Format] = field(default_factory=list)
+    controls: List[Fake_Control] = field(default_factory=list)
+    # Current format: (fourcc, width, height), and frame interval
+    current_format: Tuple[str, int, int] = ("YUYV", 640, 480)
+    current_interval: Tuple[int, int] = (1, 30)
+    supports_events: bool = True
+    # (left, top, width, height) the sensor can crop within; None when the driver cannot crop
+    crop_bounds: Tuple[int, int, int, int] = None
+    crop: Tuple[int, int, int, int] = None
+    # Open Fake_Transports; control events reach every subscribed file handle
+    transports: list = field(default_factory=list, repr=False)
+
+    def change_control(self, ctrl_id: int, value: int = None, flags: int = None):
+        """ Change a control as another program would, raising control events """
+        changes = 0
+        for control in self.controls:
+            if control.id != ctrl_id:
+                continue
+            if value is not None and value != control.value:
+                control.value = value
+                changes |= V4L2_EVENT_CTRL_CH_VALUE
+            if flags is not None and flags != control.flags:
+                control.flags = flags
+                changes |= V4L2_EVENT_CTRL_CH_FLAGS
+            if changes:
+                for transport in self.transports:
+                    transport.queue_control_event(control, changes)
+
+
+@dataclass
+class Fake_Control_Event:
+    id: int = 0
+    changes: int = V4L2_EVENT_CTRL_CH_VALUE
+    value: int = 0
+    flags: int = 0
+
+
+class Fake_Transport:
+    """ Answers ioctls from a Fake_Device, for testing without hardware """
+
+    def __init__(self, device: Fake_Device):
+        self.device = device
+        self.calls = []
+        self.subscriptions = set()
+        # Fake_Control_Events waiting to be dequeued; tests may append to it directly
+        self.events = []
+        device.transports.append(self)
+
+    def queue_control_event(self, control: Fake_Control, changes: int):
+        if control.id in self.subscriptions:
+            self.events.append(Fake_Control_Event(control.id, changes, control.value, control.flags))
+
+    def _fail(self, code):
+        raise OSError(code, os.strerror(code))
+
+    def _find_format(self, pixelformat):
+        for fake_format in self.device.formats:
+            if string_to_fourcc(fake_format.fourcc) == pixelformat:
+                return fake_format
+        self._fail(errno.EINVAL)
+
+    def _find_control(self, ctrl_id):
+        for control in self.device.controls:
+            if control.id == ctrl_id:
+                return control
+        self._fail(errno.EINVAL)
+
+    def ioctl(self, request: int, arg):
+        self.calls.append(request)
+        device = self.device
+        if request == VIDIOC_QUERYCAP:
+            arg.driver = device.driver.encode()
+            arg.card = device.card.encode()
+            arg.bus_info = device.bus_info.encode()
+            arg.version = device.version
+            arg.capabilities = device.capabilities
+            arg.device_caps = device.device_caps
+        elif request == VIDIOC_ENUM_FMT:
+            if arg.type != V4L2_BUF_TYPE_VIDEO_CAPTURE or arg.index >= len(device.formats):
+                self._fail(errno.EINVAL)
+            fake_format = device.formats[arg.index]
+            arg.pixelformat = string_to_fourcc(fake_format.fourcc)
+            arg.description = fake_format.description.encode()
+            arg.flags = fake_format.flags
+        elif request == VIDIOC_ENUM_FRAMESIZES:
+            fake_format = self._find_format(arg.pixel_format)
+            if fake_format.size_range is not None:
+                if arg.index > 0:
+                    self._fail(errno.EINVAL)
+                step_width, step_height = fake_format.size_range[2], fake_format.size_range[5]
+                arg.type = V4L2_FRMSIZE_TYPE_STEPWISE
+                if step_width == 1 and step_height == 1:
+                    arg.type = V4L2_FRMSIZE_TYPE_CONTINUOUS
+                (arg.stepwise.min_width, arg.stepwise.max_width, arg.stepwise.step_width,
+                 arg.stepwise.min_height, arg.stepwise.max_height, arg.stepwise.step_height) = fake_format.size_range
+                return arg
+            sizes = list(fake_format.sizes)
+            if arg.index >= len(sizes):
+                self._fail(errno.EINVAL)
+            arg.type = V4L2_FRMSIZE_TYPE_DISCRETE
+            arg.discrete.width, arg.discrete.height = sizes[arg.index]
+        elif request == VIDIOC_ENUM_FRAMEINTERVALS:
+            fake_format = self._find_format(arg.pixel_format)
+            if fake_format.interval_range is not None:
+                if arg.index > 0:
+                    self._fail(errno.EINVAL)
+                minimum, maximum, step = fake_format.interval_range
+                arg.type = V4L2_FRMIVAL_TYPE_STEPWISE
+                if step == (0, 0):
+                    arg.type = V4L2_FRMIVAL_TYPE_CONTINUOUS
+                    step = (1, 1)
+                arg.stepwise.min.numerator, arg.stepwise.min.denominator = minimum
+                arg.stepwise.max.numerator, arg.stepwise.max.denominator = maximum
+                arg.stepwise.step.numerator, arg.stepwise.step.denominator = step
+                return arg
+            sizes = fake_format.sizes
+            intervals = sizes.get((arg.width, arg.height))
+            if intervals is None or arg.index >= len(intervals):
+                self._fail(errno.EINVAL)
+            arg.type = V4L2_FRMIVAL_TYPE_DISCRETE
+            arg.discrete.numerator, arg.discrete.denominator = intervals[arg.index]
+        elif request == VIDIOC_QUERY_EXT_CTRL:
+            ctrl_id = arg.id
+            if ctrl_id & (V4L2_CTRL_FLAG_NEXT_CTRL | V4L2_CTRL_FLAG_NEXT_COMPOUND):
+                base_id = ctrl_id & ~(V4L2_CTRL_FLAG_NEXT_CTRL | V4L2_CTRL_FLAG_NEXT_COMPOUND)
+                following = [control for control in device.controls if control.id > base_id]
+                if len(following) == 0:
+                    self._fail(errno.EINVAL)
+                control = min(following, key=lambda control: control.id)
+            else:
+                control = self._find_control(ctrl_id)
+            arg.id = control.id
+            arg.type = control.type
+            arg.name = control.name.encode()
+            arg.minimum = control.minimum
+            arg.maximum = control.maximum
+            arg.step = control.step
+            arg.default_value = control.default_value
+            arg.flags = control.flags
+            arg.elem_size = 8 if control.type == V4L2_CTRL_TYPE_INTEGER64 else 4
+            arg.elems = 1
+        elif request == VIDIOC_QUERYMENU:
+            control = self._find_control(arg.id)
+            if arg.index not in control.menu:
+                self._fail(errno.EINVAL)
+            entry = control.menu[arg.index]
+            if control.type == V4L2_CTRL_TYPE_INTEGER_MENU:
+                arg.value = entry
+            else:
+                arg.name = str(entry).encode()
+        elif request in (VIDIOC_G_EXT_CTRLS, VIDIOC_S_EXT_CTRLS):
+            for index in range(arg.count):
+                ext_control = arg.controls[index]
+                control = self._find_control(ext_control.id)
+                if request == VIDIOC_G_EXT_CTRLS:
+                    if control.flags & V4L2_CTRL_FLAG_WRITE_ONLY:
+                        arg.error_idx = index
+                        self._fail(errno.EACCES)
+                    if control.type == V4L2_CTRL_TYPE_INTEGER64:
+                        ext_control.value64 = control.value
+                    else:
+                        ext_control.value = control.value
+                else:
+                    if control.flags & V4L2_CTRL_FLAG_READ_ONLY:
+                        arg.error_idx = index
+                        self._fail(errno.EACCES)
+                    if control.type == V4L2_CTRL_TYPE_INTEGER64:
+                        control.value = ext_control.value64
+                    else:
+                        control.value = ext_control.value
+                    for transport in device.transports:
+                        transport.queue_control_event(control, V4L2_EVENT_CTRL_CH_VALUE)
+        elif request == VIDIOC_G_FMT:
+            fourcc, width, height = device.current_format
+            arg.fmt.pix.pixelformat = string_to_fourcc(fourcc)
+            arg.fmt.pix.width = width
+            arg.fmt.pix.height = height
+        elif request == VIDIOC_G_PARM:
+            arg.parm.capture.timeperframe.numerator, \
+                arg.parm.capture.timeperframe.denominator = device.current_interval
+        elif request in (VIDIOC_G_SELECTION, VIDIOC_S_SELECTION):
+            if device.crop_bounds is None:
+                self._fail(errno.ENOTTY)
+            if arg.target not in (V4L2_SEL_TGT_CROP, V4L2_SEL_TGT_CROP_DEFAULT, V4L2_SEL_TGT_CROP_BOUNDS) or \
+                    (request == VIDIOC_S_SELECTION and arg.target != V4L2_SEL_TGT_CROP):
+                self._fail(errno.EINVAL)
+            bounds_left, bounds_top, bounds_width, bounds_height = device.crop_bounds
+            if request == VIDIOC_S_SELECTION:
+                # Adjusted to fit the bounds, as drivers do
+                left = min(max(arg.r.left, bounds_left), bounds_left + bounds_width - 1)
+                top = min(max(arg.r.top, bounds_top), bounds_top + bounds_height - 1)
+                device.crop = (left, top, max(1, min(arg.r.width, bounds_left + bounds_width - left)),
+                               max(1, min(arg.r.height, bounds_top + bounds_height - top)))
+            rect = device.crop if arg.target == V4L2_SEL_TGT_CROP and device.crop is not None \
+                else device.crop_bounds
+            arg.r.left, arg.r.top, arg.r.width, arg.r.height = rect
+        elif request in (VIDIOC_SUBSCRIBE_EVENT, VIDIOC_UNSUBSCRIBE_EVENT):
+            if not device.supports_events or arg.type != V4L2_EVENT_CTRL:
+                self._fail(errno.ENOTTY)
+            control = self._find_control(arg.id)
+            if request == VIDIOC_UNSUBSCRIBE_EVENT:
+                self.subscriptions.discard(control.id)
+            else:
+                self.subscriptions.add(control.id)
+                if arg.flags & V4L2_EVENT_SUB_FL_SEND_INITIAL:
+                    self.queue_control_event(control, V4L2_EVENT_CTRL_CH_VALUE | V4L2_EVENT_CTRL_CH_FLAGS)
+        elif request == VIDIOC_DQEVENT:
+            if len(self.events) == 0:
+                self._fail(errno.ENOENT)
+            event = self.events.pop(0)
+            arg.type = V4L2_EVENT_CTRL
+            arg.id = event.id
+            arg.u.ctrl.type = self._find_control(event.id).type
+            arg.u.ctrl.changes = event.changes
+            arg.u.ctrl.value64 = event.value
+            arg.u.ctrl.flags = event.flags
+            arg.pending = len(self.events)
+        else:
+            self._fail(errno.ENOTTY)
+        return arg
+
+    def fileno(self):
+        return -1
+
+    def wait_for_event(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while len(self.events) == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return len(self.events) > 0
+
+    def close(self):
+        if self in self.device.transports:
+            self.device.transports.remove(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class Fake_Device_Registry:
+    """ Maps device uris to Fake_Devices; same interface as Device_Registry """
+
+    def __init__(self, devices: Dict[str, Fake_Device]):
+        self.devices = devices
+        self.transports = []
+
+    def nodes(self) -> List[str]:
+        return sorted(self.devices, key=lambda uri: int(re.sub(r'\D', '', uri) or 0))
+
+    def open(self, uri: str):
+        if uri not in self.devices:
+            raise OSError(errno.ENOENT, os.strerror(errno.ENOENT), uri)
+        transport = Fake_Transport(self.devices[uri])
+        self.transports.append(transport)
+        return transport
+
+
+class V4L2_Device:
+    """ The queries Camera_Inspector needs, expressed as ioctls on a transport """
+
+    def __init__(self, transport):
+        self.transport = transport
+
+    def query_capabilities(self) -> v4l2_capability:
+        return self.transport.ioctl(VIDIOC_QUERYCAP, v4l2_capability())
+
+    def enum_formats(self, buf_type: int = V4L2_BUF_TYPE_VIDEO_CAPTURE):
+        index = 0
+        while True:
+            fmtdesc = v4l2_fmtdesc(index=index, type=buf_type)
+            try:
+                self.transport.ioctl(VIDIOC_ENUM_FMT, fmtdesc)
+            except OSError as exc:
+                if exc.errno == errno.EINVAL:
+                    return
+                raise
+            yield fmtdesc
+            index += 1
+
+    def enum_frame_sizes(self, pixelformat: int):
+        index = 0
+        while True:
+            frmsize = v4l2_frmsizeenum(index=index, pixel_format=pixelformat)
+            try:
+                self.transport.ioctl(VIDIOC_ENUM_FRAMESIZES, frmsize)
+            except OSError as exc:
+                if exc.errno == errno.EINVAL:
+                    return
+                raise
+            yield frmsize
+            # Stepwise and continuous sizes are reported once, at index 0
+            if frmsize.type != V4L2_FRMSIZE_TYPE_DISCRETE:
+                return
+            index += 1
+
+    def enum_frame_intervals(self, pixelformat: int, width: int, height: int):
+        index = 0
+        while True:
+            frmival = v4l2_frmivalenum(index=index, pixel_format=pixelformat,
+                                       width=width, height=height)
+            try:
+                self.transport.ioctl(VIDIOC_ENUM_FRAMEINTERVALS, frmival)
+            except OSError as exc:
+                if exc.errno == errno.EINVAL:
+                    return
+                raise
+            yield frmival
+            if frmival.type != V4L2_FRMIVAL_TYPE_DISCRETE:
+                return
+            index += 1
+
+    def query_controls(self):
+        ctrl_id = V4L2_CTRL_FLAG_NEXT_CTRL | V4L2_CTRL_FLAG_NEXT_COMPOUND
+        while True:
+            query = v4l2_query_ext_ctrl(id=ctrl_id)
+            try:
+                self.transport.ioctl(VIDIOC_QUERY_EXT_CTRL, query)
+            except OSError as exc:
+                if exc.errno == errno.EINVAL:
+                    return
+                raise
+            yield query
+            ctrl_id = query.id | V4L2_CTRL_FLAG_NEXT_CTRL | V4L2_CTRL_FLAG_NEXT_COMPOUND
+
+    def query_menu(self, query: v4l2_query_ext_ctrl):
+        """ Return [index, name] pairs for a menu or integer menu control """
+        to_return = []
+        for index in range(query.minimum, query.maximum + 1):
+            querymenu = v4l2_querymenu(id=query.id, index=index)
+            try:
+                self.transport.ioctl(VIDIOC_QUERYMENU, querymenu)
+            except OSError as exc:
+                # Menus may have holes
+                if exc.errno == errno.EINVAL:
+                    continue
+                raise
+            if query.type == V4L2_CTRL_TYPE_INTEGER_MENU:
+                to_return.append([str(index), f"{querymenu.value} (0x{querymenu.value & 0xffffffffffffffff:x})"])
+            else:
+                to_return.append([str(index), querymenu.name.decode(errors='replace')])
+        return to_return
+
+    def get_control(self, ctrl_id: int, int64: bool = False) -> int:
+        ext_control = v4l2_ext_control(id=ctrl_id)
+        ext_controls = v4l2_ext_controls(which=V4L2_CTRL_WHICH_CUR_VAL, count=1,
+                                         controls=ctypes.pointer(ext_control))
+        self.transport.ioctl(VIDIOC_G_EXT_CTRLS, ext_controls)
+        if int64:
+            return ext_control.value64
+        return ext_control.value
+
+    def set_controls(self, values: Dict[int, int], int64_ids=()) -> None:
+        """ Set several controls in a single VIDIOC_S_EXT_CTRLS call """
+        array = (v4l2_ext_control * len(values))()
+        for index, (ctrl_id, value) in enumerate(values.items()):
+            array[index].id = ctrl_id
+            if ctrl_id in int64_ids:
+                array[index].value64 = int(value)
+            else:
+                array[index].value = int(value)
+        ext_controls = v4l2_ext_controls(which=V4L2_CTRL_WHICH_CUR_VAL, count=len(values),
+                                         controls=array)
+        self.transport.ioctl(VIDIOC_S_EXT_CTRLS, ext_controls)
+
+    def get_format(self, buf_type: int = V4L2_BUF_TYPE_VIDEO_CAPTURE) -> v4l2_format:
+        return self.transport.ioctl(VIDIOC_G_FMT, v4l2_format(type=buf_type))
+
+    def get_stream_parameters(self, buf_type: int = V4L2_BUF_TYPE_VIDEO_CAPTURE) -> v4l2_streamparm:
+        return self.transport.ioctl(VIDIOC_G_PARM, v4l2_streamparm(type=buf_type))
+
+    def get_selection(self, target: int = V4L2_SEL_TGT_CROP,
+                      buf_type: int = V4L2_BUF_TYPE_VIDEO_CAPTURE) -> v4l2_rect:
+        return self.transport.ioctl(VIDIOC_G_SELECTION, v4l2_selection(type=buf_type, target=target)).r
+
+    def set_crop(self, left: int, top: int, width: int, height: int,
+                 buf_type: int = V4L2_BUF_TYPE_VIDEO_CAPTURE) -> v4l2_rect:
+        """ Set the capture crop rectangle; returns the one the driver chose """
+        selection = v4l2_selection(type=buf_type, target=V4L2_SEL_TGT_CROP,
+                                   r=v4l2_rect(left, top, width, height))
+        return self.transport.ioctl(VIDIOC_S_SELECTION, selection).r
+
+    def subscribe_control_events(self, ctrl_id: int, flags: int = 0) -> None:
+        subscription = v4l2_event_subscription(type=V4L2_EVENT_CTRL, id=ctrl_id, flags=flags)
+        self.transport.ioctl(VIDIOC_SUBSCRIBE_EVENT, subscription)
+
+    def dequeue_event(self):
+        """ Return the next pending v4l2_event, or None when there is none """
+        event = v4l2_event()
+        try:
+            self.transport.ioctl(VIDIOC_DQEVENT, event)
+        except OSError as exc:
+            if exc.errno == errno.ENOENT:
+                return None
+            raise
+        return event